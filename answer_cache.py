@@ -0,0 +1,105 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Dict, Any, Tuple, FrozenSet
+import numpy as np
+from models.schemas import RespostaOutput
+
+class CacheRespostas:
+    """
+    Cache semântico de respostas do modelo.
+
+    Uma resposta é reaproveitada quando a pergunta tem embedding próximo o suficiente de uma
+    pergunta anterior, os chunks recuperados são os mesmos e a agenda não mudou. Mudanças no
+    índice vetorial ou na agenda descartam todas as entradas.
+    """
+
+    def __init__(self, max_itens: int, limiar: float, ttl: float):
+        self.max_itens = max_itens
+        self.limiar = limiar
+        self.ttl = ttl
+        self._itens: "OrderedDict[int, Tuple[float, np.ndarray, FrozenSet[str], RespostaOutput]]" = OrderedDict()
+        self._proximo = 0
+        self._versao_indice = None
+        self._impressao_calendario = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidacoes = 0
+
+    @staticmethod
+    def impressao(texto: Optional[str]) -> str:
+        """Resume o contexto de calendário em uma chave curta."""
+        return hashlib.sha256((texto or "").encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _normalizar(vetor: List[float]) -> np.ndarray:
+        vetor = np.asarray(vetor, dtype=np.float32)
+        return vetor / (np.linalg.norm(vetor) or 1)
+
+    def _validar(self, versao_indice: Any, impressao_calendario: str):
+        """Descarta as entradas se o índice ou a agenda mudaram desde o último acesso."""
+        if (versao_indice, impressao_calendario) != (self._versao_indice, self._impressao_calendario):
+            if self._itens:
+                self.invalidacoes += 1
+                self._itens.clear()
+            self._versao_indice = versao_indice
+            self._impressao_calendario = impressao_calendario
+
+    def buscar(self, vetor: List[float], ids: List[str], versao_indice: Any,
+               impressao_calendario: str) -> Optional[RespostaOutput]:
+        """Retorna a resposta armazenada para uma pergunta equivalente, se houver."""
+        consulta = self._normalizar(vetor)
+        chunks = frozenset(ids)
+        agora = time.monotonic()
+
+        with self._lock:
+            self._validar(versao_indice, impressao_calendario)
+            melhor, similaridade = None, self.limiar
+            for chave, (criado, vetor_salvo, chunks_salvos, _) in list(self._itens.items()):
+                if agora - criado > self.ttl:
+                    del self._itens[chave]
+                    continue
+                if chunks_salvos != chunks:
+                    continue
+                valor = float(vetor_salvo @ consulta)
+                if valor >= similaridade:
+                    melhor, similaridade = chave, valor
+
+            if melhor is None:
+                self.misses += 1
+                return None
+            self._itens.move_to_end(melhor)
+            self.hits += 1
+            return self._itens[melhor][3]
+
+    def armazenar(self, vetor: List[float], ids: List[str], versao_indice: Any,
+                  impressao_calendario: str, resposta: RespostaOutput):
+        with self._lock:
+            self._validar(versao_indice, impressao_calendario)
+            self._itens[self._proximo] = (
+                time.monotonic(), self._normalizar(vetor), frozenset(ids), resposta)
+            self._proximo += 1
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def invalidar(self):
+        """Descarta todas as respostas armazenadas."""
+        with self._lock:
+            if self._itens:
+                self.invalidacoes += 1
+                self._itens.clear()
+
+    def estatisticas(self) -> Dict[str, Any]:
+        """Retorna os contadores de uso do cache."""
+        total = self.hits + self.misses
+        return {
+            "entradas": len(self._itens),
+            "capacidade": self.max_itens,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidacoes": self.invalidacoes,
+            "taxa_acerto": self.hits / total if total else 0.0,
+        }
@@ -1,10 +1,17 @@
 import time
 import sys
+import uuid
 import json
+import asyncio
 from agents.essentialist_agent import EssentialistAgent
+from services.index_watcher import IndexWatcher
+from services.calendar_mirror import SincronizadorCalendario
+from services.llm_scheduler import agendador_modelo, FilaCheiaError, TempoFilaEsgotadoError
+from utils.tracing import iniciar_rastro, obter_rastro, exportar_prometheus
+from config import WATCH_DOCS, LLM_WARMUP
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from pydantic import BaseModel, Field
 from typing import Optional
 import uvicorn
@@ -24,27 +31,70 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id"],
 )
 
+@app.middleware("http")
+async def rastrear_requisicao(request: Request, call_next):
+    """Associa cada requisição a um rastro, identificado pelo cabeçalho X-Trace-Id."""
+    if request.url.path == "/metrics":
+        return await call_next(request)
+    with iniciar_rastro(request.headers.get("X-Trace-Id")) as trace_id:
+        resposta = await call_next(request)
+    resposta.headers["X-Trace-Id"] = trace_id
+    return resposta
+
 # Modelos para a API
 class PerguntaRequest(BaseModel):
     pergunta: str = Field(..., description="Pergunta ou comando para o agente")
+    conversa_id: Optional[str] = Field(
+        None, max_length=64,
+        description="Conversa a que a pergunta pertence; sem ele, uma nova conversa é iniciada")
 
 class RespostaResponse(BaseModel):
     resposta: str = Field(..., description="Resposta do agente")
     fontes: Optional[str] = Field(None, description="Fontes consultadas")
     acao_realizada: Optional[dict] = Field(None, description="Detalhes da ação realizada")
+    trace_id: Optional[str] = Field(None, description="Identificador do rastro da requisição")
+    conversa_id: str = Field(..., description="Conversa da resposta, a ser enviada nas próximas perguntas")
 
 # Instanciar o agente (será criado apenas uma vez ao iniciar a aplicação)
 agent = None
+watcher = None
+sincronizador = None
+
+def iniciar_monitoramento():
+    """Inicia a atualização automática do índice, se habilitada."""
+    global watcher
+    if WATCH_DOCS or "--watch" in sys.argv:
+        watcher = IndexWatcher(agent.vector_store_service)
+        watcher.iniciar()
+
+def iniciar_sincronizacao():
+    """Mantém o espelho local da agenda em dia, se habilitado."""
+    global sincronizador
+    if agent.calendar_service.espelho is not None:
+        sincronizador = SincronizadorCalendario(agent.calendar_service)
+        sincronizador.iniciar()
 
 @app.on_event("startup")
 async def startup_event():
     global agent
     print("Inicializando o agente...")
-    agent = EssentialistAgent()
+    agent = EssentialistAgent(eco_terminal=False)
+    if LLM_WARMUP:
+        agent.aquecer()
+    iniciar_monitoramento()
+    iniciar_sincronizacao()
     print("Agente inicializado com sucesso!")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if watcher:
+        watcher.parar()
+    if sincronizador:
+        sincronizador.parar()
+
 @app.get("/")
 async def root():
     return {"message": "Jarvis1 - Agente Essencialista API"}
@@ -55,16 +105,91 @@ async def perguntar(request: PerguntaRequest):
     if not agent:
         raise HTTPException(status_code=500, detail="Agente não inicializado")
     
+    conversa_id = request.conversa_id or uuid.uuid4().hex
     try:
-        resultado = agent.processar_entrada(request.pergunta)
+        resultado = await agent.aprocessar_entrada(request.pergunta, conversa_id=conversa_id)
         return RespostaResponse(
             resposta=resultado["resposta"],
             fontes=resultado.get("fontes"),
-            acao_realizada=resultado.get("acao_realizada")
+            acao_realizada=resultado.get("acao_realizada"),
+            trace_id=resultado.get("trace_id"),
+            conversa_id=conversa_id
         )
+    except FilaCheiaError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except TempoFilaEsgotadoError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao processar pergunta: {str(e)}")
 
+def evento_sse(evento: str, dados: dict) -> str:
+    """Formata um evento no padrão server-sent events."""
+    return f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False, default=str)}\n\n"
+
+@app.post("/perguntar/stream")
+async def perguntar_stream(request: PerguntaRequest):
+    """
+    Responde em server-sent events: um evento "token" por trecho gerado e, ao final, um
+    evento "fim" com a resposta completa, as fontes e a ação realizada.
+    """
+    global agent
+    if not agent:
+        raise HTTPException(status_code=500, detail="Agente não inicializado")
+    # Recusa antes de abrir o stream, enquanto ainda é possível responder com o status HTTP
+    if agendador_modelo.lotado():
+        raise HTTPException(status_code=429, detail="Fila do modelo cheia")
+    
+    conversa_id = request.conversa_id or uuid.uuid4().hex
+    
+    async def eventos():
+        fila = asyncio.Queue()
+        tarefa = asyncio.create_task(agent.aprocessar_entrada(request.pergunta, ao_token=fila.put_nowait,
+                                                              conversa_id=conversa_id))
+        tarefa.add_done_callback(lambda _: fila.put_nowait(None))
+        try:
+            while True:
+                trecho = await fila.get()
+                if trecho is None:
+                    break
+                yield evento_sse("token", {"texto": trecho})
+            
+            resultado = tarefa.result()
+            yield evento_sse("fim", {
+                "resposta": resultado["resposta"],
+                "fontes": resultado.get("fontes"),
+                "acao_realizada": resultado.get("acao_realizada"),
+                "metricas_geracao": resultado.get("metricas_geracao"),
+                "trace_id": resultado.get("trace_id"),
+                "conversa_id": conversa_id
+            })
+        except Exception as e:
+            yield evento_sse("erro", {"detail": f"Erro ao processar pergunta: {str(e)}"})
+        finally:
+            # Cliente desconectado: a geração não precisa continuar
+            if not tarefa.done():
+                tarefa.cancel()
+    
+    return StreamingResponse(eventos(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/agendador")
+async def estatisticas_agendador():
+    """Ocupação da fila de chamadas ao modelo e tempos de espera."""
+    return agendador_modelo.estatisticas()
+
+@app.get("/metrics")
+async def metricas():
+    """Métricas no formato de texto do Prometheus."""
+    return PlainTextResponse(exportar_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/rastros/{trace_id}")
+async def obter_etapas_rastro(trace_id: str):
+    """Etapas registradas de uma requisição recente, com a duração de cada uma."""
+    etapas = obter_rastro(trace_id)
+    if etapas is None:
+        raise HTTPException(status_code=404, detail="Rastro não encontrado")
+    return {"trace_id": trace_id, "etapas": etapas}
+
 @app.get("/calendario/eventos")
 async def listar_eventos(dias: int = 7):
     global agent
@@ -72,7 +197,7 @@ async def listar_eventos(dias: int = 7):
         raise HTTPException(status_code=500, detail="Agente não inicializado")
     
     try:
-        eventos = agent.calendar_service.listar_eventos(dias)
+        eventos = await agent.calendar_service.alistar_eventos(dias)
         return {"eventos": eventos}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao listar eventos: {str(e)}")
@@ -81,6 +206,10 @@ async def listar_eventos(dias: int = 7):
 def run_cli():
     global agent
     agent = EssentialistAgent()
+    if LLM_WARMUP:
+        agent.aquecer()
+    iniciar_monitoramento()
+    iniciar_sincronizacao()
     
     print("\n==== Jarvis1: Assistente Essencialista ====")
     print("Converse com o agente (digite 'sair' para encerrar):")
@@ -99,9 +228,10 @@ def run_cli():
             inicio = time.time()
             
             # Processar a pergunta
-            resultado = agent.processar_entrada(query)
+            with iniciar_rastro():
+                resultado = agent.processar_entrada(query)
             
-            # A resposta já é exibida via streaming pelo StreamingStdOutCallbackHandler
+            # A resposta já é exibida no terminal enquanto é gerada
             
             # Exibir fontes e tempo
             print('\n')
@@ -122,6 +252,10 @@ def run_cli():
     except Exception as e:
         print(f"\nErro: {e}")
     finally:
+        if watcher:
+            watcher.parar()
+        if sincronizador:
+            sincronizador.parar()
         print("\nObrigado por usar o Jarvis1!")
 
 # Ponto de entrada
@@ -0,0 +1,363 @@
+"""
+Micro-benchmark dos componentes do agente em acervos sintéticos de tamanho crescente.
+
+Roda sem rede: os embeddings são vetores determinísticos derivados do hash do texto e o
+modelo de linguagem é substituído por um modelo falso que devolve uma resposta fixa em
+pedaços. Para cada tamanho de acervo são medidos o tempo e o pico de memória de cada etapa,
+e o resultado é salvo em JSON para comparar commits:
+
+    python benchmark.py --tamanhos 1000 10000 100000
+    python benchmark.py --tamanhos 1000 --comparar benchmark_abc1234.json
+"""
+import os
+import gc
+import json
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import platform
+import subprocess
+import tempfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Iterator, Optional
+import numpy as np
+try:
+    import psutil
+except ImportError:
+    psutil = None
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessageChunk
+from utils.helpers import formatar_fontes
+from utils.markdown_loader import MarkdownLoader, dividir_documento
+from services.vector_store import VectorStoreService
+from services.llm_service import LLMService
+from services.calendar_service import GoogleCalendarService
+from config import (
+    CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_MODEL, EMBEDDING_MODELS, FAISS_INDEX_TYPE, RETRIEVER_MODE,
+    MARKDOWN_WORKERS,
+)
+
+TAMANHOS_PADRAO = [1000, 10000, 100000, 1000000]
+SECOES_POR_ARQUIVO = 20
+PALAVRAS = (
+    "essencial prioridade foco energia agenda rotina decisao escolha limite tempo trabalho "
+    "descanso clareza proposito sistema habito semana reuniao projeto meta tarefa dizer nao "
+    "eliminar executar explorar avaliar compromisso calendario manha tarde noite pausa"
+).split()
+
+
+class EmbeddingsFalsos(Embeddings):
+    """Vetores unitários determinísticos derivados do hash do texto."""
+
+    def __init__(self, dimensao: int):
+        self.dimensao = dimensao
+
+    def _vetor(self, texto: str) -> List[float]:
+        semente = int.from_bytes(hashlib.sha256(texto.encode("utf-8")).digest()[:8], "little")
+        vetor = np.random.default_rng(semente).standard_normal(self.dimensao).astype(np.float32)
+        return (vetor / np.linalg.norm(vetor)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._vetor(texto) for texto in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vetor(text)
+
+
+class ModeloFalso:
+    """Substitui o ChatOllama: devolve uma resposta fixa em pedaços, sem rede."""
+
+    resposta = '{"resposta": "Resposta de teste gerada pelo modelo falso do benchmark.", "acao": null}'
+
+    def stream(self, prompt: str) -> Iterator[AIMessageChunk]:
+        for i in range(0, len(self.resposta), 8):
+            yield AIMessageChunk(content=self.resposta[i:i + 8])
+
+
+def gerar_acervo(diretorio: str, chunks: int, semente: int = 42):
+    """Cria arquivos Markdown com frontmatter e seções curtas (cerca de um chunk por seção)."""
+    aleatorio = random.Random(semente)
+    arquivos = max(1, chunks // SECOES_POR_ARQUIVO)
+    for n in range(arquivos):
+        pasta = os.path.join(diretorio, f"pasta_{n // 1000:04d}")
+        os.makedirs(pasta, exist_ok=True)
+        partes = [f"---\ntags: [{aleatorio.choice(PALAVRAS)}, {aleatorio.choice(PALAVRAS)}]\n---\n",
+                  f"# Nota {n}\n"]
+        for secao in range(SECOES_POR_ARQUIVO):
+            texto = " ".join(aleatorio.choices(PALAVRAS, k=90))
+            partes.append(f"\n## Seção {secao}\n\n{texto}.\n")
+        with open(os.path.join(pasta, f"nota_{n:07d}.md"), "w", encoding="utf-8") as f:
+            f.write("".join(partes))
+
+
+def eventos_sinteticos(quantidade: int) -> List[Dict[str, Any]]:
+    inicio = datetime(2026, 1, 5, 8, 0)
+    eventos = []
+    for i in range(quantidade):
+        comeco = inicio + timedelta(hours=2 * i)
+        eventos.append({
+            "id": f"evento{i}",
+            "summary": f"Compromisso {i}",
+            "description": "Reunião de acompanhamento do projeto " * 3,
+            "location": "Sala 1" if i % 2 else "",
+            "start": {"dateTime": comeco.isoformat() + "-03:00"},
+            "end": {"dateTime": (comeco + timedelta(hours=1)).isoformat() + "-03:00"},
+        })
+    return eventos
+
+
+class Medidor:
+    """
+    Mede tempo e pico de memória de cada etapa.
+
+    O pico de RSS vem de uma thread que amostra o RSS atual do processo durante a etapa e é
+    informado como acréscimo sobre o RSS do início, o que inclui as alocações nativas (FAISS,
+    numpy). O tracemalloc, opcional, mostra só o pico das alocações Python.
+    """
+
+    def __init__(self, memoria: bool, intervalo_amostragem: float = 0.005):
+        self.memoria = memoria
+        self.intervalo_amostragem = intervalo_amostragem
+        self.etapas: Dict[str, Dict[str, Any]] = {}
+
+    @contextmanager
+    def etapa(self, nome: str, **extras):
+        gc.collect()
+        if self.memoria:
+            tracemalloc.start()
+        amostrador = AmostradorRSS(self.intervalo_amostragem)
+        amostrador.iniciar()
+        inicio = time.perf_counter()
+        resultado = dict(extras)
+        try:
+            yield resultado
+        finally:
+            resultado["segundos"] = time.perf_counter() - inicio
+            if self.memoria:
+                resultado["pico_mb"] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+                tracemalloc.stop()
+            resultado.update(amostrador.parar())
+            self.etapas[nome] = resultado
+            print(f"  {nome}: {resultado['segundos']:.3f} s"
+                  + (f", pico {resultado['pico_mb']:.1f} MB" if "pico_mb" in resultado else "")
+                  + (f", RSS +{resultado['rss_pico_mb']:.1f} MB" if resultado["rss_pico_mb"] is not None else ""))
+
+
+class AmostradorRSS:
+    """Acompanha o maior RSS do processo entre iniciar() e parar(), amostrando em uma thread."""
+
+    def __init__(self, intervalo: float):
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+        self._thread = None
+        self._inicial = None
+        self._pico = None
+
+    def iniciar(self):
+        self._inicial = self._pico = _rss_atual_mb()
+        if self._inicial is None:
+            return
+        self._thread = threading.Thread(target=self._executar, name="benchmark-rss", daemon=True)
+        self._thread.start()
+
+    def _executar(self):
+        while not self._parar.wait(self.intervalo):
+            self._registrar()
+
+    def _registrar(self):
+        atual = _rss_atual_mb()
+        if atual is not None and atual > self._pico:
+            self._pico = atual
+
+    def parar(self) -> Dict[str, Optional[float]]:
+        """RSS ao final e maior acréscimo sobre o RSS inicial durante a etapa (None se indisponível)."""
+        if self._thread is None:
+            return {"rss_mb": None, "rss_pico_mb": None}
+        self._parar.set()
+        self._thread.join()
+        # Última amostra, para etapas mais curtas que o intervalo
+        self._registrar()
+        return {"rss_mb": _rss_atual_mb(), "rss_pico_mb": self._pico - self._inicial}
+
+
+_TAMANHO_PAGINA = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _rss_atual_mb() -> Optional[float]:
+    """RSS atual do processo: /proc no Linux, psutil nas demais plataformas."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _TAMANHO_PAGINA / 1024 ** 2
+    except (OSError, IndexError, ValueError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1024 ** 2
+    return None
+
+
+def _arquivos(diretorio: str) -> List[str]:
+    return sorted(os.path.join(raiz, nome) for raiz, _, nomes in os.walk(diretorio)
+                  for nome in nomes if nome.endswith(".md"))
+
+
+def medir_tamanho(chunks: int, trabalho: str, consultas: int, memoria: bool, dimensao: int) -> Dict[str, Any]:
+    print(f"\nAcervo com ~{chunks} chunks")
+    base = os.path.join(trabalho, f"acervo_{chunks}")
+    docs, indice, cache = (os.path.join(base, nome) for nome in ("docs", "indice", "cache"))
+    inicio = time.perf_counter()
+    gerar_acervo(docs, chunks)
+    print(f"  geração do acervo: {time.perf_counter() - inicio:.1f} s")
+
+    medidor = Medidor(memoria)
+    arquivos = _arquivos(docs)
+
+    # Mesmo caminho da indexação (MarkdownLoader com pool de processos); o RSS medido é o do
+    # processo principal, sem os workers
+    loader = MarkdownLoader(CHUNK_SIZE, CHUNK_OVERLAP, max_workers=MARKDOWN_WORKERS)
+    with medidor.etapa("carregamento_markdown", arquivos=len(arquivos)) as resultado:
+        total = 0
+        for _, _, chunks_arquivo in loader.carregar({os.path.relpath(caminho, docs): caminho
+                                                     for caminho in arquivos}):
+            total += len(chunks_arquivo)
+        resultado["chunks"] = total
+
+    # Divisão em seções e chunks isolada da leitura e do pool, no processo principal
+    textos = []
+    for caminho in arquivos:
+        with open(caminho, "rb") as f:
+            textos.append((caminho, f.read().decode("utf-8", errors="replace")))
+    with medidor.etapa("divisao") as resultado:
+        resultado["chunks"] = sum(len(dividir_documento(texto, caminho, CHUNK_SIZE, CHUNK_OVERLAP))
+                                  for caminho, texto in textos)
+    del textos
+
+    embeddings = EmbeddingsFalsos(dimensao)
+    with medidor.etapa("construcao_indice"):
+        servico = VectorStoreService(indice, diretorio_docs=docs, embeddings_base=embeddings,
+                                     diretorio_cache=cache)
+        servico.carregar_ou_criar_indice()
+    del servico
+    gc.collect()
+
+    with medidor.etapa("carregamento_indice"):
+        servico = VectorStoreService(indice, diretorio_docs=docs, embeddings_base=embeddings,
+                                     diretorio_cache=cache)
+        servico.carregar_ou_criar_indice()
+
+    aleatorio = random.Random(7)
+    perguntas = [" ".join(aleatorio.choices(PALAVRAS, k=6)) for _ in range(consultas)]
+    retriever = servico.get_retriever()
+    latencias = []
+    with medidor.etapa("busca", consultas=consultas) as resultado:
+        for pergunta in perguntas:
+            inicio = time.perf_counter()
+            documentos = retriever.invoke(pergunta)
+            latencias.append(time.perf_counter() - inicio)
+        resultado.update(_percentis_ms(latencias))
+
+    repeticoes = 1000
+    with medidor.etapa("formatar_fontes", repeticoes=repeticoes):
+        for _ in range(repeticoes):
+            formatar_fontes(documentos)
+
+    eventos = eventos_sinteticos(50)
+    with medidor.etapa("formatar_eventos", repeticoes=repeticoes, eventos=len(eventos)):
+        for _ in range(repeticoes):
+            GoogleCalendarService.formatar_eventos(eventos)
+
+    # Montagem do prompt e geração com o modelo falso (sem o cache de respostas)
+    llm_service = LLMService(retriever, modo="direto", eco_terminal=False)
+    llm_service.llm = ModeloFalso()
+    llm_service.cache_respostas = None
+    calendario = GoogleCalendarService.formatar_eventos(eventos[:10])
+    historico = [(pergunta, "Resposta anterior " * 20) for pergunta in perguntas[:4]]
+    latencias = []
+    with medidor.etapa("resposta_modelo_falso", consultas=consultas) as resultado:
+        for pergunta in perguntas:
+            inicio = time.perf_counter()
+            llm_service.processar_pergunta(pergunta, historico, calendario, "Resumo da conversa " * 10)
+            latencias.append(time.perf_counter() - inicio)
+        resultado.update(_percentis_ms(latencias))
+
+    shutil.rmtree(base, ignore_errors=True)
+    return {"chunks": medidor.etapas["divisao"]["chunks"], "arquivos": len(arquivos), "etapas": medidor.etapas}
+
+
+def _percentis_ms(latencias: List[float]) -> Dict[str, float]:
+    valores = np.asarray(latencias) * 1000
+    return {"media_ms": float(valores.mean()), "p50_ms": float(np.percentile(valores, 50)),
+            "p95_ms": float(np.percentile(valores, 95))}
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(atual: Dict[str, Any], anterior: Dict[str, Any]):
+    """Mostra a razão de tempo (atual / anterior) de cada etapa nos tamanhos em comum."""
+    print(f"\nComparação com {anterior.get('commit')} ({anterior.get('data')}):")
+    for tamanho, resultado in atual["resultados"].items():
+        antes = anterior.get("resultados", {}).get(tamanho)
+        if not antes:
+            continue
+        print(f"  {tamanho} chunks")
+        for nome, etapa in resultado["etapas"].items():
+            if nome in antes["etapas"] and antes["etapas"][nome]["segundos"]:
+                razao = etapa["segundos"] / antes["etapas"][nome]["segundos"]
+                print(f"    {nome}: {razao:.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dos componentes do agente")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=TAMANHOS_PADRAO,
+                        help="quantidades aproximadas de chunks dos acervos sintéticos")
+    parser.add_argument("--consultas", type=int, default=100, help="consultas por medição de busca")
+    parser.add_argument("--dimensao", type=int, default=EMBEDDING_MODELS.get(EMBEDDING_MODEL, 768),
+                        help="dimensão dos embeddings falsos")
+    parser.add_argument("--sem-memoria", action="store_true",
+                        help="não rastreia alocações (o tracemalloc deixa as etapas mais lentas)")
+    parser.add_argument("--diretorio", default=None, help="diretório de trabalho (padrão: temporário)")
+    parser.add_argument("--saida", default=None, help="arquivo JSON de resultados")
+    parser.add_argument("--comparar", default=None, help="resultado anterior para comparação")
+    args = parser.parse_args()
+
+    commit = _commit()
+    trabalho = args.diretorio or tempfile.mkdtemp(prefix="benchmark_agente_")
+    resultado = {
+        "commit": commit,
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "configuracao": {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "dimensao": args.dimensao,
+                         "tipo_indice": FAISS_INDEX_TYPE, "modo_busca": RETRIEVER_MODE},
+        "resultados": {},
+    }
+    try:
+        for tamanho in args.tamanhos:
+            resultado["resultados"][str(tamanho)] = medir_tamanho(
+                tamanho, trabalho, args.consultas, not args.sem_memoria, args.dimensao)
+    finally:
+        if args.diretorio is None:
+            shutil.rmtree(trabalho, ignore_errors=True)
+
+    saida = args.saida or f"benchmark_{commit or 'local'}.json"
+    with open(saida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados salvos em {saida}")
+
+    if args.comparar:
+        with open(args.comparar, "r", encoding="utf-8") as f:
+            comparar(resultado, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+from utils.helpers import get_local_timezone
+from config import CALENDAR_SYNC_INTERVAL_SECONDS, CALENDAR_MIRROR_MAX_AGE_SECONDS
+
+
+def instante_evento(evento: Dict[str, Any], campo: str) -> datetime:
+    """Início ("start") ou fim ("end") de um evento, com fuso; dia inteiro começa à meia-noite local."""
+    valor = evento[campo]
+    if "dateTime" in valor:
+        return datetime.fromisoformat(valor["dateTime"].replace("Z", "+00:00"))
+    return get_local_timezone().localize(datetime.fromisoformat(valor["date"]))
+
+
+def _com_fuso(instante: datetime) -> datetime:
+    """Datas sem fuso são tratadas como horário local da máquina."""
+    return instante if instante.tzinfo is not None else instante.astimezone()
+
+
+def _texto_busca(evento: Dict[str, Any]) -> str:
+    """Campos considerados na busca textual, como o parâmetro q da API."""
+    partes = [evento.get("summary", ""), evento.get("description", ""), evento.get("location", "")]
+    for participante in evento.get("attendees", []):
+        partes.extend([participante.get("email", ""), participante.get("displayName", "")])
+    return " ".join(partes).casefold()
+
+
+class EspelhoCalendario:
+    """
+    Cópia local (SQLite) dos eventos da agenda principal, no formato devolvido pela API.
+
+    Guarda também o syncToken e o horário da última sincronização bem-sucedida: com o token, a
+    API devolve apenas o que mudou desde então. O espelho só está pronto se essa sincronização
+    tiver ocorrido há no máximo validade segundos; antes da primeira, depois de reiniciar com
+    dados antigos ou se as sincronizações falharem, as leituras devem ir à API.
+    """
+
+    def __init__(self, caminho: str, validade: float = CALENDAR_MIRROR_MAX_AGE_SECONDS):
+        self.validade = validade
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(caminho, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS eventos ("
+            "id TEXT PRIMARY KEY, inicio REAL NOT NULL, fim REAL NOT NULL, "
+            "texto TEXT NOT NULL, dados TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_inicio ON eventos (inicio)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS estado (chave TEXT PRIMARY KEY, valor TEXT)")
+        self._db.commit()
+
+        estado = dict(self._db.execute("SELECT chave, valor FROM estado").fetchall())
+        self._token: Optional[str] = estado.get("sync_token")
+        self._sincronizado_em = float(estado.get("sincronizado_em") or 0.0)
+
+    @property
+    def token_sincronizacao(self) -> Optional[str]:
+        return self._token
+
+    @property
+    def pronto(self) -> bool:
+        return self._token is not None and time.time() - self._sincronizado_em <= self.validade
+
+    @staticmethod
+    def _linha(evento: Dict[str, Any]) -> Optional[Tuple[str, float, float, str, str]]:
+        try:
+            inicio = instante_evento(evento, "start").timestamp()
+            fim = instante_evento(evento, "end").timestamp()
+        except (KeyError, ValueError):
+            return None
+        return evento["id"], inicio, fim, _texto_busca(evento), json.dumps(evento, ensure_ascii=False)
+
+    def _gravar(self, eventos: Iterable[Dict[str, Any]]):
+        for evento in eventos:
+            linha = self._linha(evento) if evento.get("status") != "cancelled" else None
+            if linha is None:
+                self._db.execute("DELETE FROM eventos WHERE id = ?", (evento["id"],))
+            else:
+                self._db.execute("INSERT OR REPLACE INTO eventos VALUES (?, ?, ?, ?, ?)", linha)
+
+    def _salvar_token(self, token: Optional[str]):
+        agora = time.time()
+        self._db.executemany("INSERT OR REPLACE INTO estado (chave, valor) VALUES (?, ?)",
+                             [("sync_token", token), ("sincronizado_em", repr(agora))])
+        self._token = token
+        self._sincronizado_em = agora
+
+    def substituir(self, eventos: List[Dict[str, Any]], token: Optional[str]):
+        """Sincronização completa: o conteúdo anterior é descartado."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM eventos")
+            self._gravar(eventos)
+            self._salvar_token(token)
+
+    def aplicar(self, eventos: List[Dict[str, Any]], token: Optional[str]):
+        """Sincronização incremental: eventos cancelados são removidos, os demais substituídos."""
+        with self._lock, self._db:
+            self._gravar(eventos)
+            self._salvar_token(token)
+
+    def salvar(self, evento: Dict[str, Any]):
+        """Registra um evento criado ou alterado por este processo, sem esperar a sincronização."""
+        with self._lock, self._db:
+            self._gravar([evento])
+
+    def remover(self, event_id: str):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM eventos WHERE id = ?", (event_id,))
+
+    def listar(self, inicio: datetime, fim: datetime) -> List[Dict[str, Any]]:
+        """Eventos que se sobrepõem ao intervalo, em ordem de início (como timeMin/timeMax da API)."""
+        with self._lock:
+            linhas = self._db.execute(
+                "SELECT dados FROM eventos WHERE inicio < ? AND fim > ? ORDER BY inicio, id",
+                (_com_fuso(fim).timestamp(), _com_fuso(inicio).timestamp())).fetchall()
+        return [json.loads(dados) for (dados,) in linhas]
+
+    def buscar(self, consulta: str, inicio: datetime, fim: datetime) -> List[Dict[str, Any]]:
+        """Eventos do intervalo que contêm todos os termos da consulta."""
+        termos = consulta.casefold().split()
+        with self._lock:
+            linhas = self._db.execute(
+                "SELECT texto, dados FROM eventos WHERE inicio < ? AND fim > ? ORDER BY inicio, id",
+                (_com_fuso(fim).timestamp(), _com_fuso(inicio).timestamp())).fetchall()
+        return [json.loads(dados) for texto, dados in linhas if all(termo in texto for termo in termos)]
+
+
+class SincronizadorCalendario:
+    """Mantém o espelho da agenda em dia, sincronizando em uma thread de segundo plano."""
+
+    def __init__(self, calendar_service, intervalo: float = CALENDAR_SYNC_INTERVAL_SECONDS):
+        self.calendar_service = calendar_service
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        """Sincroniza imediatamente e, depois, a cada intervalo."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, name="calendar-sync", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        """Interrompe a sincronização."""
+        self._parar.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _executar(self):
+        while not self._parar.is_set():
+            try:
+                self.calendar_service.sincronizar()
+            except Exception as e:
+                print(f"Erro ao sincronizar a agenda: {e}")
+            self._parar.wait(self.intervalo)
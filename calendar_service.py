@@ -1,21 +1,37 @@
 import os
+import asyncio
 import datetime
+import threading
+import httplib2
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from models.schemas import CalendarEvent, CalendarEventCreate
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from utils.helpers import get_time_range, formatar_evento_calendario
-from config import CALENDAR_SCOPES, TOKEN_FILE, CREDENTIALS_FILE
+from utils.tracing import rastrear
+from services.calendar_mirror import EspelhoCalendario, instante_evento
+from config import (CALENDAR_SCOPES, TOKEN_FILE, CREDENTIALS_FILE, CALENDAR_MIRROR_ENABLED, CALENDAR_MIRROR_PATH,
+                    CALENDAR_HTTP_TIMEOUT_SECONDS)
 import json
 
 class GoogleCalendarService:
-    """Serviço para interação com a API do Google Calendar."""
+    """
+    Serviço para interação com a API do Google Calendar.
+    
+    Com o espelho local habilitado, as leituras (listagem, busca e tempo livre) são feitas no
+    SQLite, mantido em dia por sincronizar(); as alterações vão à API e são registradas no
+    espelho em seguida. Sem uma sincronização recente, as leituras consultam a API.
+    """
     
     def __init__(self):
         self.service = None
+        # O cliente HTTP da API não é seguro entre threads
+        self._lock = threading.Lock()
+        self.espelho = EspelhoCalendario(CALENDAR_MIRROR_PATH) if CALENDAR_MIRROR_ENABLED else None
         self.autenticar()
     
     def autenticar(self):
@@ -39,24 +55,80 @@ class GoogleCalendarService:
             with open(TOKEN_FILE, 'w') as token:
                 token.write(creds.to_json())
         
-        self.service = build('calendar', 'v3', credentials=creds)
+        # Sem tempo limite, uma chamada travada prenderia a thread e o lock da API indefinidamente
+        http = AuthorizedHttp(creds, http=httplib2.Http(timeout=CALENDAR_HTTP_TIMEOUT_SECONDS))
+        self.service = build('calendar', 'v3', http=http)
         print("Autenticação com Google Calendar concluída com sucesso!")
     
-    def listar_eventos(self, dias: int = 7) -> List[Dict[str, Any]]:
-        """Lista eventos do calendário para os próximos dias."""
+    def _executar(self, requisicao):
+        """Executa uma requisição da API, uma por vez."""
+        with rastrear("google_calendar", operacao=getattr(requisicao, "methodId", None)):
+            with self._lock:
+                return requisicao.execute()
+    
+    def _espelho_pronto(self) -> bool:
+        return self.espelho is not None and self.espelho.pronto
+    
+    def sincronizar(self) -> int:
+        """
+        Atualiza o espelho local e retorna a quantidade de eventos recebidos.
+        
+        Com um syncToken salvo, a API devolve só as alterações desde a última sincronização;
+        sem ele, ou quando ele expira (HTTP 410), todos os eventos são baixados novamente.
+        """
+        if self.espelho is None:
+            return 0
         if not self.service:
             self.autenticar()
         
+        token = self.espelho.token_sincronizacao
+        if token:
+            try:
+                with rastrear("sincronizacao_agenda", tipo="incremental") as span:
+                    eventos, novo_token = self._listar_alteracoes(syncToken=token)
+                    self.espelho.aplicar(eventos, novo_token)
+                    span["eventos"] = len(eventos)
+                return len(eventos)
+            except HttpError as error:
+                if error.resp.status != 410:
+                    raise
+                print("Token de sincronização da agenda expirado; refazendo a sincronização completa")
+        
+        with rastrear("sincronizacao_agenda", tipo="completa") as span:
+            eventos, novo_token = self._listar_alteracoes()
+            self.espelho.substituir(eventos, novo_token)
+            span["eventos"] = len(eventos)
+        return len(eventos)
+    
+    def _listar_alteracoes(self, **parametros) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Percorre todas as páginas da listagem e retorna os eventos e o próximo syncToken."""
+        eventos = []
+        parametros.update(calendarId='primary', singleEvents=True, maxResults=2500)
+        while True:
+            resultado = self._executar(self.service.events().list(**parametros))
+            eventos.extend(resultado.get('items', []))
+            if not resultado.get('nextPageToken'):
+                return eventos, resultado.get('nextSyncToken')
+            parametros['pageToken'] = resultado['nextPageToken']
+    
+    def listar_eventos(self, dias: int = 7) -> List[Dict[str, Any]]:
+        """Lista eventos do calendário para os próximos dias."""
         time_min, time_max = get_time_range(dias)
+        if self._espelho_pronto():
+            return self.espelho.listar(datetime.datetime.fromisoformat(time_min),
+                                       datetime.datetime.fromisoformat(time_max))
+        
+        if not self.service:
+            self.autenticar()
         
         try:
-            eventos_result = self.service.events().list(
+            eventos_result = self._executar(self.service.events().list(
                 calendarId='primary',
                 timeMin=time_min,
                 timeMax=time_max,
                 singleEvents=True,
                 orderBy='startTime'
-            ).execute()
+            ))
             
             eventos = eventos_result.get('items', [])
             return eventos
@@ -97,12 +169,14 @@ class GoogleCalendarService:
             event_body['reminders'] = evento.reminders
         
         try:
-            event = self.service.events().insert(
+            event = self._executar(self.service.events().insert(
                 calendarId='primary',
                 body=event_body
-            ).execute()
+            ))
             
             print(f'Evento criado: {event.get("htmlLink")}')
+            if self.espelho is not None:
+                self.espelho.salvar(event)
             return event
             
         except HttpError as error:
@@ -141,13 +215,15 @@ class GoogleCalendarService:
             event_body['reminders'] = evento.reminders
         
         try:
-            event = self.service.events().update(
+            event = self._executar(self.service.events().update(
                 calendarId='primary',
                 eventId=event_id,
                 body=event_body
-            ).execute()
+            ))
             
             print(f'Evento atualizado: {event.get("htmlLink")}')
+            if self.espelho is not None:
+                self.espelho.salvar(event)
             return event
             
         except HttpError as error:
@@ -160,12 +236,14 @@ class GoogleCalendarService:
             self.autenticar()
             
         try:
-            self.service.events().delete(
+            self._executar(self.service.events().delete(
                 calendarId='primary',
                 eventId=event_id
-            ).execute()
+            ))
             
             print(f'Evento excluído: {event_id}')
+            if self.espelho is not None:
+                self.espelho.remover(event_id)
             return True
             
         except HttpError as error:
@@ -174,20 +252,23 @@ class GoogleCalendarService:
     
     def buscar_evento(self, query: str) -> List[Dict[str, Any]]:
         """Busca eventos no calendário com base em uma consulta."""
+        time_min, time_max = get_time_range(30)  # Busca nos próximos 30 dias
+        if self._espelho_pronto():
+            return self.espelho.buscar(query, datetime.datetime.fromisoformat(time_min),
+                                       datetime.datetime.fromisoformat(time_max))
+        
         if not self.service:
             self.autenticar()
-            
-        time_min, time_max = get_time_range(30)  # Busca nos próximos 30 dias
         
         try:
-            eventos_result = self.service.events().list(
+            eventos_result = self._executar(self.service.events().list(
                 calendarId='primary',
                 timeMin=time_min,
                 timeMax=time_max,
                 q=query,
                 singleEvents=True,
                 orderBy='startTime'
-            ).execute()
+            ))
             
             eventos = eventos_result.get('items', [])
             return eventos
@@ -209,61 +290,62 @@ class GoogleCalendarService:
         Returns:
             Lista de dicionários com períodos livres (start, end)
         """
-        if not self.service:
-            self.autenticar()
+        # Datas sem fuso são tratadas como horário local, para comparar com os eventos
+        if inicio.tzinfo is None:
+            inicio = inicio.astimezone()
+        if fim.tzinfo is None:
+            fim = fim.astimezone()
         
-        # Converter para RFC3339
-        inicio_rfc = inicio.isoformat()
-        fim_rfc = fim.isoformat()
-        
-        try:
-            # Obter eventos no período
-            eventos_result = self.service.events().list(
-                calendarId='primary',
-                timeMin=inicio_rfc,
-                timeMax=fim_rfc,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
+        if self._espelho_pronto():
+            eventos = self.espelho.listar(inicio, fim)
+        else:
+            if not self.service:
+                self.autenticar()
             
-            eventos = eventos_result.get('items', [])
+            try:
+                # Obter eventos no período (RFC3339)
+                eventos_result = self._executar(self.service.events().list(
+                    calendarId='primary',
+                    timeMin=inicio.isoformat(),
+                    timeMax=fim.isoformat(),
+                    singleEvents=True,
+                    orderBy='startTime'
+                ))
+                eventos = eventos_result.get('items', [])
             
-            # Encontrar períodos livres
-            periodos_livres = []
-            tempo_atual = inicio
-            
-            for evento in eventos:
-                event_start = datetime.fromisoformat(
-                    evento['start'].get('dateTime', evento['start'].get('date')).replace('Z', '+00:00')
-                )
-                
-                # Verificar se há um período livre antes do evento
-                if (event_start - tempo_atual).total_seconds() / 60 >= duracao_minima:
-                    periodos_livres.append({
-                        'start': tempo_atual,
-                        'end': event_start
-                    })
-                
-                # Atualizar o tempo atual para depois do evento
-                event_end = datetime.fromisoformat(
-                    evento['end'].get('dateTime', evento['end'].get('date')).replace('Z', '+00:00')
-                )
-                tempo_atual = event_end
+            except HttpError as error:
+                print(f'Erro ao analisar tempo livre: {error}')
+                return []
+        
+        # Encontrar períodos livres
+        periodos_livres = []
+        tempo_atual = inicio
+        
+        for evento in eventos:
+            event_start = instante_evento(evento, 'start').astimezone(inicio.tzinfo)
             
-            # Verificar se há um período livre após o último evento até o fim
-            if (fim - tempo_atual).total_seconds() / 60 >= duracao_minima:
+            # Verificar se há um período livre antes do evento
+            if (event_start - tempo_atual).total_seconds() / 60 >= duracao_minima:
                 periodos_livres.append({
                     'start': tempo_atual,
-                    'end': fim
+                    'end': event_start
                 })
             
-            return periodos_livres
-            
-        except HttpError as error:
-            print(f'Erro ao analisar tempo livre: {error}')
-            return []
+            # Atualizar o tempo atual para depois do evento (eventos sobrepostos não o fazem recuar)
+            event_end = instante_evento(evento, 'end').astimezone(inicio.tzinfo)
+            tempo_atual = max(tempo_atual, event_end)
+        
+        # Verificar se há um período livre após o último evento até o fim
+        if (fim - tempo_atual).total_seconds() / 60 >= duracao_minima:
+            periodos_livres.append({
+                'start': tempo_atual,
+                'end': fim
+            })
+        
+        return periodos_livres
     
-    def formatar_eventos(self, eventos: List[Dict[str, Any]]) -> str:
+    @staticmethod
+    def formatar_eventos(eventos: List[Dict[str, Any]]) -> str:
         """Formata uma lista de eventos para exibição ao usuário."""
         if not eventos:
             return "Nenhum evento encontrado para o período."
@@ -273,4 +355,25 @@ class GoogleCalendarService:
             evento_formatado = formatar_evento_calendario(evento)
             resultado.append(f"Evento {i}:\n{evento_formatado}\n")
         
-        return "\n".join(resultado)
\ No newline at end of file
+        return "\n".join(resultado)
+    
+    # Versões assíncronas: as chamadas à API rodam em threads para não bloquear o event loop
+    
+    async def alistar_eventos(self, dias: int = 7) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.listar_eventos, dias)
+    
+    async def acriar_evento(self, evento: CalendarEventCreate) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.criar_evento, evento)
+    
+    async def aatualizar_evento(self, event_id: str, evento: CalendarEventCreate) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.atualizar_evento, event_id, evento)
+    
+    async def aexcluir_evento(self, event_id: str) -> bool:
+        return await asyncio.to_thread(self.excluir_evento, event_id)
+    
+    async def abuscar_evento(self, query: str) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.buscar_evento, query)
+    
+    async def aanalisar_tempo_livre(self, inicio: datetime.datetime, fim: datetime.datetime,
+                                    duracao_minima: int = 30) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.analisar_tempo_livre, inicio, fim, duracao_minima)
\ No newline at end of file
@@ -6,6 +6,13 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DOCS_DIR = r"C:\Users\Gabriel Lopes\Documents\cofrinho\100. Recursos\RAG\Agente Essencialista"
 CACHE_DIR = os.path.join(os.path.dirname(DOCS_DIR), "cache")
 VECTOR_STORE_PATH = os.path.join(CACHE_DIR, "faiss_index")
+MANIFEST_FILENAME = "manifesto.json"
+# Arquivo que aponta para a versão do índice em uso (cada versão fica em um subdiretório)
+INDEX_VERSION_FILENAME = "versao_atual"
+# Aponta para a versão sendo construída do zero, retomada se a construção for interrompida
+INDEX_BUILD_FILENAME = "versao_em_construcao"
+# Mapeia os vetores do disco em vez de copiá-los para a memória do processo
+INDEX_MMAP = True
 CREDENTIALS_DIR = os.path.join(BASE_DIR, "credentials")
 
 # Configurações LLM
@@ -13,6 +20,68 @@ LLM_MODEL = "llama3.1:8b-instruct-Q4_K_M"
 LLM_TEMPERATURE = 0.1
 LLM_TOP_P = 0.9
 LLM_NUM_CTX = 4096
+# Tempo que o servidor mantém o modelo carregado após a última requisição
+LLM_KEEP_ALIVE = "30m"
+# Carrega o modelo e o início fixo do prompt ao iniciar
+LLM_WARMUP = True
+# "direto": busca com a própria pergunta e uma única chamada ao modelo
+# "cadeia": o modelo reescreve a pergunta com o histórico antes da busca (chamada extra)
+LLM_PIPELINE_MODE = "direto"
+# "json": o modelo responde em JSON ({"resposta": ..., "acao": ...}) restrito ao esquema
+# "texto": texto livre, com a ação procurada como um objeto JSON no meio da resposta
+LLM_OUTPUT_MODE = "json"
+# No modo direto, perguntas com até este número de palavras são buscadas junto da anterior
+LLM_FOLLOWUP_MAX_WORDS = 6
+# Agendador de chamadas ao Ollama (geração e embeddings)
+LLM_MAX_CONCURRENCY = 1
+# Chamadas interativas aguardando além deste número são recusadas (HTTP 429)
+LLM_QUEUE_MAX = 8
+# Espera máxima de uma chamada interativa na fila (HTTP 503); None espera indefinidamente
+LLM_QUEUE_TIMEOUT_SECONDS = 60.0
+# Tokens da janela de contexto reservados para a resposta
+LLM_RESPONSE_TOKENS = 512
+# Divisão do espaço restante do prompt entre as seções (a sobra de uma vai para as outras)
+CONTEXT_BUDGET_SHARES = {"documentos": 0.5, "calendario": 0.2, "historico": 0.3}
+
+# Prazos das etapas de uma resposta: depois deles, a resposta segue sem a agenda ou sem documentos
+CALENDAR_TIMEOUT_SECONDS = 3.0
+RETRIEVAL_TIMEOUT_SECONDS = 15.0
+
+# Histórico de conversa: turnos mantidos na íntegra; os anteriores viram um resumo
+HISTORY_RECENT_TURNS = 4
+HISTORY_SUMMARY_ENABLED = True
+HISTORY_SUMMARY_WORDS = 150
+HISTORY_SUMMARY_MAX_TOKENS = 300
+# Conversas mantidas em memória pela API (cada uma com seu histórico); as menos recentes saem primeiro
+HISTORY_MAX_CONVERSATIONS = 100
+
+# Roteador de intenções: pula a agenda ou a geração quando a entrada não precisa delas
+ROUTER_ENABLED = True
+# Similaridade mínima com os exemplos de perguntas sobre os documentos para dispensar a agenda
+ROUTER_THRESHOLD = 0.6
+
+# Rastreamento por etapas: rastros recentes mantidos em memória (consultados por /rastros/{id})
+TRACE_HISTORY_SIZE = 200
+# Imprime cada etapa como uma linha JSON
+TRACE_LOG_SPANS = False
+
+# Cache semântico de respostas
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_SIZE = 256
+# Similaridade de cosseno mínima entre perguntas para reaproveitar a resposta
+ANSWER_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE_TTL_SECONDS = 3600
+
+# Configurações de embeddings
+# Modelos de embedding conhecidos e suas dimensões
+EMBEDDING_MODELS = {
+    "nomic-embed-text": 768,
+    "mxbai-embed-large": 1024,
+    "snowflake-arctic-embed": 1024,
+    "bge-m3": 1024,
+    "all-minilm": 384,
+}
+EMBEDDING_MODEL = "nomic-embed-text"
 
 # Configurações do Vector Store
 CHUNK_SIZE = 1000
@@ -20,6 +89,48 @@ CHUNK_OVERLAP = 200
 RETRIEVER_K = 3
 RETRIEVER_FETCH_K = 5
 RETRIEVER_LAMBDA_MULT = 0.5
+RETRIEVER_SEARCH_TYPE = "mmr"  # "mmr" ou "similarity"
+# Similaridade de cosseno mínima para um chunk chegar ao prompt (None desativa)
+RETRIEVER_SCORE_THRESHOLD = None
+RETRIEVER_MODE = "hibrido"  # "hibrido" (BM25 + vetorial) ou "vetorial"
+HYBRID_RRF_K = 60
+# Consultas cujo melhor resultado léxico contém todos os termos e supera o segundo
+# por esta razão dispensam o embedding da consulta
+LEXICAL_FAST_PATH_RATIO = 2.0
+LEXICAL_INDEX_FILENAME = "lexico.db"
+
+# Tipo de índice FAISS: "flat" (exato), "ivf", "hnsw" ou "ivfpq" (aproximados)
+FAISS_INDEX_TYPE = "flat"
+FAISS_INDEX_FACTORIES = {
+    "flat": "Flat",
+    "ivf": "IVF{nlist},Flat",
+    "hnsw": "HNSW32",
+    "ivfpq": "IVF{nlist},PQ{pq_m}",
+}
+FAISS_NLIST = 256
+FAISS_PQ_M = 16  # Precisa dividir a dimensão do embedding
+FAISS_NPROBE = 16
+FAISS_EF_SEARCH = 64
+FAISS_TRAIN_SAMPLE = 20000
+FAISS_REPORT_RECALL = False
+
+# Cache persistente de embeddings
+EMBEDDING_CACHE_DIR = os.path.join(CACHE_DIR, "embeddings")
+EMBEDDING_CACHE_MAX_MB = 512
+# Cache em memória dos embeddings de perguntas (LRU com expiração)
+QUERY_CACHE_SIZE = 1024
+QUERY_CACHE_TTL_SECONDS = 3600
+
+# Pipeline de indexação
+EMBEDDING_BATCH_SIZE = 64
+EMBEDDING_CONCURRENCY = 2
+INDEX_CHECKPOINT_BATCHES = 20
+MARKDOWN_WORKERS = None  # None usa todos os núcleos disponíveis
+
+# Atualização automática do índice ao editar notas
+WATCH_DOCS = False
+WATCH_POLL_INTERVAL = 2.0
+WATCH_DEBOUNCE_SECONDS = 5.0
 
 # Verificar disponibilidade da GPU
 HAS_CUDA = torch.cuda.is_available()
@@ -31,6 +142,15 @@ if HAS_CUDA:
 CALENDAR_SCOPES = ['https://www.googleapis.com/auth/calendar']
 TOKEN_FILE = os.path.join(CREDENTIALS_DIR, 'token.json')
 CREDENTIALS_FILE = os.path.join(CREDENTIALS_DIR, 'credentials.json')
+# Tempo limite de cada requisição HTTP à API do Google Calendar
+CALENDAR_HTTP_TIMEOUT_SECONDS = 10.0
+
+# Espelho local da agenda (SQLite), mantido em dia por sincronização incremental (syncToken)
+CALENDAR_MIRROR_ENABLED = True
+CALENDAR_MIRROR_PATH = os.path.join(CACHE_DIR, "calendario.db")
+CALENDAR_SYNC_INTERVAL_SECONDS = 60.0
+# Sem uma sincronização bem-sucedida há mais tempo que isso, as leituras voltam a consultar a API
+CALENDAR_MIRROR_MAX_AGE_SECONDS = 5 * CALENDAR_SYNC_INTERVAL_SECONDS
 
 # Criar diretórios necessários
 os.makedirs(CACHE_DIR, exist_ok=True)
@@ -0,0 +1,175 @@
+import re
+import math
+from typing import Dict, List, Tuple, Any, Optional
+from langchain_core.documents import Document
+
+_PEDACOS = re.compile(r"\w+|[^\w\s]")
+
+def estimar_tokens(texto: str) -> int:
+    """Estimativa de tokens: palavras longas viram vários tokens, pontuação conta um."""
+    return sum(max(1, math.ceil(len(p) / 4)) for p in _PEDACOS.findall(texto or ""))
+
+def formatar_historico(historico: List[Tuple[str, str]]) -> str:
+    """Formata os turnos no mesmo formato usado pelas cadeias do LangChain."""
+    return "".join(f"\nHuman: {pergunta}\nAssistant: {resposta}" for pergunta, resposta in historico)
+
+def formatar_resumo(resumo: Optional[str]) -> str:
+    """Formata o resumo dos turnos antigos para a seção de histórico."""
+    return f"\nResumo da conversa anterior: {resumo}" if resumo else ""
+
+def _cortar(texto: str, limite: int) -> str:
+    """Corta o texto para caber em limite tokens (aproximadamente), marcando o corte."""
+    if estimar_tokens(texto) <= limite:
+        return texto
+    if limite <= 1:
+        return ""
+    # Busca binária pelo maior prefixo que cabe
+    baixo, alto = 0, len(texto)
+    while baixo < alto:
+        meio = (baixo + alto + 1) // 2
+        if estimar_tokens(texto[:meio]) + 1 <= limite:
+            baixo = meio
+        else:
+            alto = meio - 1
+    return texto[:baixo].rstrip() + "…"
+
+_LINHAS_VAZIAS = ("Local: Não especificado", "Descrição: Sem descrição", "Descrição: ", "Local: ")
+
+def compactar_calendario(texto: str) -> str:
+    """Remove campos vazios e encurta descrições longas dos eventos."""
+    linhas = []
+    for linha in texto.splitlines():
+        if linha.strip() in _LINHAS_VAZIAS:
+            continue
+        if linha.startswith("Descrição: ") and len(linha) > 160:
+            linha = linha[:160].rstrip() + "…"
+        linhas.append(linha)
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(linhas)).strip()
+
+class EmpacotadorContexto:
+    """
+    Monta as seções variáveis do prompt dentro da janela de contexto do modelo.
+
+    O calendário recebe uma fração fixa do espaço livre (janela menos a reserva para a
+    resposta e as instruções), de modo que o mesmo calendário produza sempre o mesmo texto
+    e o início do prompt se repita entre perguntas. O restante, descontada a pergunta, é
+    dividido entre histórico e documentos; a sobra de um vai para o outro. Dentro de cada
+    seção sai primeiro o conteúdo de menor valor: turnos mais antigos, eventos mais
+    distantes e chunks de menor relevância.
+    """
+
+    PRIORIDADE = ("documentos", "historico")
+
+    def __init__(self, num_ctx: int, reserva_resposta: int, fracoes: Dict[str, float]):
+        self.num_ctx = num_ctx
+        self.reserva_resposta = reserva_resposta
+        self.fracoes = fracoes
+
+    def _livre(self, sistema: str) -> int:
+        return max(0, self.num_ctx - self.reserva_resposta - estimar_tokens(sistema))
+
+    def _distribuir(self, disponivel: int, necessidade: Dict[str, int]) -> Dict[str, int]:
+        total_fracoes = sum(self.fracoes.get(s, 0) for s in self.PRIORIDADE) or 1
+        orcamento = {s: int(disponivel * self.fracoes.get(s, 0) / total_fracoes) for s in self.PRIORIDADE}
+        sobra = sum(max(0, orcamento[s] - necessidade[s]) for s in self.PRIORIDADE)
+        sobra += disponivel - sum(orcamento.values())
+        for secao in self.PRIORIDADE:
+            orcamento[secao] = min(orcamento[secao], necessidade[secao])
+        for secao in self.PRIORIDADE:
+            extra = min(sobra, necessidade[secao] - orcamento[secao])
+            orcamento[secao] += extra
+            sobra -= extra
+        return orcamento
+
+    @staticmethod
+    def _documentos(documentos: List[Document], limite: int) -> List[Document]:
+        usados, total = [], 0
+        for doc in documentos:
+            tokens = estimar_tokens(doc.page_content) + 1
+            if total + tokens > limite:
+                # O chunk mais relevante entra ao menos em parte
+                if not usados and limite > 0:
+                    usados.append(Document(id=doc.id, page_content=_cortar(doc.page_content, limite),
+                                           metadata=doc.metadata))
+                break
+            usados.append(doc)
+            total += tokens
+        return usados
+
+    def ajustar_calendario(self, sistema: str, texto: Optional[str]) -> Optional[str]:
+        """Ajusta o calendário à sua fração do prompt (depende apenas das instruções e da agenda)."""
+        if not texto:
+            return texto
+        limite = int(self._livre(sistema) * self.fracoes.get("calendario", 0))
+        if estimar_tokens(texto) <= limite:
+            return texto
+        texto = compactar_calendario(texto)
+        if estimar_tokens(texto) <= limite:
+            return texto
+
+        # Eventos em ordem cronológica: os mais distantes saem primeiro
+        eventos = texto.split("\n\n")
+        for n in range(len(eventos) - 1, 0, -1):
+            parcial = "\n\n".join(eventos[:n]) + f"\n\n(+{len(eventos) - n} eventos omitidos)"
+            if estimar_tokens(parcial) <= limite:
+                return parcial
+        return _cortar(eventos[0], limite)
+
+    @staticmethod
+    def _historico(historico: List[Tuple[str, str]], limite: int) -> List[Tuple[str, str]]:
+        mantidos, total = [], 0
+        for pergunta, resposta in reversed(historico):
+            tokens = estimar_tokens(formatar_historico([(pergunta, resposta)]))
+            if total + tokens > limite:
+                # Do último turno, ao menos a pergunta e o começo da resposta
+                if not mantidos:
+                    restante = limite - estimar_tokens(formatar_historico([(pergunta, "")]))
+                    if restante > 0:
+                        mantidos.append((pergunta, _cortar(resposta, restante)))
+                break
+            mantidos.append((pergunta, resposta))
+            total += tokens
+        return list(reversed(mantidos))
+
+    def montar(self, sistema: str, pergunta: str, documentos: List[Document],
+               calendario: Optional[str], historico: List[Tuple[str, str]],
+               resumo: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Ajusta as seções ao orçamento de tokens.
+
+        sistema é o prompt formatado com todas as seções vazias (apenas as instruções).
+        O resumo da conversa faz parte do histórico e usa no máximo metade do seu espaço.
+        Retorna as seções ajustadas e a contagem de tokens de cada uma.
+        """
+        cal = self.ajustar_calendario(sistema, calendario)
+        tokens = {
+            "sistema": estimar_tokens(sistema),
+            "calendario": estimar_tokens(cal) if cal else 0,
+            "pergunta": estimar_tokens(pergunta),
+        }
+        disponivel = max(0, self._livre(sistema) - tokens["calendario"] - tokens["pergunta"])
+        necessidade = {
+            "documentos": sum(estimar_tokens(doc.page_content) + 1 for doc in documentos),
+            "historico": estimar_tokens(formatar_resumo(resumo)) + estimar_tokens(formatar_historico(historico)),
+        }
+        orcamento = self._distribuir(disponivel, necessidade)
+
+        docs = self._documentos(documentos, orcamento["documentos"])
+        if resumo:
+            resumo = _cortar(resumo, orcamento["historico"] // 2)
+        resto = orcamento["historico"] - estimar_tokens(formatar_resumo(resumo))
+        hist = self._historico(historico, max(0, resto))
+        tokens["documentos"] = sum(estimar_tokens(doc.page_content) + 1 for doc in docs)
+        tokens["historico"] = estimar_tokens(formatar_resumo(resumo)) + estimar_tokens(formatar_historico(hist))
+        tokens["total"] = sum(tokens.values())
+        return {
+            "documentos": docs,
+            "calendario": cal,
+            "historico": hist,
+            "resumo": resumo,
+            "tokens": tokens,
+            "omitidos": {
+                "documentos": len(documentos) - len(docs),
+                "historico": len(historico) - len(hist),
+            },
+        }
@@ -0,0 +1,126 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional
+from services.context_packer import formatar_historico
+from services.llm_scheduler import AgendadorModelo, PRIORIDADE_RESUMO
+
+PROMPT_RESUMO = """Resuma a conversa abaixo entre um usuário e o assistente Jarvis1 em português do Brasil,
+em no máximo {limite} palavras. Mantenha fatos, decisões, preferências do usuário, datas e
+compromissos mencionados; descarte cumprimentos e repetições. Responda apenas com o resumo.
+
+Resumo anterior:
+{resumo}
+
+Novos turnos:
+{turnos}
+
+Resumo atualizado:"""
+
+
+class HistoricoConversa:
+    """
+    Histórico de conversa de tamanho aproximadamente constante.
+
+    Os últimos turnos_recentes turnos ficam na íntegra; os anteriores são incorporados a um
+    resumo em uma thread de segundo plano, depois que a resposta já foi entregue. Enquanto o
+    resumo não é atualizado, os turnos que saíram da janela continuam sendo devolvidos na
+    íntegra, de modo que nenhum contexto se perde. Sem modelo de resumo, os turnos antigos
+    são simplesmente descartados.
+    """
+
+    def __init__(self, llm, agendador: AgendadorModelo, turnos_recentes: int, palavras_resumo: int,
+                 executor: Optional[ThreadPoolExecutor] = None):
+        self.llm = llm
+        self.agendador = agendador
+        self.turnos_recentes = turnos_recentes
+        self.palavras_resumo = palavras_resumo
+        self.resumo = ""
+        self._turnos: List[Tuple[str, str]] = []
+        self._pendentes: List[Tuple[str, str]] = []
+        self._lock = threading.Lock()
+        # Resumos em série: dois resumos da mesma conversa não podem rodar ao mesmo tempo
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="resumo-conversa")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pendentes) + len(self._turnos)
+
+    def contexto(self) -> Tuple[str, List[Tuple[str, str]]]:
+        """Retorna o resumo e os turnos que ainda não entraram nele."""
+        with self._lock:
+            return self.resumo, self._pendentes + self._turnos
+
+    def adicionar(self, pergunta: str, resposta: str):
+        """Registra um turno e agenda a atualização do resumo, se algum turno saiu da janela."""
+        with self._lock:
+            self._turnos.append((pergunta, resposta))
+            excedentes = self._turnos[:-self.turnos_recentes] if self.turnos_recentes else self._turnos[:]
+            if not excedentes:
+                return
+            del self._turnos[:len(excedentes)]
+            if self.llm is None:
+                return
+            self._pendentes.extend(excedentes)
+        self._executor.submit(self._resumir)
+
+    def _resumir(self):
+        with self._lock:
+            pendentes = list(self._pendentes)
+            resumo = self.resumo
+        if not pendentes:
+            return
+
+        prompt = PROMPT_RESUMO.format(limite=self.palavras_resumo, resumo=resumo or "(nenhum)",
+                                      turnos=formatar_historico(pendentes).strip())
+        try:
+            with self.agendador.reservar(PRIORIDADE_RESUMO):
+                novo = self.llm.invoke(prompt).content.strip()
+        except Exception as e:
+            # Os turnos continuam pendentes e entram no próximo resumo
+            print(f"Erro ao resumir a conversa: {e}")
+            return
+
+        with self._lock:
+            self.resumo = novo
+            del self._pendentes[:len(pendentes)]
+
+
+class HistoricosConversas:
+    """
+    Um HistoricoConversa por conversa, para que clientes simultâneos não compartilhem turnos
+    nem resumo.
+
+    Guarda no máximo max_conversas históricos; ao passar do limite, o da conversa usada há
+    mais tempo é descartado. Os resumos de todas as conversas são feitos, um por vez, na
+    mesma thread de segundo plano.
+    """
+
+    def __init__(self, llm, agendador: AgendadorModelo, turnos_recentes: int, palavras_resumo: int,
+                 max_conversas: int):
+        self.llm = llm
+        self.agendador = agendador
+        self.turnos_recentes = turnos_recentes
+        self.palavras_resumo = palavras_resumo
+        self.max_conversas = max_conversas
+        self._historicos: "OrderedDict[str, HistoricoConversa]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="resumo-conversa")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._historicos)
+
+    def obter(self, conversa_id: str) -> HistoricoConversa:
+        """Histórico da conversa, criado no primeiro uso."""
+        with self._lock:
+            historico = self._historicos.get(conversa_id)
+            if historico is None:
+                historico = HistoricoConversa(self.llm, self.agendador, self.turnos_recentes,
+                                              self.palavras_resumo, self._executor)
+                self._historicos[conversa_id] = historico
+                while len(self._historicos) > self.max_conversas:
+                    self._historicos.popitem(last=False)
+            else:
+                self._historicos.move_to_end(conversa_id)
+            return historico
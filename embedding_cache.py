@@ -0,0 +1,274 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Dict, Any, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+class EmbeddingCache:
+    """Cache persistente de embeddings endereçado por (modelo, hash do texto)."""
+
+    def __init__(self, diretorio: str, modelo: str, max_mb: int):
+        os.makedirs(diretorio, exist_ok=True)
+        self.modelo = modelo
+        self.max_bytes = max_mb * 1024 * 1024
+        self.arquivo_vetores = os.path.join(
+            diretorio, f"vetores_{re.sub(r'[^A-Za-z0-9_.-]', '_', modelo)}.f32")
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(diretorio, "embeddings.db"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS vetores ("
+            "modelo TEXT NOT NULL, chave TEXT NOT NULL, slot INTEGER NOT NULL, "
+            "ultimo_acesso REAL NOT NULL, PRIMARY KEY (modelo, chave))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_acesso ON vetores (modelo, ultimo_acesso)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS dimensoes (modelo TEXT PRIMARY KEY, dimensao INTEGER NOT NULL)")
+        self._db.commit()
+
+        self.dimensao = None
+        self.capacidade = 0
+        self._vetores = None
+        self._slots_livres: List[int] = []
+
+        self.hits = 0
+        self.misses = 0
+        self.remocoes = 0
+
+        linha = self._db.execute(
+            "SELECT dimensao FROM dimensoes WHERE modelo = ?", (modelo,)).fetchone()
+        if linha:
+            self._abrir_vetores(linha[0])
+
+    @staticmethod
+    def chave(texto: str) -> str:
+        """Retorna a chave de conteúdo de um texto."""
+        return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+    def _abrir_vetores(self, dimensao: int):
+        """Abre (ou cria) o arquivo de vetores mapeado em memória."""
+        self.dimensao = dimensao
+        self.capacidade = max(1, self.max_bytes // (dimensao * 4))
+        tamanho = self.capacidade * dimensao * 4
+
+        # Ajusta o arquivo ao limite configurado, descartando slots que não cabem mais
+        with open(self.arquivo_vetores, "ab") as f:
+            f.truncate(tamanho)
+        self._db.execute(
+            "DELETE FROM vetores WHERE modelo = ? AND slot >= ?", (self.modelo, self.capacidade))
+        self._db.execute(
+            "INSERT OR REPLACE INTO dimensoes (modelo, dimensao) VALUES (?, ?)", (self.modelo, dimensao))
+        self._db.commit()
+
+        self._vetores = np.memmap(
+            self.arquivo_vetores, dtype=np.float32, mode="r+", shape=(self.capacidade, dimensao))
+
+        ocupados = {slot for (slot,) in self._db.execute(
+            "SELECT slot FROM vetores WHERE modelo = ?", (self.modelo,))}
+        self._slots_livres = sorted(set(range(self.capacidade)) - ocupados, reverse=True)
+
+    def _buscar_slots(self, chaves: List[str]) -> Dict[str, int]:
+        """Retorna o slot de cada chave presente no cache."""
+        slots = {}
+        # Consulta em lotes para respeitar o limite de parâmetros do SQLite
+        for i in range(0, len(chaves), 500):
+            lote = chaves[i:i + 500]
+            marcadores = ",".join("?" * len(lote))
+            for chave, slot in self._db.execute(
+                    f"SELECT chave, slot FROM vetores WHERE modelo = ? AND chave IN ({marcadores})",
+                    (self.modelo, *lote)):
+                slots[chave] = slot
+        return slots
+
+    def obter(self, textos: List[str]) -> List[Optional[List[float]]]:
+        """Busca os embeddings dos textos; retorna None para os ausentes."""
+        resultado: List[Optional[List[float]]] = [None] * len(textos)
+        with self._lock:
+            if self._vetores is None:
+                self.misses += len(textos)
+                return resultado
+
+            chaves = [self.chave(t) for t in textos]
+            slots = self._buscar_slots(chaves)
+
+            agora = time.time()
+            for i, chave in enumerate(chaves):
+                slot = slots.get(chave)
+                if slot is not None:
+                    resultado[i] = self._vetores[slot].tolist()
+
+            encontrados = len([r for r in resultado if r is not None])
+            self.hits += encontrados
+            self.misses += len(textos) - encontrados
+
+            if slots:
+                self._db.executemany(
+                    "UPDATE vetores SET ultimo_acesso = ? WHERE modelo = ? AND chave = ?",
+                    [(agora, self.modelo, chave) for chave in slots])
+                self._db.commit()
+
+        return resultado
+
+    def armazenar(self, textos: List[str], vetores: List[List[float]]):
+        """Armazena embeddings no cache, removendo os menos usados se necessário."""
+        if not textos:
+            return
+
+        with self._lock:
+            if self._vetores is None:
+                self._abrir_vetores(len(vetores[0]))
+
+            agora = time.time()
+            registros = {}
+            for texto, vetor in zip(textos, vetores):
+                registros[self.chave(texto)] = vetor
+
+            existentes = self._buscar_slots(list(registros))
+            novos = [chave for chave in registros if chave not in existentes]
+
+            # Despejo por tamanho: libera os slots acessados há mais tempo
+            faltando = len(novos) - len(self._slots_livres)
+            if faltando > 0:
+                antigos = self._db.execute(
+                    "SELECT chave, slot FROM vetores WHERE modelo = ? "
+                    "ORDER BY ultimo_acesso LIMIT ?", (self.modelo, faltando)).fetchall()
+                self._db.executemany(
+                    "DELETE FROM vetores WHERE modelo = ? AND chave = ?",
+                    [(self.modelo, chave) for chave, _ in antigos])
+                self._slots_livres.extend(slot for _, slot in antigos)
+                self.remocoes += len(antigos)
+
+            linhas = []
+            for chave in novos[:len(self._slots_livres)]:
+                slot = self._slots_livres.pop()
+                self._vetores[slot] = np.asarray(registros[chave], dtype=np.float32)
+                linhas.append((self.modelo, chave, slot, agora))
+
+            self._vetores.flush()
+            self._db.executemany(
+                "INSERT INTO vetores (modelo, chave, slot, ultimo_acesso) VALUES (?, ?, ?, ?)", linhas)
+            self._db.commit()
+
+    def estatisticas(self) -> Dict[str, Any]:
+        """Retorna os contadores de uso do cache."""
+        total = self.hits + self.misses
+        with self._lock:
+            entradas = self._db.execute(
+                "SELECT COUNT(*) FROM vetores WHERE modelo = ?", (self.modelo,)).fetchone()[0]
+        return {
+            "modelo": self.modelo,
+            "entradas": entradas,
+            "capacidade": self.capacidade,
+            "hits": self.hits,
+            "misses": self.misses,
+            "remocoes": self.remocoes,
+            "taxa_acerto": self.hits / total if total else 0.0,
+        }
+
+
+class CacheConsultas:
+    """Cache LRU em memória de embeddings de perguntas, com tamanho máximo e expiração."""
+
+    def __init__(self, modelo: str, max_itens: int, ttl: float):
+        self.modelo = modelo
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._itens: "OrderedDict[Tuple[str, str], Tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expirados = 0
+        self.remocoes = 0
+
+    @staticmethod
+    def normalizar(texto: str) -> str:
+        """Ignora diferenças de espaços e de maiúsculas/minúsculas entre perguntas."""
+        return " ".join(texto.split()).casefold()
+
+    def obter(self, texto: str) -> Optional[List[float]]:
+        chave = (self.modelo, self.normalizar(texto))
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None and time.monotonic() - item[0] > self.ttl:
+                del self._itens[chave]
+                self.expirados += 1
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.hits += 1
+            return item[1]
+
+    def armazenar(self, texto: str, vetor: List[float]):
+        chave = (self.modelo, self.normalizar(texto))
+        with self._lock:
+            self._itens[chave] = (time.monotonic(), vetor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+                self.remocoes += 1
+
+    def estatisticas(self) -> Dict[str, Any]:
+        """Retorna os contadores de uso do cache."""
+        total = self.hits + self.misses
+        return {
+            "modelo": self.modelo,
+            "entradas": len(self._itens),
+            "capacidade": self.max_itens,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expirados": self.expirados,
+            "remocoes": self.remocoes,
+            "taxa_acerto": self.hits / total if total else 0.0,
+        }
+
+
+class CacheEmbeddings(Embeddings):
+    """Embeddings que consultam o cache persistente antes de chamar o modelo."""
+
+    def __init__(self, base: Embeddings, cache: EmbeddingCache, consultas: Optional[CacheConsultas] = None):
+        self.base = base
+        self.cache = cache
+        self.consultas = consultas
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vetores = self.cache.obter(texts)
+        faltantes = [i for i, v in enumerate(vetores) if v is None]
+
+        if faltantes:
+            # Textos repetidos no mesmo lote são enviados ao modelo uma única vez
+            unicos = list(dict.fromkeys(texts[i] for i in faltantes))
+            calculados = dict(zip(unicos, self.base.embed_documents(unicos)))
+            self.cache.armazenar(unicos, [calculados[t] for t in unicos])
+            for i in faltantes:
+                vetores[i] = calculados[texts[i]]
+
+        return vetores
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.consultas is None:
+            return self.base.embed_query(text)
+
+        vetor = self.consultas.obter(text)
+        if vetor is None:
+            vetor = self.base.embed_query(text)
+            self.consultas.armazenar(text, vetor)
+        return vetor
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.consultas is None:
+            return await self.base.aembed_query(text)
+
+        vetor = self.consultas.obter(text)
+        if vetor is None:
+            vetor = await self.base.aembed_query(text)
+            self.consultas.armazenar(text, vetor)
+        return vetor
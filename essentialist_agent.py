@@ -1,65 +1,221 @@
 import json
-from typing import List, Tuple, Dict, Any, Optional
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FuturesTimeoutError
+from typing import List, Tuple, Dict, Any, Optional, Callable
 from datetime import datetime, timedelta
 from utils.helpers import formatar_fontes, PerformanceTimer
-from models.schemas import AgentAction, CalendarEventCreate
+from utils.tracing import rastrear, rastro_atual
+from models.schemas import AgentAction, CalendarEventCreate, RespostaOutput, RotaIntencao
 from services.vector_store import VectorStoreService
 from services.llm_service import LLMService
 from services.calendar_service import GoogleCalendarService
+from services.intent_router import RoteadorIntencoes
+from services.conversation_memory import HistoricoConversa, HistoricosConversas
+from services.llm_scheduler import agendador_modelo
+from config import (
+    ROUTER_ENABLED,
+    ROUTER_THRESHOLD,
+    HISTORY_RECENT_TURNS,
+    HISTORY_SUMMARY_ENABLED,
+    HISTORY_SUMMARY_WORDS,
+    HISTORY_SUMMARY_MAX_TOKENS,
+    HISTORY_MAX_CONVERSATIONS,
+    CALENDAR_TIMEOUT_SECONDS,
+    RETRIEVAL_TIMEOUT_SECONDS
+)
+
+# Conversa usada quando quem chama não informa uma (o CLI, com um único usuário)
+CONVERSA_PADRAO = "padrao"
 
 class EssentialistAgent:
     """Agente principal que integra RAG e Google Calendar."""
     
-    def __init__(self):
+    def __init__(self, eco_terminal: bool = True):
         # Inicializar serviços
         self.vector_store_service = VectorStoreService()
-        retriever = self.vector_store_service.carregar_ou_criar_indice().get_retriever()
-        self.llm_service = LLMService(retriever)
+        self.vector_store_service.carregar_ou_criar_indice()
+        retriever = self.vector_store_service.get_retriever()
+        self.llm_service = LLMService(retriever, eco_terminal=eco_terminal)
         self.calendar_service = GoogleCalendarService()
+        self.roteador = RoteadorIntencoes(self.vector_store_service.embeddings, ROUTER_THRESHOLD) \
+            if ROUTER_ENABLED else None
         
-        # Estado do agente
-        self.chat_history = []
+        # Estado do agente, por conversa: turnos recentes na íntegra e resumo dos anteriores
+        modelo_resumo = self.llm_service.modelo_texto(num_predict=HISTORY_SUMMARY_MAX_TOKENS) \
+            if HISTORY_SUMMARY_ENABLED else None
+        self.historicos = HistoricosConversas(modelo_resumo, agendador_modelo, HISTORY_RECENT_TURNS,
+                                              HISTORY_SUMMARY_WORDS, HISTORY_MAX_CONVERSATIONS)
+        # Etapas independentes de uma resposta (agenda e busca) rodam em paralelo, em pools
+        # separados: uma chamada à agenda que estourou o prazo não ocupa as threads da busca
+        self._agenda = ThreadPoolExecutor(max_workers=2, thread_name_prefix="agenda")
+        self._busca = ThreadPoolExecutor(max_workers=4, thread_name_prefix="busca")
     
-    def processar_entrada(self, pergunta: str) -> Dict[str, Any]:
-        """Processa a entrada do usuário e retorna uma resposta."""
-        with PerformanceTimer("Processamento da resposta"):
-            # Obter contexto da agenda para enriquecer a resposta
-            info_calendario = self._obter_info_calendario()
+    def processar_entrada(self, pergunta: str, conversa_id: str = CONVERSA_PADRAO) -> Dict[str, Any]:
+        """Processa a entrada do usuário na conversa indicada e retorna uma resposta."""
+        historico = self.historicos.obter(conversa_id)
+        with PerformanceTimer("Processamento da resposta", etapa="atendimento"):
+            with rastrear("roteamento") as span:
+                rota = self.roteador.classificar(pergunta) if self.roteador else None
+                self._informar_rota(rota, span)
             
-            # Adicionar informações do calendário à pergunta
-            pergunta_enriquecida = f"{pergunta}\n\nInformações do calendário: {info_calendario}"
+            # Comandos simples de agenda não passam pelo modelo
+            if rota and rota.destino == "calendario":
+                resultado_acao = self._executar_acao(rota.acao)
+                return self._registrar_resposta(historico, pergunta, self._resposta_acao(resultado_acao),
+                                                rota.acao, resultado_acao)
             
-            # Obter resposta do modelo
-            resposta = self.llm_service.processar_pergunta(pergunta_enriquecida, self.chat_history)
+            # A agenda (dispensada em perguntas sobre os documentos) é obtida enquanto a pergunta
+            # é preparada e os documentos são buscados; cada etapa tem seu prazo
+            inicio = time.monotonic()
+            calendario = self._submeter(self._agenda, self._obter_info_calendario) if self._usa_calendario(rota) else None
+            resumo, turnos = historico.contexto()
+            pergunta_final, consulta = self.llm_service.preparar_consulta(pergunta, turnos, resumo)
+            busca = self._submeter(self._busca, self.llm_service.buscar, consulta)
+            prazo_busca = time.monotonic() + RETRIEVAL_TIMEOUT_SECONDS
             
-            # Extrair possíveis ações de calendário da resposta
-            acao = self.llm_service.extrair_acao(resposta.answer)
-            resultado_acao = None
+            documentos = self._resultado_etapa("Busca de documentos", busca, prazo_busca, [])
+            info_calendario = self._resultado_etapa("Consulta à agenda", calendario,
+                                                    inicio + CALENDAR_TIMEOUT_SECONDS, None)
             
-            # Executar a ação se existir
-            if acao:
-                resultado_acao = self._executar_acao(acao)
-                
-            # Atualizar histórico de conversa
-            self.chat_history.append((pergunta, resposta.answer))
-            
-            # Limitar tamanho do histórico para economizar memória
-            if len(self.chat_history) > 10:
-                self.chat_history = self.chat_history[-10:]
-            
-            # Montar resultado
-            return {
-                "resposta": resposta.answer,
-                "fontes": formatar_fontes(resposta.source_documents),
-                "acao_realizada": resultado_acao,
-                "historico_atualizado": len(self.chat_history)
-            }
+            resposta = self.llm_service.responder(pergunta_final, consulta, documentos, turnos,
+                                                  info_calendario, resumo)
+            
+            # Executar a ação de calendário extraída da resposta, se houver
+            acao = resposta.acao
+            resultado_acao = self._executar_acao(acao) if acao else None
+            
+            return self._registrar_resposta(historico, pergunta, resposta, acao, resultado_acao)
+    
+    async def aprocessar_entrada(self, pergunta: str,
+                                 ao_token: Optional[Callable[[str], None]] = None,
+                                 conversa_id: str = CONVERSA_PADRAO) -> Dict[str, Any]:
+        """
+        Versão assíncrona de processar_entrada, para atender várias conversas no mesmo processo.
+        
+        ao_token recebe os trechos da resposta à medida que o modelo os gera.
+        """
+        historico = self.historicos.obter(conversa_id)
+        with PerformanceTimer("Processamento da resposta", etapa="atendimento"):
+            with rastrear("roteamento") as span:
+                rota = await self.roteador.aclassificar(pergunta) if self.roteador else None
+                self._informar_rota(rota, span)
+            
+            if rota and rota.destino == "calendario":
+                resultado_acao = await self._aexecutar_agenda(self._executar_acao, rota.acao)
+                resposta = self._resposta_acao(resultado_acao)
+                if ao_token is not None:
+                    ao_token(resposta.answer)
+                return self._registrar_resposta(historico, pergunta, resposta, rota.acao, resultado_acao)
+            
+            resumo, turnos = historico.contexto()
+            
+            async def buscar():
+                pergunta_final, consulta = await self.llm_service.apreparar_consulta(pergunta, turnos, resumo)
+                documentos = await self._aresultado_etapa(
+                    "Busca de documentos", self.llm_service.abuscar(consulta), RETRIEVAL_TIMEOUT_SECONDS, [])
+                return pergunta_final, consulta, documentos
+            
+            async def obter_calendario():
+                if not self._usa_calendario(rota):
+                    return None
+                return await self._aresultado_etapa(
+                    "Consulta à agenda", self._aexecutar_agenda(self._obter_info_calendario),
+                    CALENDAR_TIMEOUT_SECONDS, None)
+            
+            (pergunta_final, consulta, documentos), info_calendario = await asyncio.gather(
+                buscar(), obter_calendario())
+            
+            resposta = await self.llm_service.aresponder(
+                pergunta_final, consulta, documentos, turnos, info_calendario, resumo, ao_token)
+            
+            acao = resposta.acao
+            resultado_acao = await self._aexecutar_agenda(self._executar_acao, acao) if acao else None
+            
+            return self._registrar_resposta(historico, pergunta, resposta, acao, resultado_acao)
+    
+    @staticmethod
+    def _submeter(executor: ThreadPoolExecutor, funcao: Callable, *args) -> Future:
+        """Executa uma etapa no pool, mantendo o rastro da requisição."""
+        return executor.submit(contextvars.copy_context().run, funcao, *args)
+    
+    async def _aexecutar_agenda(self, funcao: Callable, *args) -> Any:
+        """Executa uma chamada à agenda no pool próprio, fora do executor padrão do event loop."""
+        return await asyncio.wrap_future(self._submeter(self._agenda, funcao, *args))
+    
+    @staticmethod
+    def _resultado_etapa(nome: str, futuro: Optional[Future], prazo: float, padrao: Any) -> Any:
+        """Aguarda uma etapa até o prazo (instante monotônico); depois dele, segue com o valor padrão."""
+        if futuro is None:
+            return padrao
+        try:
+            return futuro.result(timeout=max(0.0, prazo - time.monotonic()))
+        except FuturesTimeoutError:
+            print(f"{nome} excedeu o prazo; a resposta segue sem ela")
+            return padrao
+    
+    @staticmethod
+    async def _aresultado_etapa(nome: str, etapa, tempo_limite: float, padrao: Any) -> Any:
+        try:
+            return await asyncio.wait_for(etapa, tempo_limite)
+        except asyncio.TimeoutError:
+            print(f"{nome} excedeu o prazo; a resposta segue sem ela")
+            return padrao
+    
+    @staticmethod
+    def _informar_rota(rota: Optional[RotaIntencao], span: Dict[str, Any]):
+        if rota is not None:
+            span["destino"] = rota.destino
+            print(f"Rota: {rota.destino} ({rota.motivo})")
+    
+    @staticmethod
+    def _usa_calendario(rota: Optional[RotaIntencao]) -> bool:
+        return rota is None or rota.destino != "conhecimento"
+    
+    @staticmethod
+    def _resposta_acao(resultado_acao: Dict[str, Any]) -> RespostaOutput:
+        """Resposta de uma ação executada diretamente, sem geração."""
+        texto = resultado_acao["mensagem"]
+        if resultado_acao.get("dados") and isinstance(resultado_acao["dados"], str):
+            texto = f"{texto}\n\n{resultado_acao['dados']}"
+        return RespostaOutput(answer=texto, source_documents=[])
+    
+    def _registrar_resposta(self, historico: HistoricoConversa, pergunta: str, resposta: RespostaOutput,
+                            acao: Optional[AgentAction], resultado_acao: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Atualiza o histórico e os caches após uma resposta e monta o resultado."""
+        # Respostas guardadas podem ter ficado desatualizadas com a alteração da agenda
+        if acao and acao.action_type in ("criar_evento", "atualizar_evento", "excluir_evento") \
+                and resultado_acao.get("sucesso") and self.llm_service.cache_respostas:
+            self.llm_service.cache_respostas.invalidar()
+        
+        # Atualizar histórico de conversa (o resumo dos turnos antigos é feito em segundo plano)
+        historico.adicionar(pergunta, resposta.answer)
+        
+        # Montar resultado
+        return {
+            "resposta": resposta.answer,
+            "fontes": formatar_fontes(resposta.source_documents),
+            "acao_realizada": resultado_acao,
+            "historico_atualizado": len(historico),
+            "tokens_prompt": resposta.tokens_prompt,
+            "metricas_geracao": resposta.metricas_geracao,
+            "trace_id": rastro_atual()
+        }
+    
+    def aquecer(self):
+        """Carrega o modelo de linguagem com o início fixo do prompt e os exemplos do roteador."""
+        self.llm_service.aquecer(self._obter_info_calendario())
+        if self.roteador:
+            self.roteador.preparar()
     
     def _obter_info_calendario(self) -> str:
         """Obtém informações recentes do calendário para contexto."""
         try:
             # Obter eventos dos próximos 3 dias
-            eventos = self.calendar_service.listar_eventos(dias=3)
+            with rastrear("agenda") as span:
+                eventos = self.calendar_service.listar_eventos(dias=3)
+                span["eventos"] = len(eventos)
             return self.calendar_service.formatar_eventos(eventos)
         except Exception as e:
             print(f"Erro ao obter informações do calendário: {e}")
@@ -67,6 +223,12 @@ class EssentialistAgent:
     
     def _executar_acao(self, acao: AgentAction) -> Dict[str, Any]:
         """Executa uma ação no calendário com base na instrução do agente."""
+        with rastrear("acao", tipo=acao.action_type) as span:
+            resultado = self._despachar_acao(acao)
+            span["sucesso"] = resultado.get("sucesso", False)
+        return resultado
+    
+    def _despachar_acao(self, acao: AgentAction) -> Dict[str, Any]:
         resultado = {"sucesso": False, "mensagem": "Ação não reconhecida", "dados": None}
         
         try:
@@ -2,7 +2,8 @@ import os
 import time
 from datetime import datetime, timedelta
 import pytz
-from typing import List, Any
+from typing import List, Any, Optional
+from utils.tracing import rastrear
 
 def formatar_fontes(source_docs: List[Any]) -> str:
     """Formata as fontes de documentos para exibição."""
@@ -20,18 +21,31 @@ def formatar_fontes(source_docs: List[Any]) -> str:
     return "\n".join(fontes)
 
 class PerformanceTimer:
-    """Utilitário para medir performance de operações."""
-    def __init__(self, nome_operacao: str = "Operação"):
+    """
+    Utilitário para medir performance de operações.
+    
+    Com etapa, a duração também entra no histograma da etapa e no rastro da requisição;
+    atributos recebe informações extras para o rastro.
+    """
+    def __init__(self, nome_operacao: str = "Operação", etapa: Optional[str] = None):
         self.nome_operacao = nome_operacao
+        self.etapa = etapa
         self.inicio = None
+        self.atributos = {}
+        self._rastreio = None
         
     def __enter__(self):
+        if self.etapa:
+            self._rastreio = rastrear(self.etapa)
+            self.atributos = self._rastreio.__enter__()
         self.inicio = time.time()
         return self
         
     def __exit__(self, *args):
         duracao = time.time() - self.inicio
         print(f"{self.nome_operacao} concluída em {duracao:.2f} segundos")
+        if self._rastreio is not None:
+            self._rastreio.__exit__(*args)
 
 def formatar_evento_calendario(evento: dict) -> str:
     """Formata um evento do Google Calendar para exibição amigável."""
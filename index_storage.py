@@ -0,0 +1,178 @@
+import os
+import json
+import sqlite3
+import threading
+from collections.abc import Mapping
+from typing import Dict, List, Iterator, Union
+import faiss
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+ARQUIVO_INDICE = "index.faiss"
+ARQUIVO_DOCSTORE = "docstore.db"
+ARQUIVO_PICKLE = "index.pkl"
+
+class DocstoreSQLite(Docstore, AddableMixin):
+    """Docstore em SQLite: texto e metadados dos chunks são lidos do disco sob demanda."""
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        # Remoções renumeram as posições do FAISS; o mapa salvo precisa ser regravado
+        self.posicoes_invalidas = False
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        self.conexao = sqlite3.connect(caminho, check_same_thread=False)
+        self.conexao.execute("PRAGMA journal_mode=WAL")
+        self.conexao.executescript(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "  id TEXT PRIMARY KEY, conteudo TEXT NOT NULL, metadados TEXT NOT NULL) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS posicoes (pos INTEGER PRIMARY KEY, id TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_posicoes_id ON posicoes (id);"
+        )
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        with self._lock:
+            self.conexao.executemany(
+                "INSERT OR REPLACE INTO chunks (id, conteudo, metadados) VALUES (?, ?, ?)",
+                [(chunk_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+                 for chunk_id, doc in texts.items()])
+
+    def delete(self, ids: List) -> None:
+        with self._lock:
+            self.conexao.executemany("DELETE FROM chunks WHERE id = ?", [(i,) for i in ids])
+
+    def search(self, search: str) -> Union[str, Document]:
+        with self._lock:
+            linha = self.conexao.execute(
+                "SELECT conteudo, metadados FROM chunks WHERE id = ?", (search,)).fetchone()
+        if linha is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=linha[0], metadata=json.loads(linha[1]))
+
+    def salvar_posicoes(self, index_to_docstore_id: Mapping):
+        """Grava o mapa posição -> id, acrescentando apenas as posições novas."""
+        if isinstance(index_to_docstore_id, MapeamentoSQLite):
+            return
+        with self._lock:
+            if self.posicoes_invalidas:
+                self.conexao.execute("DELETE FROM posicoes")
+                self.posicoes_invalidas = False
+            salvas = self.conexao.execute("SELECT COUNT(*) FROM posicoes").fetchone()[0]
+            self.conexao.executemany(
+                "INSERT INTO posicoes (pos, id) VALUES (?, ?)",
+                [(pos, chunk_id) for pos, chunk_id in index_to_docstore_id.items() if pos >= salvas])
+
+    def commit(self):
+        with self._lock:
+            self.conexao.commit()
+
+    def descartar(self):
+        """Desfaz as alterações feitas desde o último commit."""
+        with self._lock:
+            self.conexao.rollback()
+
+
+class MapeamentoSQLite(Mapping):
+    """Mapa posição -> id do chunk consultado no SQLite, sem carregá-lo em memória."""
+
+    def __init__(self, docstore: DocstoreSQLite):
+        self.docstore = docstore
+        with docstore._lock:
+            self._tamanho = docstore.conexao.execute("SELECT COUNT(*) FROM posicoes").fetchone()[0]
+
+    def __getitem__(self, pos: int) -> str:
+        with self.docstore._lock:
+            linha = self.docstore.conexao.execute(
+                "SELECT id FROM posicoes WHERE pos = ?", (int(pos),)).fetchone()
+        if linha is None:
+            raise KeyError(pos)
+        return linha[0]
+
+    def __len__(self) -> int:
+        return self._tamanho
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self._tamanho))
+
+    def items(self):
+        with self.docstore._lock:
+            return self.docstore.conexao.execute("SELECT pos, id FROM posicoes ORDER BY pos").fetchall()
+
+    def values(self):
+        return [chunk_id for _, chunk_id in self.items()]
+
+    def posicoes(self, ids: List[str]) -> Dict[str, int]:
+        """Retorna a posição de cada id no índice."""
+        resultado = {}
+        with self.docstore._lock:
+            for i in range(0, len(ids), 500):
+                lote = ids[i:i + 500]
+                marcadores = ",".join("?" * len(lote))
+                resultado.update((chunk_id, pos) for pos, chunk_id in self.docstore.conexao.execute(
+                    f"SELECT pos, id FROM posicoes WHERE id IN ({marcadores})", lote))
+        return resultado
+
+
+def novo_docstore(caminho: str) -> DocstoreSQLite:
+    """Cria o docstore de um índice salvo em caminho."""
+    return DocstoreSQLite(os.path.join(caminho, ARQUIVO_DOCSTORE))
+
+def salvar_indice(vector_store: FAISS, caminho: str):
+    """
+    Salva o índice FAISS e os chunks (SQLite) em caminho.
+
+    caminho deve ser uma versão ainda não publicada: os arquivos são sobrescritos no lugar.
+    """
+    os.makedirs(caminho, exist_ok=True)
+    docstore = vector_store.docstore
+    if not isinstance(docstore, DocstoreSQLite) or docstore.caminho != os.path.join(caminho, ARQUIVO_DOCSTORE):
+        # Conversão de um índice no formato anterior (docstore em memória)
+        destino = novo_docstore(caminho)
+        destino.add({chunk_id: docstore.search(chunk_id)
+                     for chunk_id in vector_store.index_to_docstore_id.values()})
+        destino.posicoes_invalidas = True
+        vector_store.docstore = docstore = destino
+
+    # O índice é gravado antes do docstore: as posições salvas nunca apontam além dele
+    temporario = os.path.join(caminho, ARQUIVO_INDICE + ".tmp")
+    faiss.write_index(vector_store.index, temporario)
+    os.replace(temporario, os.path.join(caminho, ARQUIVO_INDICE))
+
+    docstore.salvar_posicoes(vector_store.index_to_docstore_id)
+    docstore.commit()
+
+def carregar_indice(caminho: str, embeddings: Embeddings, mmap: bool = True) -> FAISS:
+    """
+    Carrega o índice salvo em caminho.
+
+    Com mmap=True os vetores são mapeados do arquivo, sem cópia para a memória do processo,
+    e o mapa de posições fica no SQLite. O índice mapeado é somente leitura: use
+    indice_gravavel antes de inserir ou remover vetores.
+    """
+    if not os.path.exists(os.path.join(caminho, ARQUIVO_DOCSTORE)):
+        # Formato anterior (pickle, gerado pelo próprio serviço): convertido uma única vez
+        print("Convertendo índice vetorial para o formato SQLite...")
+        antigo = FAISS.load_local(caminho, embeddings, allow_dangerous_deserialization=True)
+        salvar_indice(antigo, caminho)
+        os.remove(os.path.join(caminho, ARQUIVO_PICKLE))
+
+    docstore = novo_docstore(caminho)
+    if mmap:
+        index = faiss.read_index(os.path.join(caminho, ARQUIVO_INDICE), faiss.IO_FLAG_MMAP_IFC)
+        vector_store = FAISS(embeddings, index, docstore, MapeamentoSQLite(docstore))
+        vector_store.somente_leitura = True
+        return vector_store
+
+    index = faiss.read_index(os.path.join(caminho, ARQUIVO_INDICE))
+    return FAISS(embeddings, index, docstore, dict(MapeamentoSQLite(docstore).items()))
+
+def indice_gravavel(vector_store: FAISS, caminho: str) -> FAISS:
+    """Retorna uma cópia em memória, que aceita alterações, de um índice mapeado."""
+    if not getattr(vector_store, "somente_leitura", False):
+        return vector_store
+    # Alterar um índice mapeado aborta o processo dentro do FAISS
+    index = faiss.read_index(os.path.join(caminho, ARQUIVO_INDICE))
+    return FAISS(vector_store.embedding_function, index, vector_store.docstore,
+                 dict(vector_store.index_to_docstore_id.items()))
@@ -0,0 +1,64 @@
+import os
+import time
+import threading
+from typing import Dict, Tuple
+from config import WATCH_POLL_INTERVAL, WATCH_DEBOUNCE_SECONDS
+
+class IndexWatcher:
+    """Monitora o diretório de notas e atualiza o índice vetorial em segundo plano."""
+
+    def __init__(self, vector_store_service, intervalo: float = WATCH_POLL_INTERVAL,
+                 espera: float = WATCH_DEBOUNCE_SECONDS):
+        self.vector_store_service = vector_store_service
+        self.intervalo = intervalo
+        self.espera = espera
+        self._parar = threading.Event()
+        self._thread = None
+
+    def _estado(self) -> Dict[str, Tuple[float, int]]:
+        """Retorna (data de modificação, tamanho) de cada arquivo Markdown."""
+        estado = {}
+        for raiz, _, nomes in os.walk(self.vector_store_service.diretorio_docs):
+            for nome in nomes:
+                if nome.endswith(".md"):
+                    caminho = os.path.join(raiz, nome)
+                    try:
+                        info = os.stat(caminho)
+                    except FileNotFoundError:
+                        continue
+                    estado[caminho] = (info.st_mtime, info.st_size)
+        return estado
+
+    def iniciar(self):
+        """Inicia o monitoramento em uma thread de segundo plano."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._executar, name="index-watcher", daemon=True)
+        self._thread.start()
+        print(f"Monitorando alterações em {self.vector_store_service.diretorio_docs}")
+
+    def parar(self):
+        """Interrompe o monitoramento."""
+        self._parar.set()
+        if self._thread:
+            self._thread.join(timeout=self.intervalo * 2)
+
+    def _executar(self):
+        ultimo_estado = self._estado()
+        ultima_alteracao = None
+
+        while not self._parar.wait(self.intervalo):
+            estado = self._estado()
+            if estado != ultimo_estado:
+                ultimo_estado = estado
+                ultima_alteracao = time.monotonic()
+                continue
+
+            # Debounce: espera as edições pararem antes de reindexar
+            if ultima_alteracao and time.monotonic() - ultima_alteracao >= self.espera:
+                ultima_alteracao = None
+                try:
+                    self.vector_store_service.atualizar_em_paralelo()
+                except Exception as e:
+                    print(f"Erro ao atualizar o índice vetorial: {e}")
@@ -0,0 +1,183 @@
+import re
+import asyncio
+import threading
+import unicodedata
+from typing import List, Optional, Dict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from models.schemas import AgentAction, RotaIntencao
+
+# Frases de exemplo de cada intenção para a comparação por embeddings
+EXEMPLOS_INTENCAO: Dict[str, List[str]] = {
+    "agenda": [
+        "Como está meu dia amanhã?",
+        "Estou livre na sexta à tarde?",
+        "O que tenho para fazer hoje?",
+        "Tenho alguma reunião esta semana?",
+        "Consigo encaixar uma hora de estudo amanhã?",
+        "Como posso organizar minha semana com os compromissos que tenho?",
+    ],
+    "conhecimento": [
+        "O que é essencialismo?",
+        "Quais são os princípios do essencialismo?",
+        "Como dizer não sem culpa?",
+        "Por que devo eliminar o que não é essencial?",
+        "Explique a diferença entre essencialista e não essencialista.",
+        "Como priorizar o que realmente importa?",
+    ],
+}
+
+_PALAVRAS_AGENDA = re.compile(
+    r"\b(agenda|calendario|eventos?|compromissos?|reuni(oes|ao)|horarios?|tempo livre|livre|"
+    r"hoje|amanha|semana|dia|dias|data|marcad[oa]s?|agendad[oa]s?)\b")
+_VERBOS_ALTERACAO = re.compile(
+    r"\b(cri(e|ar)|marcar|marque|agend(ar|e)|adicion(ar|e)|inclu(ir|a)|mov(er|a)|remarcar|remarque|"
+    r"alter(ar|e)|atualiz(ar|e)|mud(ar|e)|cancel(ar|e)|exclu(ir|a)|remov(er|a)|apag(ar|ue)|busc(ar|que)|"
+    r"procur(ar|e)|encontr(ar|e))\b")
+# A ação direta só vale para comandos claros sobre a agenda: um verbo no imperativo,
+# "quais são meus ..." ou "estou livre"
+_COMANDO_AGENDA = re.compile(
+    r"^\W*(me )?(liste|listar|mostre|mostra|exiba|exibir|veja|ver|consulte|verifique|analise|diga|informe)\b"
+    r"|^\W*quais sao (os |as )?(meus|minhas)\b|^\W*estou livre\b")
+# "O que tenho ..." e "tenho ..." só são comandos quando citam a agenda ou um período
+# ("o que tenho aprendido", "tenho dúvidas" não são)
+_PERGUNTA_TENHO = re.compile(r"\bo que (eu )?tenho\b|^\W*(eu )?tenho\b")
+_PERIODO = re.compile(r"\b(hoje|amanha|semana)\b")
+# Perguntas de por que, como, importância ou sobre o essencialismo vão para o RAG, mesmo citando a agenda
+_CONCEITUAL = re.compile(
+    r"\b(por ?que|como|importancia|importante|significa|sentido|deveria|devo|devemos|segundo|"
+    r"essencialis\w*|principios?|vale a pena|beneficios?|de forma|maneira|jeito)\b")
+# A listagem direta cobre apenas os próximos dias a partir de hoje
+_DATA_ESPECIFICA = re.compile(
+    r"\b(segunda|terca|quarta|quinta|sexta|sabado|domingo|ontem|passad[oa]s?|fim de semana|"
+    r"proxim[oa] (semana|mes)|(semana|mes) que vem|dia \d{1,2}|\d{1,2}/\d{1,2})\b")
+_EVENTOS = re.compile(r"\b(eventos?|compromissos?|reuni(oes|ao)|agenda)\b")
+# A listagem direta exige que a pergunta seja sobre a agenda do próprio usuário
+_PROPRIA_AGENDA = re.compile(r"\b(meus|minhas|meu|minha|hoje|amanha|semana|proxim[oa]s?)\b")
+_TEMPO_LIVRE = re.compile(r"\b(tempo livre|horarios? livres?|periodos? livres?|janelas? livres?|estou livre)\b")
+_DIAS = re.compile(r"\b(\d{1,2})\s+dias\b")
+
+
+def _normalizar(texto: str) -> str:
+    """Minúsculas e sem acentos, para as regras de palavras-chave."""
+    texto = unicodedata.normalize("NFKD", texto.casefold())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def _dias_mencionados(texto: str, padrao: int) -> int:
+    """Quantidade de dias a partir de hoje que a pergunta cobre."""
+    encontrado = _DIAS.search(texto)
+    if encontrado:
+        return max(1, int(encontrado.group(1)))
+    if re.search(r"\bhoje\b", texto):
+        return 1
+    if re.search(r"\bamanha\b", texto):
+        return 2
+    if re.search(r"\bsemana\b", texto):
+        return 7
+    if re.search(r"\bmes\b", texto):
+        return 30
+    return padrao
+
+
+class RoteadorIntencoes:
+    """
+    Decide, antes do RAG, quais etapas uma entrada precisa.
+
+    - "calendario": comandos claros sobre a agenda do usuário (listar eventos, analisar tempo
+      livre) viram uma ação direta, sem busca nem geração. Perguntas de por que, como ou
+      importância e menções a dias específicos nunca seguem esta rota.
+    - "conhecimento": perguntas sobre os documentos dispensam a consulta à agenda.
+    - "completo": agenda e documentos, como antes (inclusive para criar, alterar ou excluir
+      eventos, que dependem do modelo para extrair os parâmetros).
+
+    Primeiro valem regras de palavras-chave; sem nenhuma indicação de agenda, a pergunta é
+    comparada com frases de exemplo pelo embedding, que é o mesmo usado pela busca e fica no
+    cache de consultas. Na dúvida, a rota é "completo".
+    """
+
+    def __init__(self, embeddings: Embeddings, limiar: float):
+        self.embeddings = embeddings
+        self.limiar = limiar
+        self._exemplos: Optional[Dict[str, np.ndarray]] = None
+        self._lock = threading.Lock()
+
+    def preparar(self) -> Optional[Dict[str, np.ndarray]]:
+        """Embeddings normalizados dos exemplos, calculados uma vez (e guardados no cache persistente)."""
+        with self._lock:
+            if self._exemplos is None:
+                try:
+                    exemplos = {}
+                    for intencao, frases in EXEMPLOS_INTENCAO.items():
+                        vetores = np.asarray(self.embeddings.embed_documents(frases), dtype=np.float32)
+                        normas = np.linalg.norm(vetores, axis=1, keepdims=True)
+                        exemplos[intencao] = vetores / np.where(normas == 0, 1, normas)
+                    self._exemplos = exemplos
+                except Exception as e:
+                    print(f"Erro ao preparar o roteador de intenções: {e}")
+                    return None
+            return self._exemplos
+
+    @staticmethod
+    def _comando_agenda(texto: str) -> bool:
+        if _COMANDO_AGENDA.search(texto):
+            return True
+        return bool(_PERGUNTA_TENHO.search(texto)) and bool(
+            _EVENTOS.search(texto) or _TEMPO_LIVRE.search(texto) or _PERIODO.search(texto))
+
+    def _por_regras(self, texto: str) -> Optional[RotaIntencao]:
+        if _VERBOS_ALTERACAO.search(texto):
+            if _PALAVRAS_AGENDA.search(texto):
+                return RotaIntencao(destino="completo", motivo="alteração ou busca na agenda")
+            return None
+        if self._comando_agenda(texto) and not _CONCEITUAL.search(texto) \
+                and not _DATA_ESPECIFICA.search(texto):
+            if _TEMPO_LIVRE.search(texto):
+                acao = AgentAction(action_type="analisar_tempo_livre",
+                                   params={"dias": _dias_mencionados(texto, 7)})
+                return RotaIntencao(destino="calendario", acao=acao, motivo="tempo livre")
+            if (_EVENTOS.search(texto) or "o que" in texto) and _PROPRIA_AGENDA.search(texto):
+                acao = AgentAction(action_type="listar_eventos",
+                                   params={"dias": _dias_mencionados(texto, 7)})
+                return RotaIntencao(destino="calendario", acao=acao, motivo="listagem de eventos")
+        if _PALAVRAS_AGENDA.search(texto):
+            return RotaIntencao(destino="completo", motivo="menção à agenda")
+        return None
+
+    def _por_exemplos(self, vetor: List[float]) -> RotaIntencao:
+        exemplos = self.preparar()
+        if exemplos is None:
+            return RotaIntencao(destino="completo", motivo="roteador indisponível")
+
+        consulta = np.asarray(vetor, dtype=np.float32)
+        consulta = consulta / (np.linalg.norm(consulta) or 1)
+        similaridades = {intencao: float(np.max(vetores @ consulta)) for intencao, vetores in exemplos.items()}
+        intencao = max(similaridades, key=similaridades.get)
+        if intencao == "conhecimento" and similaridades[intencao] >= self.limiar:
+            return RotaIntencao(destino="conhecimento",
+                                motivo=f"exemplos de conhecimento ({similaridades[intencao]:.2f})")
+        return RotaIntencao(destino="completo", motivo=f"exemplos de {intencao} ({similaridades[intencao]:.2f})")
+
+    def classificar(self, pergunta: str) -> RotaIntencao:
+        rota = self._por_regras(_normalizar(pergunta))
+        if rota is not None:
+            return rota
+        try:
+            vetor = self.embeddings.embed_query(pergunta)
+        except Exception as e:
+            print(f"Erro ao classificar a intenção: {e}")
+            return RotaIntencao(destino="completo", motivo="roteador indisponível")
+        return self._por_exemplos(vetor)
+
+    async def aclassificar(self, pergunta: str) -> RotaIntencao:
+        rota = self._por_regras(_normalizar(pergunta))
+        if rota is not None:
+            return rota
+        if self._exemplos is None:
+            await asyncio.to_thread(self.preparar)
+        try:
+            vetor = await self.embeddings.aembed_query(pergunta)
+        except Exception as e:
+            print(f"Erro ao classificar a intenção: {e}")
+            return RotaIntencao(destino="completo", motivo="roteador indisponível")
+        return self._por_exemplos(vetor)
@@ -0,0 +1,150 @@
+import re
+import json
+from typing import Optional, Dict, Any, Callable, List
+
+_DECODIFICADOR = json.JSONDecoder()
+_HEX4 = re.compile(r"[0-9a-fA-F]{4}")
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+def completar_json(texto: str) -> str:
+    """
+    Fecha a string, os arrays e os objetos deixados abertos por um JSON truncado.
+
+    Se o texto terminar no meio de uma chave ou de um literal ("ac, tr), o trecho pendente é
+    descartado até o último membro completo antes de fechar. Retorna o texto fechado da forma
+    mais simples quando nenhum corte produz um JSON válido.
+    """
+    pilha: List[str] = []
+    # Posições em que o texto pode ser cortado, com os fechamentos necessários em cada uma
+    cortes: List[tuple] = []
+    em_string = escapado = False
+    ultimo_escape = -1
+    for i, caractere in enumerate(texto):
+        if em_string:
+            if escapado:
+                escapado = False
+            elif caractere == "\\":
+                escapado = True
+                ultimo_escape = i
+            elif caractere == '"':
+                em_string = False
+                cortes.append((i + 1, "".join(reversed(pilha))))
+        elif caractere == '"':
+            em_string = True
+        elif caractere in "{[":
+            pilha.append("}" if caractere == "{" else "]")
+            cortes.append((i + 1, "".join(reversed(pilha))))
+        elif caractere in "}]" and pilha:
+            pilha.pop()
+            cortes.append((i + 1, "".join(reversed(pilha))))
+        elif caractere == ",":
+            cortes.append((i, "".join(reversed(pilha))))
+
+    fechado = texto
+    if em_string:
+        # Escape incompleto no fim da string (\ ou \u sem os quatro dígitos)
+        if escapado or (texto[ultimo_escape + 1:ultimo_escape + 2] == "u" and len(texto) - ultimo_escape < 6):
+            fechado = texto[:ultimo_escape]
+        fechado += '"'
+    fechado += "".join(reversed(pilha))
+
+    candidatos = [fechado] + [texto[:posicao] + fechamento for posicao, fechamento in reversed(cortes[-16:])]
+    for candidato in candidatos:
+        try:
+            _DECODIFICADOR.raw_decode(candidato)
+            return candidato
+        except json.JSONDecodeError:
+            continue
+    return fechado
+
+
+def extrair_objeto_json(texto: str, aceitar: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                        completar: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Retorna o primeiro objeto JSON do texto aceito pelo filtro.
+
+    Objetos aninhados são lidos por inteiro. Se o texto terminar no meio de um objeto (geração
+    interrompida), o trecho final é completado antes da leitura, a menos que completar=False.
+    """
+    inicio = texto.find("{")
+    while inicio != -1:
+        candidatos = (texto, completar_json(texto[inicio:])) if completar else (texto,)
+        for candidato in candidatos:
+            try:
+                objeto, _ = _DECODIFICADOR.raw_decode(candidato, inicio if candidato is texto else 0)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(objeto, dict) and (aceitar is None or aceitar(objeto)):
+                return objeto
+            break
+        inicio = texto.find("{", inicio + 1)
+    return None
+
+
+class CampoTextoIncremental:
+    """
+    Decodifica o valor de um campo de texto de um JSON recebido aos pedaços.
+
+    Cada chamada a alimentar devolve apenas os caracteres do campo que ficaram completos com o
+    novo pedaço, de modo que o texto pode ser exibido enquanto o JSON ainda está sendo gerado.
+    """
+
+    def __init__(self, campo: str):
+        self._chave = re.compile(r'"%s"\s*:\s*"' % re.escape(campo))
+        self._buffer = ""
+        self._posicao: Optional[int] = None
+        self.concluido = False
+
+    def alimentar(self, pedaco: str) -> str:
+        if self.concluido:
+            return ""
+        self._buffer += pedaco
+        if self._posicao is None:
+            encontrado = self._chave.search(self._buffer)
+            if encontrado is None:
+                return ""
+            self._posicao = encontrado.end()
+
+        saida = []
+        i = self._posicao
+        while i < len(self._buffer):
+            caractere = self._buffer[i]
+            if caractere == '"':
+                self.concluido = True
+                i += 1
+                break
+            if caractere != "\\":
+                saida.append(caractere)
+                i += 1
+                continue
+            # Sequência de escape incompleta: aguarda o próximo pedaço
+            if i + 1 >= len(self._buffer):
+                break
+            codigo = self._buffer[i + 1]
+            if codigo == "u":
+                if i + 6 > len(self._buffer):
+                    break
+                digitos = self._buffer[i + 2:i + 6]
+                # Escape malformado (\uZZZZ): vira U+FFFD, como os substitutos isolados
+                valor = int(digitos, 16) if _HEX4.fullmatch(digitos) else 0xFFFD
+                if 0xD800 <= valor <= 0xDBFF:
+                    # Primeira metade de um par substituto (emojis): precisa da segunda
+                    seguinte = self._buffer[i + 6:i + 12]
+                    if len(seguinte) < 6 and "\\u".startswith(seguinte[:2]):
+                        break
+                    if re.fullmatch(r"\\u[dD][c-fC-F][0-9a-fA-F]{2}", seguinte):
+                        baixo = int(seguinte[2:], 16)
+                        saida.append(chr(0x10000 + ((valor - 0xD800) << 10) + (baixo - 0xDC00)))
+                        i += 12
+                        continue
+                    valor = 0xFFFD
+                elif 0xDC00 <= valor <= 0xDFFF:
+                    valor = 0xFFFD
+                saida.append(chr(valor))
+                i += 6
+            else:
+                saida.append(_ESCAPES.get(codigo, codigo))
+                i += 2
+        self._posicao = i
+        return "".join(saida)
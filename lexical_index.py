@@ -0,0 +1,145 @@
+import os
+import re
+import math
+import sqlite3
+import unicodedata
+from collections import Counter, defaultdict
+from contextlib import closing
+from typing import Dict, List, Tuple, Optional
+
+# Palavras muito frequentes que não ajudam a ranquear
+STOPWORDS = {
+    "a", "o", "as", "os", "um", "uma", "uns", "umas", "de", "do", "da", "dos", "das", "em", "no",
+    "na", "nos", "nas", "por", "para", "com", "sem", "e", "ou", "que", "se", "como", "mais",
+    "mas", "ao", "aos", "pelo", "pela", "pelos", "pelas", "eu", "voce", "meu", "minha", "seu",
+    "sua", "isso", "isto", "esse", "essa", "este", "esta", "ser", "ter", "sobre", "qual", "quais",
+    "the", "of", "and", "to", "in", "is", "on", "for"
+}
+
+def tokenizar(texto: str) -> List[str]:
+    """Normaliza (minúsculas, sem acentos) e divide o texto em termos."""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return [t for t in re.findall(r"\w+", texto) if len(t) > 1 and t not in STOPWORDS]
+
+class IndiceLexico:
+    """Índice invertido BM25 persistido em SQLite, mantido junto ao índice FAISS."""
+
+    def __init__(self, caminho: str, k1: float = 1.2, b: float = 0.75):
+        self.caminho = caminho
+        self.k1 = k1
+        self.b = b
+        self._escrita: Optional[sqlite3.Connection] = None
+
+    def existe(self) -> bool:
+        return os.path.exists(self.caminho)
+
+    def _conectar(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.caminho), exist_ok=True)
+        conexao = sqlite3.connect(self.caminho, check_same_thread=False)
+        conexao.execute("PRAGMA journal_mode=WAL")
+        conexao.executescript(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "  num INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, comprimento INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS postings ("
+            "  termo TEXT NOT NULL, num INTEGER NOT NULL, tf INTEGER NOT NULL,"
+            "  PRIMARY KEY (termo, num)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS idx_postings_num ON postings (num);"
+        )
+        return conexao
+
+    def _conexao_escrita(self) -> sqlite3.Connection:
+        # Alterações ficam em uma transação aberta até salvar(), acompanhando os checkpoints do FAISS
+        if self._escrita is None:
+            self._escrita = self._conectar()
+        return self._escrita
+
+    def adicionar(self, ids: List[str], textos: List[str]):
+        """Adiciona chunks ao índice."""
+        conexao = self._conexao_escrita()
+        for chunk_id, texto in zip(ids, textos):
+            termos = Counter(tokenizar(texto))
+            # Reindexar um chunk existente não pode deixar postings órfãos
+            conexao.execute(
+                "DELETE FROM postings WHERE num = (SELECT num FROM chunks WHERE id = ?)", (chunk_id,))
+            cursor = conexao.execute(
+                "INSERT OR REPLACE INTO chunks (id, comprimento) VALUES (?, ?)",
+                (chunk_id, sum(termos.values())))
+            num = cursor.lastrowid
+            conexao.executemany(
+                "INSERT INTO postings (termo, num, tf) VALUES (?, ?, ?)",
+                [(termo, num, tf) for termo, tf in termos.items()])
+
+    def remover(self, ids: List[str]):
+        """Remove chunks do índice."""
+        conexao = self._conexao_escrita()
+        for i in range(0, len(ids), 500):
+            lote = ids[i:i + 500]
+            marcadores = ",".join("?" * len(lote))
+            nums = [num for (num,) in conexao.execute(
+                f"SELECT num FROM chunks WHERE id IN ({marcadores})", lote)]
+            if nums:
+                marcadores_nums = ",".join("?" * len(nums))
+                conexao.execute(f"DELETE FROM postings WHERE num IN ({marcadores_nums})", nums)
+                conexao.execute(f"DELETE FROM chunks WHERE num IN ({marcadores_nums})", nums)
+
+    def salvar(self):
+        """Confirma as alterações pendentes e libera o arquivo."""
+        if self._escrita is not None:
+            self._escrita.commit()
+            self._escrita.close()
+            self._escrita = None
+
+    def descartar(self):
+        """Desfaz as alterações pendentes e libera o arquivo."""
+        if self._escrita is not None:
+            self._escrita.rollback()
+            self._escrita.close()
+            self._escrita = None
+
+    def buscar(self, consulta: str, k: int) -> Tuple[List[Tuple[str, float]], Dict[str, float]]:
+        """
+        Retorna os k chunks com maior pontuação BM25 e a cobertura de termos de cada um.
+
+        A cobertura é a fração dos termos da consulta presentes no chunk.
+        """
+        termos = list(dict.fromkeys(tokenizar(consulta)))
+        if not termos or not self.existe():
+            return [], {}
+
+        # Conexão própria por consulta: nada fica aberto entre trocas de versão do índice
+        with closing(self._conectar()) as conexao:
+            total, media = conexao.execute(
+                "SELECT COUNT(*), AVG(comprimento) FROM chunks").fetchone()
+            if not total:
+                return [], {}
+
+            pontuacoes: Dict[int, float] = defaultdict(float)
+            encontrados: Dict[int, int] = defaultdict(int)
+
+            for termo in termos:
+                postings = conexao.execute(
+                    "SELECT p.num, p.tf, c.comprimento FROM postings p "
+                    "JOIN chunks c ON c.num = p.num WHERE p.termo = ?", (termo,)).fetchall()
+                if not postings:
+                    continue
+
+                df = len(postings)
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                for num, tf, comprimento in postings:
+                    norma = self.k1 * (1 - self.b + self.b * comprimento / (media or 1))
+                    pontuacoes[num] += idf * tf * (self.k1 + 1) / (tf + norma)
+                    encontrados[num] += 1
+
+            melhores = sorted(pontuacoes.items(), key=lambda item: item[1], reverse=True)[:k]
+            if not melhores:
+                return [], {}
+
+            nums = [num for num, _ in melhores]
+            marcadores = ",".join("?" * len(nums))
+            ids = dict(conexao.execute(
+                f"SELECT num, id FROM chunks WHERE num IN ({marcadores})", nums).fetchall())
+
+        resultados = [(ids[num], pontuacao) for num, pontuacao in melhores]
+        cobertura = {ids[num]: encontrados[num] / len(termos) for num in nums}
+        return resultados, cobertura
@@ -0,0 +1,229 @@
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from typing import List, Optional, Dict, Any, Iterator, AsyncIterator
+from langchain_core.embeddings import Embeddings
+from utils.tracing import ESPERA_FILA, registrar_medidor, registrar_contador
+from config import LLM_MAX_CONCURRENCY, LLM_QUEUE_MAX, LLM_QUEUE_TIMEOUT_SECONDS
+
+# Prioridades: valores menores são atendidos primeiro
+PRIORIDADE_INTERATIVA = 0
+PRIORIDADE_RESUMO = 1
+PRIORIDADE_INDEXACAO = 2
+
+NOMES_PRIORIDADE = {PRIORIDADE_INTERATIVA: "interativa", PRIORIDADE_RESUMO: "resumo",
+                    PRIORIDADE_INDEXACAO: "indexacao"}
+
+
+class FilaCheiaError(Exception):
+    """A fila de chamadas interativas ao modelo atingiu o limite."""
+
+
+class TempoFilaEsgotadoError(Exception):
+    """A chamada esperou na fila mais do que o tempo limite."""
+
+
+class _Espera:
+    """Uma chamada na fila: uma thread bloqueada em um evento ou uma corrotina em um futuro."""
+
+    def __init__(self, prioridade: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.prioridade = prioridade
+        self.inicio = time.monotonic()
+        self.concedida = False
+        self.loop = loop
+        self.evento = threading.Event() if loop is None else None
+        self.futuro = loop.create_future() if loop is not None else None
+
+    def conceder(self):
+        """Entrega a vaga (chamado com o lock do agendador, de qualquer thread)."""
+        self.concedida = True
+        if self.evento is not None:
+            self.evento.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolver)
+
+    def _resolver(self):
+        if not self.futuro.done():
+            self.futuro.set_result(None)
+
+
+class AgendadorModelo:
+    """
+    Controla o acesso ao servidor Ollama, compartilhado por geração e embeddings.
+
+    No máximo max_concorrencia chamadas rodam ao mesmo tempo; as demais esperam em uma fila
+    ordenada por prioridade e ordem de chegada, de modo que perguntas passam à frente da
+    indexação. Chamadas interativas são recusadas quando já há max_fila delas esperando e
+    desistem após tempo_limite segundos na fila; as tarefas de segundo plano (resumo da conversa
+    e indexação) não têm limite de espera.
+
+    Ao liberar uma vaga, o agendador a entrega diretamente à próxima da fila: chamadas
+    síncronas esperam em um evento, e as assíncronas em um futuro do próprio event loop, sem
+    ocupar threads enquanto aguardam.
+    """
+
+    def __init__(self, max_concorrencia: int, max_fila: int, tempo_limite: Optional[float]):
+        self.max_concorrencia = max_concorrencia
+        self.max_fila = max_fila
+        self.tempo_limite = tempo_limite
+        self._fila: List[tuple] = []
+        self._sequencia = itertools.count()
+        self._em_execucao = 0
+        self._lock = threading.Lock()
+
+        self.atendidas = {nome: 0 for nome in NOMES_PRIORIDADE.values()}
+        self.espera_total = {nome: 0.0 for nome in NOMES_PRIORIDADE.values()}
+        self.espera_maxima = {nome: 0.0 for nome in NOMES_PRIORIDADE.values()}
+        self.rejeitadas = 0
+        self.expiradas = 0
+        self.fila_maxima = 0
+
+    def _interativas_na_fila(self) -> int:
+        return sum(1 for prioridade, _, _ in self._fila if prioridade == PRIORIDADE_INTERATIVA)
+
+    def lotado(self) -> bool:
+        """Indica se uma nova chamada interativa seria recusada agora."""
+        with self._lock:
+            return self._interativas_na_fila() >= self.max_fila
+
+    def _limite(self, prioridade: int) -> Optional[float]:
+        return self.tempo_limite if prioridade == PRIORIDADE_INTERATIVA else None
+
+    def _entrar(self, prioridade: int, loop: Optional[asyncio.AbstractEventLoop] = None) -> _Espera:
+        """Coloca a chamada na fila; se houver vaga, ela já sai concedida."""
+        with self._lock:
+            if prioridade == PRIORIDADE_INTERATIVA and self._interativas_na_fila() >= self.max_fila:
+                self.rejeitadas += 1
+                raise FilaCheiaError(f"Fila do modelo cheia ({self.max_fila} chamadas aguardando)")
+
+            espera = _Espera(prioridade, loop)
+            heapq.heappush(self._fila, (prioridade, next(self._sequencia), espera))
+            self.fila_maxima = max(self.fila_maxima, len(self._fila))
+            self._despachar()
+            return espera
+
+    def _despachar(self):
+        """Entrega as vagas livres às primeiras da fila (chamado com o lock)."""
+        while self._em_execucao < self.max_concorrencia and self._fila:
+            _, _, espera = heapq.heappop(self._fila)
+            self._em_execucao += 1
+            tempo = time.monotonic() - espera.inicio
+            nome = NOMES_PRIORIDADE[espera.prioridade]
+            self.atendidas[nome] += 1
+            self.espera_total[nome] += tempo
+            self.espera_maxima[nome] = max(self.espera_maxima[nome], tempo)
+            ESPERA_FILA.observar(tempo, nome)
+            espera.conceder()
+
+    def _desistir(self, espera: _Espera, expirou: bool) -> bool:
+        """Retira a chamada da fila; retorna False se a vaga já havia sido concedida."""
+        with self._lock:
+            if espera.concedida:
+                return False
+            self._fila = [item for item in self._fila if item[2] is not espera]
+            heapq.heapify(self._fila)
+            if expirou:
+                self.expiradas += 1
+            return True
+
+    def _erro_tempo(self, prioridade: int) -> TempoFilaEsgotadoError:
+        return TempoFilaEsgotadoError(
+            f"Tempo de espera pelo modelo esgotado ({self._limite(prioridade):.0f} segundos)")
+
+    def _adquirir(self, prioridade: int):
+        espera = self._entrar(prioridade)
+        try:
+            concedida = espera.evento.wait(self._limite(prioridade))
+        except BaseException:
+            if not self._desistir(espera, expirou=False):
+                self._liberar()
+            raise
+        # A vaga pode ter chegado junto com o fim do prazo: nesse caso, é usada
+        if not concedida and self._desistir(espera, expirou=True):
+            raise self._erro_tempo(prioridade)
+
+    def _liberar(self):
+        with self._lock:
+            self._em_execucao -= 1
+            self._despachar()
+
+    @contextmanager
+    def reservar(self, prioridade: int = PRIORIDADE_INTERATIVA) -> Iterator[None]:
+        """Ocupa uma vaga no modelo durante o bloco."""
+        self._adquirir(prioridade)
+        try:
+            yield
+        finally:
+            self._liberar()
+
+    @asynccontextmanager
+    async def areservar(self, prioridade: int = PRIORIDADE_INTERATIVA) -> AsyncIterator[None]:
+        """Versão assíncrona de reservar: a espera na fila não ocupa nenhuma thread."""
+        espera = self._entrar(prioridade, asyncio.get_running_loop())
+        if not espera.concedida:
+            try:
+                await asyncio.wait_for(espera.futuro, self._limite(prioridade))
+            except asyncio.TimeoutError:
+                if self._desistir(espera, expirou=True):
+                    raise self._erro_tempo(prioridade) from None
+            except asyncio.CancelledError:
+                # Uma vaga concedida depois do cancelamento é devolvida
+                if not self._desistir(espera, expirou=False):
+                    self._liberar()
+                raise
+        try:
+            yield
+        finally:
+            self._liberar()
+
+    def estatisticas(self) -> Dict[str, Any]:
+        """Retorna a ocupação atual e os contadores de espera."""
+        with self._lock:
+            profundidade = len(self._fila)
+            em_execucao = self._em_execucao
+        return {
+            "max_concorrencia": self.max_concorrencia,
+            "em_execucao": em_execucao,
+            "fila": profundidade,
+            "fila_maxima": self.fila_maxima,
+            "rejeitadas": self.rejeitadas,
+            "expiradas": self.expiradas,
+            "atendidas": dict(self.atendidas),
+            "espera_media": {nome: self.espera_total[nome] / self.atendidas[nome] if self.atendidas[nome] else 0.0
+                             for nome in self.atendidas},
+            "espera_maxima": dict(self.espera_maxima),
+        }
+
+
+class EmbeddingsAgendados(Embeddings):
+    """Embeddings que passam pelo agendador: documentos como indexação, perguntas como interativas."""
+
+    def __init__(self, base: Embeddings, agendador: AgendadorModelo):
+        self.base = base
+        self.agendador = agendador
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self.agendador.reservar(PRIORIDADE_INDEXACAO):
+            return self.base.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self.agendador.reservar(PRIORIDADE_INTERATIVA):
+            return self.base.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        async with self.agendador.areservar(PRIORIDADE_INTERATIVA):
+            return await self.base.aembed_query(text)
+
+
+# Uma única instância por processo: todos os serviços compartilham o mesmo servidor Ollama
+agendador_modelo = AgendadorModelo(LLM_MAX_CONCURRENCY, LLM_QUEUE_MAX, LLM_QUEUE_TIMEOUT_SECONDS)
+
+registrar_medidor("jarvis_fila_modelo_profundidade", "Chamadas aguardando o modelo",
+                  lambda: agendador_modelo.estatisticas()["fila"])
+registrar_medidor("jarvis_fila_modelo_em_execucao", "Chamadas em execução no modelo",
+                  lambda: agendador_modelo.estatisticas()["em_execucao"])
+registrar_contador("jarvis_fila_modelo_rejeitadas_total", "Chamadas recusadas por fila cheia",
+                   lambda: agendador_modelo.rejeitadas)
@@ -1,24 +1,53 @@
 from langchain_ollama import ChatOllama
 from langchain.prompts import PromptTemplate
 from langchain.chains.conversational_retrieval.base import ConversationalRetrievalChain
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
-from typing import List, Tuple, Optional, Dict, Any
-from models.schemas import PerguntaInput, RespostaOutput, AgentAction
-import json
+from typing import List, Tuple, Optional, Dict, Any, Callable
+from models.schemas import RespostaOutput, AgentAction, RespostaEstruturada
+from services.answer_cache import CacheRespostas
+from services.context_packer import EmpacotadorContexto, formatar_historico, formatar_resumo
+from services.llm_scheduler import agendador_modelo
+from utils.helpers import PerformanceTimer
+from utils.tracing import rastrear, registrar_geracao
+from utils.json_stream import extrair_objeto_json, CampoTextoIncremental
+import time
 from config import (
     LLM_MODEL,
     LLM_TEMPERATURE,
     LLM_TOP_P,
-    LLM_NUM_CTX
+    LLM_NUM_CTX,
+    LLM_KEEP_ALIVE,
+    LLM_PIPELINE_MODE,
+    LLM_OUTPUT_MODE,
+    LLM_FOLLOWUP_MAX_WORDS,
+    LLM_RESPONSE_TOKENS,
+    CONTEXT_BUDGET_SHARES,
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_SIZE,
+    ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_TTL_SECONDS
 )
 
 class LLMService:
     """Serviço para gerenciamento do modelo de linguagem."""
     
-    def __init__(self, retriever):
+    def __init__(self, retriever, modo: str = LLM_PIPELINE_MODE, eco_terminal: bool = True,
+                 saida: str = LLM_OUTPUT_MODE):
         self.retriever = retriever
+        self.modo = modo
+        self.saida = saida
+        self.eco_terminal = eco_terminal
+        self.agendador = agendador_modelo
         self.llm = self._inicializar_llm()
+        self.prompt = self._criar_prompt()
         self.qa_chain = self._criar_qa_chain()
+        self.empacotador = EmpacotadorContexto(LLM_NUM_CTX, LLM_RESPONSE_TOKENS, CONTEXT_BUDGET_SHARES)
+        
+        # O cache de respostas usa o serviço do índice para embeddings e versão
+        self.vector_store_service = getattr(retriever, "servico", None)
+        self.cache_respostas = None
+        if ANSWER_CACHE_ENABLED and self.vector_store_service is not None:
+            self.cache_respostas = CacheRespostas(
+                ANSWER_CACHE_SIZE, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL_SECONDS)
         
     def _inicializar_llm(self):
         """Inicializa o modelo de linguagem com as configurações apropriadas."""
@@ -27,11 +56,13 @@ class LLMService:
             temperature=LLM_TEMPERATURE,
             top_p=LLM_TOP_P,
             num_ctx=LLM_NUM_CTX,
-            callbacks=[StreamingStdOutCallbackHandler()]
+            keep_alive=LLM_KEEP_ALIVE,
+            # No modo "json" o servidor restringe a geração ao esquema da resposta estruturada
+            format=RespostaEstruturada.model_json_schema() if self.saida == "json" else None
         )
     
-    def _criar_qa_chain(self):
-        """Cria a cadeia de conversação com o retriever."""
+    def _criar_prompt(self) -> PromptTemplate:
+        """Cria o prompt de resposta do assistente."""
         prompt_template = """Você é Jarvis1, um assistente virtual especializado em ajudar com a organização 
         e otimização da rotina diária usando princípios essencialistas.
         
@@ -45,54 +76,340 @@ class LLMService:
         4. Excluir eventos
         5. Analisar tempo livre
         
-        Para realizar estas ações, devolva um objeto JSON com a estrutura adequada.
+        {formato}
         
         Seja claro, objetivo e amigável. Responda sempre em português do Brasil.
         
-        Contexto do documento:
-        {context}
+        Informações do calendário:
+        {calendar}
         
         Histórico de conversa:
         {chat_history}
         
+        Contexto do documento:
+        {context}
+        
         Pergunta: {question}
         
         Resposta:"""
         
-        prompt = PromptTemplate(
-            template=prompt_template,
-            input_variables=["context", "chat_history", "question"]
-        )
+        if self.saida == "json":
+            formato = ('Responda sempre com um objeto JSON com os campos "resposta" (o texto para o usuário) '
+                       'e "acao" (null, ou {{"action_type": ..., "params": {{...}}}} para realizar uma ação).')
+        else:
+            formato = ('Para realizar estas ações, inclua na resposta um objeto JSON no formato '
+                       '{{"action_type": ..., "params": {{...}}}}.')
+        formato += (' Os tipos de ação são listar_eventos, buscar_evento, criar_evento, '
+                    'atualizar_evento, excluir_evento e analisar_tempo_livre.')
         
+        # Do mais estável para o mais variável: instruções, agenda, histórico e, por fim, o turno
+        # atual. O servidor reaproveita o processamento do início idêntico entre perguntas.
+        return PromptTemplate(
+            template=prompt_template.replace("{formato}", formato),
+            input_variables=["calendar", "chat_history", "context", "question"]
+        )
+    
+    def _sistema(self) -> str:
+        """Prompt apenas com as instruções, sem as seções variáveis."""
+        return self.prompt.format(calendar="", chat_history="", context="", question="")
+    
+    def modelo_texto(self, **opcoes) -> ChatOllama:
+        """Cópia do modelo para tarefas auxiliares em texto livre, sem o esquema da resposta."""
+        return self.llm.model_copy(update={"format": None, **opcoes})
+    
+    def _criar_qa_chain(self):
+        """Cria a cadeia de conversação com o retriever."""
         return ConversationalRetrievalChain.from_llm(
             llm=self.llm,
             retriever=self.retriever,
+            condense_question_llm=self.modelo_texto(),
+            combine_docs_chain_kwargs={"prompt": self.prompt.partial(calendar="")},
             return_source_documents=True,
             verbose=False
         )
     
-    def processar_pergunta(self, pergunta: str, historico: List[Tuple[str, str]]) -> RespostaOutput:
-        """Processa uma pergunta e retorna a resposta com fontes."""
-        entrada = PerguntaInput(question=pergunta, chat_history=historico)
-        entrada_dict = entrada.model_dump()
+    def processar_pergunta(self, pergunta: str, historico: List[Tuple[str, str]],
+                           info_calendario: Optional[str] = None, resumo: Optional[str] = None) -> RespostaOutput:
+        """
+        Processa uma pergunta e retorna a resposta com fontes.
+        
+        No modo "cadeia", o modelo reescreve a pergunta com base no histórico antes da busca
+        (uma chamada extra por turno). No modo "direto", a busca usa a própria pergunta e há
+        uma única chamada ao modelo, com o prompt do projeto. resumo é o resumo dos turnos
+        mais antigos da conversa, que não estão em historico.
+        
+        As etapas (preparar_consulta, buscar e responder) também podem ser chamadas em separado,
+        para sobrepor a busca a outras tarefas.
+        """
+        pergunta, consulta = self.preparar_consulta(pergunta, historico, resumo)
+        documentos = self.buscar(consulta)
+        return self.responder(pergunta, consulta, documentos, historico, info_calendario, resumo)
+    
+    async def aprocessar_pergunta(self, pergunta: str, historico: List[Tuple[str, str]],
+                                  info_calendario: Optional[str] = None,
+                                  resumo: Optional[str] = None,
+                                  ao_token: Optional[Callable[[str], None]] = None) -> RespostaOutput:
+        """
+        Versão assíncrona de processar_pergunta: as chamadas ao Ollama não ocupam threads.
         
-        result_raw = self.qa_chain.invoke(entrada_dict)
-        resposta = RespostaOutput(**result_raw)
+        Se ao_token for informado, cada trecho da resposta é repassado a ele assim que gerado
+        (uma resposta vinda do cache é repassada de uma vez).
+        """
+        pergunta, consulta = await self.apreparar_consulta(pergunta, historico, resumo)
+        documentos = await self.abuscar(consulta)
+        return await self.aresponder(pergunta, consulta, documentos, historico, info_calendario, resumo, ao_token)
+    
+    def preparar_consulta(self, pergunta: str, historico: List[Tuple[str, str]],
+                          resumo: Optional[str] = None) -> Tuple[str, str]:
+        """Retorna a pergunta a responder e a consulta de busca (a agenda não entra na busca)."""
+        if self.modo != "cadeia":
+            return pergunta, self._consulta_direta(pergunta, historico)
+        if historico:
+            with PerformanceTimer("Reescrita da pergunta", etapa="reescrita"), self.agendador.reservar():
+                pergunta = self.qa_chain.question_generator.invoke(
+                    {"question": pergunta, "chat_history": formatar_resumo(resumo) + formatar_historico(historico)})["text"]
+        return pergunta, pergunta
+    
+    async def apreparar_consulta(self, pergunta: str, historico: List[Tuple[str, str]],
+                                 resumo: Optional[str] = None) -> Tuple[str, str]:
+        if self.modo != "cadeia":
+            return pergunta, self._consulta_direta(pergunta, historico)
+        if historico:
+            async with self.agendador.areservar():
+                with PerformanceTimer("Reescrita da pergunta", etapa="reescrita"):
+                    pergunta = (await self.qa_chain.question_generator.ainvoke(
+                        {"question": pergunta, "chat_history": formatar_resumo(resumo) + formatar_historico(historico)}))["text"]
+        return pergunta, pergunta
+    
+    def buscar(self, consulta: str) -> List[Any]:
+        """Embedding da consulta e busca dos chunks relevantes."""
+        with rastrear("busca") as span:
+            documentos = self.retriever.invoke(consulta)
+            span["documentos"] = len(documentos)
+        return documentos
+    
+    async def abuscar(self, consulta: str) -> List[Any]:
+        with rastrear("busca") as span:
+            documentos = await self.retriever.ainvoke(consulta)
+            span["documentos"] = len(documentos)
+        return documentos
+    
+    def responder(self, pergunta: str, consulta: str, documentos: List[Any], historico: List[Tuple[str, str]],
+                  info_calendario: Optional[str] = None, resumo: Optional[str] = None) -> RespostaOutput:
+        """Consulta o cache de respostas e, se preciso, gera a resposta com os documentos encontrados."""
+        chave = None
+        if self.cache_respostas is not None:
+            with rastrear("cache_respostas") as span:
+                vetor = self.vector_store_service.embeddings.embed_query(consulta)
+                chave, resposta = self._buscar_cache(vetor, documentos, info_calendario)
+                span["acerto"] = resposta is not None
+            if resposta is not None:
+                return resposta
         
+        with rastrear("montagem_prompt"):
+            contexto, texto_prompt = self._montar_prompt(pergunta, documentos, info_calendario, historico, resumo)
+        with PerformanceTimer(f"Geração da resposta (modo {self.modo})", etapa="geracao") as timer:
+            mensagem, primeiro_token, metricas = self._gerar(texto_prompt)
+            timer.atributos.update(metricas)
+        return self._concluir(mensagem, primeiro_token, contexto, chave, metricas)
+    
+    async def aresponder(self, pergunta: str, consulta: str, documentos: List[Any],
+                         historico: List[Tuple[str, str]], info_calendario: Optional[str] = None,
+                         resumo: Optional[str] = None,
+                         ao_token: Optional[Callable[[str], None]] = None) -> RespostaOutput:
+        chave = None
+        if self.cache_respostas is not None:
+            with rastrear("cache_respostas") as span:
+                vetor = await self.vector_store_service.embeddings.aembed_query(consulta)
+                chave, resposta = self._buscar_cache(vetor, documentos, info_calendario)
+                span["acerto"] = resposta is not None
+            if resposta is not None:
+                if ao_token is not None:
+                    ao_token(resposta.answer)
+                return resposta
+        
+        with rastrear("montagem_prompt"):
+            contexto, texto_prompt = self._montar_prompt(pergunta, documentos, info_calendario, historico, resumo)
+        with PerformanceTimer(f"Geração da resposta (modo {self.modo})", etapa="geracao") as timer:
+            mensagem, primeiro_token, metricas = await self._agerar(texto_prompt, ao_token)
+            timer.atributos.update(metricas)
+        return self._concluir(mensagem, primeiro_token, contexto, chave, metricas)
+    
+    def _buscar_cache(self, vetor: List[float], documentos: List[Any],
+                      info_calendario: Optional[str]) -> Tuple[tuple, Optional[RespostaOutput]]:
+        """Monta a chave do cache de respostas e retorna a resposta armazenada, se houver."""
+        chave = (vetor, [doc.id for doc in documentos], self.vector_store_service.versao,
+                 CacheRespostas.impressao(info_calendario))
+        resposta = self.cache_respostas.buscar(*chave)
+        if resposta is not None:
+            print("Resposta obtida do cache de respostas")
+            # Sem geração, a resposta não passa pelo emissor; no terminal ela é mostrada inteira
+            if self.eco_terminal:
+                print(resposta.answer)
+        return chave, resposta
+    
+    def _montar_prompt(self, pergunta: str, documentos: List[Any], info_calendario: Optional[str],
+                       historico: List[Tuple[str, str]],
+                       resumo: Optional[str] = None) -> Tuple[Dict[str, Any], str]:
+        """Ajusta documentos, agenda e histórico à janela de contexto e formata o prompt."""
+        contexto = self.empacotador.montar(self._sistema(), pergunta, documentos, info_calendario,
+                                           historico, resumo)
+        tokens = contexto["tokens"]
+        print(f"Prompt: ~{tokens['total']} tokens (instruções {tokens['sistema']}, "
+              f"calendário {tokens['calendario']}, histórico {tokens['historico']}, "
+              f"documentos {tokens['documentos']}, pergunta {tokens['pergunta']}); "
+              f"omitidos {contexto['omitidos']['documentos']} chunks e "
+              f"{contexto['omitidos']['historico']} turnos")
+        
+        texto_prompt = self.prompt.format(
+            calendar=contexto["calendario"] or "",
+            chat_history=formatar_resumo(contexto["resumo"]) + formatar_historico(contexto["historico"]),
+            context="\n\n".join(doc.page_content for doc in contexto["documentos"]),
+            question=pergunta
+        )
+        return contexto, texto_prompt
+    
+    def _concluir(self, mensagem, primeiro_token: float, contexto: Dict[str, Any],
+                  chave: Optional[tuple], metricas: Optional[Dict[str, float]] = None) -> RespostaOutput:
+        """Monta a resposta final e a guarda no cache, quando cabível."""
+        print(f"Tempo até o primeiro token: {primeiro_token:.2f} segundos")
+        if metricas and "tokens_por_segundo" in metricas:
+            print(f"Velocidade de geração: {metricas['tokens_por_segundo']:.1f} tokens/s "
+                  f"({metricas['tokens_gerados']} tokens)")
+        
+        # Contagem real informada pelo servidor, quando disponível
+        tokens = contexto["tokens"]
+        uso = getattr(mensagem, "usage_metadata", None) or {}
+        if uso.get("input_tokens"):
+            tokens["servidor"] = uso["input_tokens"]
+            print(f"Prompt avaliado pelo servidor: {uso['input_tokens']} tokens")
+        texto, acao = self._interpretar(mensagem.content)
+        resposta = RespostaOutput(answer=texto, source_documents=contexto["documentos"],
+                                  tokens_prompt=tokens, tempo_primeiro_token=primeiro_token, acao=acao,
+                                  metricas_geracao=metricas)
+        
+        # Respostas com ações de calendário não são reaproveitadas: a ação seria repetida
+        if chave is not None and acao is None:
+            self.cache_respostas.armazenar(*chave, resposta)
         return resposta
     
+    def _gerar(self, texto_prompt: str):
+        """Gera a resposta em streaming, medindo o tempo até o primeiro token."""
+        emitir = self._emissor()
+        with self.agendador.reservar():
+            inicio = time.perf_counter()
+            primeiro_token = None
+            mensagem = None
+            pedacos = 0
+            for pedaco in self.llm.stream(texto_prompt):
+                if primeiro_token is None and pedaco.content:
+                    primeiro_token = time.perf_counter() - inicio
+                if pedaco.content:
+                    pedacos += 1
+                emitir(pedaco.content)
+                mensagem = pedaco if mensagem is None else mensagem + pedaco
+            duracao = time.perf_counter() - inicio
+        return self._medir_geracao(mensagem, primeiro_token, duracao, pedacos)
+    
+    def _emissor(self, ao_token: Optional[Callable[[str], None]] = None) -> Callable[[str], None]:
+        """
+        Repassa o texto da resposta, à medida que é gerado, ao terminal e a ao_token.
+        
+        No modo "json" apenas o valor do campo "resposta" é repassado, já decodificado.
+        """
+        campo = CampoTextoIncremental("resposta") if self.saida == "json" else None
+        
+        def emitir(pedaco: str):
+            texto = campo.alimentar(pedaco) if campo is not None else pedaco
+            if not texto:
+                return
+            if self.eco_terminal:
+                print(texto, end="", flush=True)
+            if ao_token is not None:
+                ao_token(texto)
+        
+        return emitir
+    
+    async def _agerar(self, texto_prompt: str, ao_token: Optional[Callable[[str], None]] = None):
+        """Versão assíncrona de _gerar, que também repassa cada trecho a ao_token."""
+        emitir = self._emissor(ao_token)
+        async with self.agendador.areservar():
+            inicio = time.perf_counter()
+            primeiro_token = None
+            mensagem = None
+            pedacos = 0
+            async for pedaco in self.llm.astream(texto_prompt):
+                if primeiro_token is None and pedaco.content:
+                    primeiro_token = time.perf_counter() - inicio
+                if pedaco.content:
+                    pedacos += 1
+                emitir(pedaco.content)
+                mensagem = pedaco if mensagem is None else mensagem + pedaco
+            duracao = time.perf_counter() - inicio
+        return self._medir_geracao(mensagem, primeiro_token, duracao, pedacos)
+    
+    @staticmethod
+    def _medir_geracao(mensagem, primeiro_token: Optional[float], duracao: float, pedacos: int):
+        """Registra as métricas da geração; sem contagem do servidor, cada trecho vale um token."""
+        if primeiro_token is None:
+            primeiro_token = duracao
+        uso = getattr(mensagem, "usage_metadata", None) or {}
+        tokens = uso.get("output_tokens") or pedacos
+        return mensagem, primeiro_token, registrar_geracao(primeiro_token, duracao, tokens)
+    
+    def aquecer(self, info_calendario: Optional[str] = None):
+        """
+        Carrega o modelo no servidor antes da primeira pergunta.
+        
+        O prompt de aquecimento tem o mesmo início das perguntas (instruções e agenda), que
+        fica processado no cache do servidor.
+        """
+        sistema = self._sistema()
+        calendario = self.empacotador.ajustar_calendario(sistema, info_calendario)
+        texto_prompt = self.prompt.format(calendar=calendario or "", chat_history="", context="", question="")
+        try:
+            with PerformanceTimer("Aquecimento do modelo"), self.agendador.reservar():
+                self.llm.model_copy(update={"num_predict": 1}).invoke(texto_prompt)
+        except Exception as e:
+            print(f"Erro ao aquecer o modelo: {e}")
+    
+    @staticmethod
+    def _consulta_direta(pergunta: str, historico: List[Tuple[str, str]]) -> str:
+        """Consulta de busca sem chamar o modelo: perguntas curtas herdam o contexto da anterior."""
+        if historico and len(pergunta.split()) <= LLM_FOLLOWUP_MAX_WORDS:
+            return f"{historico[-1][0]} {pergunta}"
+        return pergunta
+    
+    def _interpretar(self, conteudo: str) -> Tuple[str, Optional[AgentAction]]:
+        """Separa o texto da resposta e a ação de calendário, conforme o modo de saída."""
+        if self.saida == "json":
+            dados = extrair_objeto_json(conteudo, lambda objeto: "resposta" in objeto)
+            if dados is not None:
+                acao = dados.get("acao")
+                # Uma ação de uma resposta interrompida pode estar com parâmetros cortados
+                if acao and extrair_objeto_json(conteudo, lambda objeto: "resposta" in objeto,
+                                                completar=False) is None:
+                    print("Ação ignorada: resposta JSON incompleta")
+                    acao = None
+                try:
+                    acao = AgentAction(**acao) if isinstance(acao, dict) else None
+                except Exception as e:
+                    print(f"Erro ao extrair ação: {e}")
+                    acao = None
+                return str(dados["resposta"]), acao
+            # O modelo não seguiu o formato: trata a saída como texto livre
+        return conteudo, self.extrair_acao(conteudo)
+    
     def extrair_acao(self, texto_resposta: str) -> Optional[AgentAction]:
-        """Extrai uma possível ação de calendário da resposta do modelo."""
-        # Procura por marcações JSON na resposta
+        """Extrai uma possível ação de calendário de uma resposta em texto livre."""
         try:
-            # Tentar encontrar JSON entre delimitadores
-            import re
-            json_match = re.search(r'\{.*?\}', texto_resposta, re.DOTALL)
-            if json_match:
-                acao_json = json_match.group(0)
-                acao_dict = json.loads(acao_json)
+            # O primeiro objeto JSON com um tipo de ação, inclusive com parâmetros aninhados; sem
+            # completar o texto, para não executar uma ação com parâmetros cortados
+            acao_dict = extrair_objeto_json(texto_resposta, lambda objeto: "action_type" in objeto,
+                                            completar=False)
+            if acao_dict:
                 return AgentAction(**acao_dict)
         except Exception as e:
             print(f"Erro ao extrair ação: {e}")
         
-        return None
\ No newline at end of file
+        return None
@@ -0,0 +1,149 @@
+import os
+import re
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from typing import Dict, List, Any, Iterator, Tuple
+import yaml
+from langchain_core.documents import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+_FRONTMATTER = re.compile(r"\A---[ \t]*\r?\n(.*?)\r?\n---[ \t]*(?:\r?\n|\Z)", re.DOTALL)
+_TITULO = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t]*#*[ \t]*$")
+_CERCA = re.compile(r"^[ \t]*(```|~~~)")
+
+# Divisor reaproveitado entre arquivos dentro de cada processo
+_splitters: Dict[Tuple[int, int], RecursiveCharacterTextSplitter] = {}
+
+def _obter_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    chave = (chunk_size, chunk_overlap)
+    if chave not in _splitters:
+        _splitters[chave] = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=["\n\n", "\n", ". ", " ", ""]
+        )
+    return _splitters[chave]
+
+def _valor_metadado(valor: Any) -> Any:
+    """Converte valores do frontmatter para tipos serializáveis em JSON."""
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    if isinstance(valor, dict):
+        return {str(k): _valor_metadado(v) for k, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_valor_metadado(v) for v in valor]
+    if valor is None or isinstance(valor, (str, int, float, bool)):
+        return valor
+    return str(valor)
+
+def extrair_frontmatter(texto: str) -> Tuple[Dict[str, Any], str]:
+    """Separa o frontmatter YAML do corpo do documento."""
+    match = _FRONTMATTER.match(texto)
+    if not match:
+        return {}, texto
+
+    try:
+        dados = yaml.safe_load(match.group(1)) or {}
+    except yaml.YAMLError:
+        dados = {}
+    if not isinstance(dados, dict):
+        dados = {}
+
+    return {str(k): _valor_metadado(v) for k, v in dados.items()}, texto[match.end():]
+
+def dividir_por_titulos(texto: str) -> List[Tuple[List[str], str]]:
+    """Divide o texto nas fronteiras de títulos, retornando (caminho de títulos, conteúdo)."""
+    secoes = []
+    caminho: List[str] = []
+    linhas: List[str] = []
+    em_codigo = False
+
+    def fechar():
+        conteudo = "\n".join(linhas).strip()
+        # Ignora seções que contêm apenas o próprio título
+        if conteudo and not (len(linhas) == 1 and _TITULO.match(linhas[0])):
+            secoes.append((list(caminho), conteudo))
+
+    for linha in texto.splitlines():
+        if _CERCA.match(linha):
+            em_codigo = not em_codigo
+
+        match = None if em_codigo else _TITULO.match(linha)
+        if match:
+            fechar()
+            nivel = len(match.group(1))
+            caminho = caminho[:nivel - 1] + [match.group(2)]
+            linhas = [linha]
+        else:
+            linhas.append(linha)
+
+    fechar()
+    return secoes
+
+def dividir_documento(texto: str, caminho: str, chunk_size: int, chunk_overlap: int) -> List[Document]:
+    """Divide o conteúdo de um arquivo Markdown em chunks, por seções e depois por tamanho."""
+    frontmatter, corpo = extrair_frontmatter(texto)
+    splitter = _obter_splitter(chunk_size, chunk_overlap)
+
+    chunks = []
+    for titulos, secao in dividir_por_titulos(corpo):
+        metadados = {**frontmatter, "source": caminho}
+        if titulos:
+            metadados["secao"] = " > ".join(titulos)
+
+        # Seções grandes ainda passam pelo divisor recursivo, repetindo o título em cada parte
+        if len(secao) <= chunk_size:
+            partes = [secao]
+        elif titulos:
+            linha_titulo, _, resto = secao.partition("\n")
+            partes = [f"{linha_titulo}\n{parte}" for parte in splitter.split_text(resto)]
+        else:
+            partes = splitter.split_text(secao)
+        chunks.extend(Document(page_content=parte, metadata=dict(metadados)) for parte in partes)
+
+    return chunks
+
+def carregar_arquivo(caminho: str, chunk_size: int, chunk_overlap: int) -> Tuple[str, List[Document]]:
+    """Lê um arquivo Markdown e retorna o hash do conteúdo e seus chunks."""
+    with open(caminho, "rb") as f:
+        conteudo = f.read()
+    hash_arquivo = hashlib.sha256(conteudo).hexdigest()
+    texto = conteudo.decode("utf-8", errors="replace")
+    return hash_arquivo, dividir_documento(texto, caminho, chunk_size, chunk_overlap)
+
+class MarkdownLoader:
+    """Carregador leve de Markdown que processa arquivos em paralelo e entrega chunks em fluxo."""
+
+    def __init__(self, chunk_size: int, chunk_overlap: int, max_workers: int = None,
+                 min_arquivos_paralelo: int = 16):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.max_workers = max_workers
+        self.min_arquivos_paralelo = min_arquivos_paralelo
+
+    def carregar(self, arquivos: Dict[str, str]) -> Iterator[Tuple[str, str, List[Document]]]:
+        """Gera (caminho relativo, hash, chunks) para cada arquivo, na ordem recebida."""
+        # Para poucos arquivos, o custo de iniciar processos supera o ganho
+        if len(arquivos) < self.min_arquivos_paralelo:
+            for relativo, caminho in arquivos.items():
+                yield (relativo, *carregar_arquivo(caminho, self.chunk_size, self.chunk_overlap))
+            return
+
+        workers = self.max_workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            limite = workers * 2
+            pendentes = deque()
+
+            # Mantém um número limitado de arquivos em processamento para não acumular resultados
+            for relativo, caminho in arquivos.items():
+                pendentes.append((relativo, executor.submit(
+                    carregar_arquivo, caminho, self.chunk_size, self.chunk_overlap)))
+                if len(pendentes) >= limite:
+                    relativo_pronto, future = pendentes.popleft()
+                    yield (relativo_pronto, *future.result())
+
+            while pendentes:
+                relativo_pronto, future = pendentes.popleft()
+                yield (relativo_pronto, *future.result())
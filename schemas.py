@@ -3,6 +3,22 @@ from typing import List, Tuple, Any, Optional, Dict
 from datetime import datetime
 
 # Modelos para o RAG
+class AgentAction(BaseModel):
+    action_type: str = Field(..., description="Tipo de ação a ser executada")
+    params: Dict[str, Any] = Field(default_factory=dict, description="Parâmetros para a ação")
+    context: Optional[str] = None
+
+# Etapas do pipeline escolhidas pelo roteador de intenções
+class RotaIntencao(BaseModel):
+    destino: str = Field(..., description='"calendario", "conhecimento" ou "completo"')
+    acao: Optional[AgentAction] = None
+    motivo: Optional[str] = None
+
+# Formato exigido do modelo no modo de saída estruturada
+class RespostaEstruturada(BaseModel):
+    resposta: str = Field(..., description="Texto da resposta ao usuário")
+    acao: Optional[AgentAction] = Field(None, description="Ação de calendário a executar, se houver")
+
 class PerguntaInput(BaseModel):
     question: str
     chat_history: List[Tuple[str, str]]
@@ -10,6 +26,10 @@ class PerguntaInput(BaseModel):
 class RespostaOutput(BaseModel):
     answer: str
     source_documents: Any
+    tokens_prompt: Optional[Dict[str, int]] = None
+    tempo_primeiro_token: Optional[float] = None
+    acao: Optional[AgentAction] = None
+    metricas_geracao: Optional[Dict[str, float]] = None
 
 # Modelos para o Google Calendar
 class CalendarEvent(BaseModel):
@@ -31,9 +51,4 @@ class CalendarEventCreate(BaseModel):
     start: datetime
     end: datetime
     attendees: Optional[List[Dict[str, str]]] = None
-    reminders: Optional[Dict[str, Any]] = None
-
-class AgentAction(BaseModel):
-    action_type: str = Field(..., description="Tipo de ação a ser executada")
-    params: Dict[str, Any] = Field(default_factory=dict, description="Parâmetros para a ação")
-    context: Optional[str] = None
\ No newline at end of file
+    reminders: Optional[Dict[str, Any]] = None
\ No newline at end of file
@@ -0,0 +1,54 @@
+import pytest
+from services.intent_router import RoteadorIntencoes
+
+
+class EmbeddingsIndisponiveis:
+    """As regras devem decidir sozinhas; sem regra, o roteador cai em "completo"."""
+
+    def embed_documents(self, texts):
+        raise RuntimeError("embeddings indisponíveis")
+
+    def embed_query(self, text):
+        raise RuntimeError("embeddings indisponíveis")
+
+
+@pytest.fixture
+def roteador():
+    return RoteadorIntencoes(EmbeddingsIndisponiveis(), limiar=0.6)
+
+
+@pytest.mark.parametrize("pergunta", [
+    "Como usar meu tempo livre de forma essencialista?",
+    "Qual a importância de ter tempo livre na semana?",
+    "Quais compromissos meus devo eliminar segundo o essencialismo?",
+    "Por que tenho tantas reuniões na semana?",
+    "Me mostre minhas reuniões de terça",
+    "Liste meus compromissos da próxima semana",
+    "O que tenho aprendido sobre foco?",
+    "Tenho dúvidas sobre o livro, o que faço?",
+    "Tenho compromissos demais, o que cortar?",
+])
+def test_perguntas_que_nao_viram_acao_direta(roteador, pergunta):
+    rota = roteador.classificar(pergunta)
+    assert rota.destino == "completo"
+    assert rota.acao is None
+
+
+@pytest.mark.parametrize("pergunta, acao, dias", [
+    ("Liste meus eventos de hoje", "listar_eventos", 1),
+    ("Me mostre minha agenda de amanhã", "listar_eventos", 2),
+    ("O que tenho para fazer hoje?", "listar_eventos", 1),
+    ("Tenho alguma reunião esta semana?", "listar_eventos", 7),
+    ("Mostre meus horários livres nos próximos 3 dias", "analisar_tempo_livre", 3),
+    ("Tenho tempo livre amanhã?", "analisar_tempo_livre", 2),
+])
+def test_comandos_de_agenda_viram_acao_direta(roteador, pergunta, acao, dias):
+    rota = roteador.classificar(pergunta)
+    assert rota.destino == "calendario"
+    assert rota.acao.action_type == acao
+    assert rota.acao.params["dias"] == dias
+
+
+def test_alteracao_da_agenda_passa_pelo_modelo(roteador):
+    rota = roteador.classificar("Marque uma reunião amanhã às 10h")
+    assert rota.destino == "completo"
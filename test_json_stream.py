@@ -0,0 +1,66 @@
+import json
+import pytest
+from utils.json_stream import completar_json, extrair_objeto_json, CampoTextoIncremental
+
+
+def _alimentar_aos_pedacos(texto, tamanho, campo="resposta"):
+    decodificador = CampoTextoIncremental(campo)
+    return "".join(decodificador.alimentar(texto[i:i + tamanho]) for i in range(0, len(texto), tamanho))
+
+
+@pytest.mark.parametrize("truncado, esperado", [
+    ('{"resposta": "Olá', {"resposta": "Olá"}),
+    ('{"resposta": "a", "ac', {"resposta": "a"}),
+    ('{"resposta": "a", "acao": tr', {"resposta": "a"}),
+    ('{"resposta": "a", "acao": nu', {"resposta": "a"}),
+    ('{"resposta": "a", "lista": [1, 2', {"resposta": "a", "lista": [1, 2]}),
+    ('{"resposta": "fim\\', {"resposta": "fim"}),
+    ('{"resposta": "fim\\u00', {"resposta": "fim"}),
+    ('{"resposta": "barra \\\\', {"resposta": "barra \\"}),
+])
+def test_completar_json_fecha_texto_truncado(truncado, esperado):
+    assert json.loads(completar_json(truncado)) == esperado
+
+
+def test_completar_json_mantem_json_completo():
+    texto = '{"resposta": "a", "acao": {"action_type": "listar_eventos", "params": {"dias": 3}}}'
+    assert completar_json(texto) == texto
+
+
+def test_extrair_objeto_json_com_filtro_e_objetos_aninhados():
+    texto = 'Antes {"x": 1} depois {"action_type": "listar_eventos", "params": {"dias": 2}} fim'
+    objeto = extrair_objeto_json(texto, lambda o: "action_type" in o)
+    assert objeto == {"action_type": "listar_eventos", "params": {"dias": 2}}
+
+
+def test_extrair_objeto_json_sem_completar_ignora_objeto_truncado():
+    texto = '{"action_type": "criar_evento", "params": {"description": "Discutir o pl'
+    assert extrair_objeto_json(texto, lambda o: "action_type" in o, completar=False) is None
+    completado = extrair_objeto_json(texto, lambda o: "action_type" in o)
+    assert completado["params"]["description"] == "Discutir o pl"
+
+
+@pytest.mark.parametrize("tamanho", [1, 2, 3, 5, 7, 64])
+def test_campo_incremental_decodifica_escapes_divididos(tamanho):
+    texto = '{"resposta": "linha\\nnova \\"aspas\\" \\u00e9 \\ud83d\\ude00 fim", "acao": null}'
+    assert _alimentar_aos_pedacos(texto, tamanho) == 'linha\nnova "aspas" é 😀 fim'
+
+
+@pytest.mark.parametrize("tamanho", [1, 4, 64])
+def test_campo_incremental_substitutos_isolados_viram_ffd(tamanho):
+    texto = '{"resposta": "a\\ud83d b\\ude00 c\\ud83d"}'
+    assert _alimentar_aos_pedacos(texto, tamanho) == "a� b� c�"
+
+
+@pytest.mark.parametrize("tamanho", [1, 3, 64])
+def test_campo_incremental_escape_malformado_nao_interrompe(tamanho):
+    texto = '{"resposta": "a\\uZZZZb\\ud83d\\uZZZZc"}'
+    assert _alimentar_aos_pedacos(texto, tamanho) == "a�b��c"
+
+
+def test_campo_incremental_ignora_texto_apos_o_campo():
+    decodificador = CampoTextoIncremental("resposta")
+    assert decodificador.alimentar('{"outro": "x", "resposta": "o') == "o"
+    assert decodificador.alimentar('k", "acao": "ignorado"}') == "k"
+    assert decodificador.concluido
+    assert decodificador.alimentar('"mais"') == ""
@@ -0,0 +1,176 @@
+import re
+import json
+import time
+import uuid
+import threading
+import contextvars
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional, Iterator, Callable, Tuple
+from config import TRACE_HISTORY_SIZE, TRACE_LOG_SPANS
+
+LIMITES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+LIMITES_TOKENS = (16, 32, 64, 128, 256, 512, 1024, 2048)
+LIMITES_TOKENS_POR_SEGUNDO = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200)
+
+
+class Histograma:
+    """Histograma cumulativo no formato do Prometheus, com um rótulo opcional."""
+
+    def __init__(self, nome: str, descricao: str, limites: Tuple[float, ...], rotulo: Optional[str] = None):
+        self.nome = nome
+        self.descricao = descricao
+        self.limites = limites
+        self.rotulo = rotulo
+        self._series: Dict[Optional[str], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float, rotulo: Optional[str] = None):
+        with self._lock:
+            # Contagens por faixa, seguidas da soma e do total
+            serie = self._series.setdefault(rotulo, [0.0] * (len(self.limites) + 3))
+            serie[bisect_left(self.limites, valor)] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def exportar(self) -> List[str]:
+        linhas = [f"# HELP {self.nome} {self.descricao}", f"# TYPE {self.nome} histogram"]
+        with self._lock:
+            series = {rotulo: list(valores) for rotulo, valores in self._series.items()}
+        for rotulo, valores in sorted(series.items(), key=lambda item: item[0] or ""):
+            base = f'{self.rotulo}="{rotulo}",' if self.rotulo else ""
+            acumulado = 0.0
+            for limite, contagem in zip(self.limites + (float("inf"),), valores):
+                acumulado += contagem
+                le = "+Inf" if limite == float("inf") else repr(limite)
+                linhas.append(f'{self.nome}_bucket{{{base}le="{le}"}} {acumulado:g}')
+            sufixo = f"{{{base.rstrip(',')}}}" if base else ""
+            linhas.append(f"{self.nome}_sum{sufixo} {valores[-2]:.6f}")
+            linhas.append(f"{self.nome}_count{sufixo} {valores[-1]:g}")
+        return linhas
+
+
+DURACAO_ETAPAS = Histograma(
+    "jarvis_etapa_duracao_segundos", "Duração de cada etapa do atendimento", LIMITES_SEGUNDOS, "etapa")
+PRIMEIRO_TOKEN = Histograma(
+    "jarvis_tempo_primeiro_token_segundos", "Tempo até o primeiro token da resposta", LIMITES_SEGUNDOS)
+TOKENS_GERADOS = Histograma(
+    "jarvis_tokens_gerados", "Tokens gerados por resposta", LIMITES_TOKENS)
+TOKENS_POR_SEGUNDO = Histograma(
+    "jarvis_tokens_por_segundo", "Velocidade de geração após o primeiro token", LIMITES_TOKENS_POR_SEGUNDO)
+ESPERA_FILA = Histograma(
+    "jarvis_fila_modelo_espera_segundos", "Espera na fila do modelo por prioridade", LIMITES_SEGUNDOS,
+    "prioridade")
+
+HISTOGRAMAS = [DURACAO_ETAPAS, PRIMEIRO_TOKEN, TOKENS_GERADOS, TOKENS_POR_SEGUNDO, ESPERA_FILA]
+
+# Valores avaliados na exportação: nome -> (descrição, tipo, função que retorna o valor)
+_medidores: Dict[str, Tuple[str, str, Callable[[], float]]] = {}
+
+
+def registrar_medidor(nome: str, descricao: str, leitura: Callable[[], float]):
+    """Registra um valor instantâneo (gauge) lido a cada exportação."""
+    _medidores[nome] = (descricao, "gauge", leitura)
+
+
+def registrar_contador(nome: str, descricao: str, leitura: Callable[[], float]):
+    """Registra um total acumulado (counter) lido a cada exportação; o nome deve terminar em _total."""
+    _medidores[nome] = (descricao, "counter", leitura)
+
+
+def exportar_prometheus() -> str:
+    """Todas as métricas no formato de texto do Prometheus."""
+    linhas = []
+    for histograma in HISTOGRAMAS:
+        linhas.extend(histograma.exportar())
+    for nome, (descricao, tipo, leitura) in sorted(_medidores.items()):
+        try:
+            valor = float(leitura())
+        except Exception:
+            continue
+        linhas.extend([f"# HELP {nome} {descricao}", f"# TYPE {nome} {tipo}", f"{nome} {valor:g}"])
+    return "\n".join(linhas) + "\n"
+
+
+# Rastro da requisição em andamento (propagado para tarefas e threads que copiam o contexto)
+_rastro_atual: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("rastro_atual", default=None)
+_rastros: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+_lock_rastros = threading.Lock()
+
+
+# Identificadores aceitos vindos do cliente (cabeçalho X-Trace-Id)
+_TRACE_ID_VALIDO = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+
+def rastro_atual() -> Optional[str]:
+    return _rastro_atual.get()
+
+
+@contextmanager
+def iniciar_rastro(trace_id: Optional[str] = None) -> Iterator[str]:
+    """
+    Associa as etapas executadas no bloco a um identificador de rastro.
+
+    Um identificador inválido é substituído por um novo; um já existente continua o rastro
+    anterior em vez de apagá-lo.
+    """
+    if not trace_id or not _TRACE_ID_VALIDO.fullmatch(trace_id):
+        trace_id = uuid.uuid4().hex
+    with _lock_rastros:
+        _rastros.setdefault(trace_id, [])
+        _rastros.move_to_end(trace_id)
+        while len(_rastros) > TRACE_HISTORY_SIZE:
+            _rastros.popitem(last=False)
+    token = _rastro_atual.set(trace_id)
+    try:
+        yield trace_id
+    finally:
+        _rastro_atual.reset(token)
+
+
+def obter_rastro(trace_id: str) -> Optional[List[Dict[str, Any]]]:
+    """Etapas registradas de um rastro recente."""
+    with _lock_rastros:
+        etapas = _rastros.get(trace_id)
+        return list(etapas) if etapas is not None else None
+
+
+@contextmanager
+def rastrear(etapa: str, **atributos) -> Iterator[Dict[str, Any]]:
+    """
+    Mede uma etapa: registra a duração no histograma e, se houver um rastro ativo, guarda a etapa
+    nele. O dicionário devolvido recebe atributos adicionais durante a execução.
+    """
+    inicio = time.perf_counter()
+    erro = None
+    try:
+        yield atributos
+    except BaseException as e:
+        erro = type(e).__name__
+        raise
+    finally:
+        duracao = time.perf_counter() - inicio
+        DURACAO_ETAPAS.observar(duracao, etapa)
+        registro = {"etapa": etapa, "duracao_ms": round(duracao * 1000, 3), **atributos}
+        if erro:
+            registro["erro"] = erro
+        trace_id = _rastro_atual.get()
+        if trace_id is not None:
+            registro["trace_id"] = trace_id
+            with _lock_rastros:
+                if trace_id in _rastros:
+                    _rastros[trace_id].append(registro)
+        if TRACE_LOG_SPANS:
+            print(json.dumps(registro, ensure_ascii=False, default=str))
+
+
+def registrar_geracao(primeiro_token: float, duracao: float, tokens: int) -> Dict[str, float]:
+    """Registra as métricas de uma geração e retorna os valores calculados."""
+    PRIMEIRO_TOKEN.observar(primeiro_token)
+    TOKENS_GERADOS.observar(tokens)
+    metricas = {"tokens_gerados": tokens, "tempo_primeiro_token_s": round(primeiro_token, 4)}
+    if tokens > 1 and duracao > primeiro_token:
+        metricas["tokens_por_segundo"] = round((tokens - 1) / (duracao - primeiro_token), 2)
+        TOKENS_POR_SEGUNDO.observar(metricas["tokens_por_segundo"])
+    return metricas
@@ -1,94 +1,882 @@
 import os
+import re
+import asyncio
+import json
 import time
+import shutil
+import hashlib
+import sqlite3
+import threading
+from collections import deque, defaultdict
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, List, Any, Iterator, Tuple, Optional
+import numpy as np
+import faiss
 from langchain_community.vectorstores import FAISS
 from langchain_ollama.embeddings import OllamaEmbeddings
-from langchain_community.document_loaders import DirectoryLoader, UnstructuredMarkdownLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, AsyncCallbackManagerForRetrieverRun
 from utils.helpers import PerformanceTimer
+from utils.tracing import rastrear
+from utils.markdown_loader import MarkdownLoader
+from services.embedding_cache import EmbeddingCache, CacheConsultas, CacheEmbeddings
+from services.lexical_index import IndiceLexico
+from services.llm_scheduler import EmbeddingsAgendados, agendador_modelo
+from services.index_storage import (
+    novo_docstore,
+    salvar_indice,
+    carregar_indice,
+    indice_gravavel
+)
 from config import (
-    DOCS_DIR, 
-    VECTOR_STORE_PATH, 
-    LLM_MODEL,
+    DOCS_DIR,
+    VECTOR_STORE_PATH,
+    MANIFEST_FILENAME,
+    INDEX_VERSION_FILENAME,
+    INDEX_BUILD_FILENAME,
+    INDEX_MMAP,
+    EMBEDDING_MODEL,
+    EMBEDDING_MODELS,
     CHUNK_SIZE,
     CHUNK_OVERLAP,
     RETRIEVER_K,
     RETRIEVER_FETCH_K,
-    RETRIEVER_LAMBDA_MULT
+    RETRIEVER_LAMBDA_MULT,
+    RETRIEVER_SEARCH_TYPE,
+    RETRIEVER_SCORE_THRESHOLD,
+    RETRIEVER_MODE,
+    HYBRID_RRF_K,
+    LEXICAL_FAST_PATH_RATIO,
+    LEXICAL_INDEX_FILENAME,
+    EMBEDDING_CACHE_DIR,
+    EMBEDDING_CACHE_MAX_MB,
+    QUERY_CACHE_SIZE,
+    QUERY_CACHE_TTL_SECONDS,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_CONCURRENCY,
+    INDEX_CHECKPOINT_BATCHES,
+    MARKDOWN_WORKERS,
+    FAISS_INDEX_TYPE,
+    FAISS_INDEX_FACTORIES,
+    FAISS_NLIST,
+    FAISS_PQ_M,
+    FAISS_NPROBE,
+    FAISS_EF_SEARCH,
+    FAISS_TRAIN_SAMPLE,
+    FAISS_REPORT_RECALL
 )
 
+# Os codebooks de 8 bits do PQ exigem ao menos 256 vetores de treino
+_MINIMO_TREINO_PQ = 2 ** 8
+
+def selecionar_mmr(consulta: np.ndarray, candidatos: np.ndarray, k: int,
+                   lambda_mult: float) -> List[int]:
+    """
+    Seleciona k candidatos por Maximal Marginal Relevance.
+
+    As similaridades de cosseno são calculadas de uma vez como produtos de matrizes; a
+    seleção gulosa apenas atualiza o vetor de similaridade máxima com os já escolhidos.
+    """
+    if len(candidatos) == 0:
+        return []
+
+    normas = np.linalg.norm(candidatos, axis=1, keepdims=True)
+    candidatos = candidatos / np.where(normas == 0, 1, normas)
+    consulta = consulta / (np.linalg.norm(consulta) or 1)
+
+    relevancia = candidatos @ consulta
+    similaridade = candidatos @ candidatos.T
+
+    selecionados = [int(np.argmax(relevancia))]
+    redundancia = similaridade[selecionados[0]].copy()
+    while len(selecionados) < min(k, len(candidatos)):
+        pontuacao = lambda_mult * relevancia - (1 - lambda_mult) * redundancia
+        pontuacao[selecionados] = -np.inf
+        escolhido = int(np.argmax(pontuacao))
+        selecionados.append(escolhido)
+        np.maximum(redundancia, similaridade[escolhido], out=redundancia)
+
+    return selecionados
+
+
+class RetrieverIndice(BaseRetriever):
+    """Retriever que sempre consulta a versão atual do índice do serviço."""
+
+    servico: Any
+    k: int = RETRIEVER_K
+    fetch_k: int = RETRIEVER_FETCH_K
+    lambda_mult: float = RETRIEVER_LAMBDA_MULT
+    modo: str = RETRIEVER_MODE
+    tipo_busca: str = RETRIEVER_SEARCH_TYPE
+    limiar: Optional[float] = RETRIEVER_SCORE_THRESHOLD
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        # Uma única leitura da referência: a consulta inteira usa a mesma versão do índice
+        vector_store = self.servico.vector_store
+        return self.servico.buscar_documentos(
+            vector_store, query, k=self.k, fetch_k=self.fetch_k, lambda_mult=self.lambda_mult,
+            modo=self.modo, tipo_busca=self.tipo_busca, limiar=self.limiar)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        vector_store = self.servico.vector_store
+        return await self.servico.abuscar_documentos(
+            vector_store, query, k=self.k, fetch_k=self.fetch_k, lambda_mult=self.lambda_mult,
+            modo=self.modo, tipo_busca=self.tipo_busca, limiar=self.limiar)
+
+
 class VectorStoreService:
     """Serviço para gerenciamento do índice vetorial."""
-    
-    def __init__(self):
-        self.embeddings = OllamaEmbeddings(model=LLM_MODEL)
+
+    def __init__(self, caminho: str = VECTOR_STORE_PATH, diretorio_docs: str = DOCS_DIR,
+                 embeddings_base: Optional[Embeddings] = None, diretorio_cache: str = EMBEDDING_CACHE_DIR):
+        self.base = caminho
+        self.diretorio_docs = diretorio_docs
+        self.embedding_cache = EmbeddingCache(diretorio_cache, EMBEDDING_MODEL, EMBEDDING_CACHE_MAX_MB)
+        self.cache_consultas = CacheConsultas(EMBEDDING_MODEL, QUERY_CACHE_SIZE, QUERY_CACHE_TTL_SECONDS)
+        # Só as chamadas que passam pelos caches chegam ao agendador do servidor
+        if embeddings_base is None:
+            embeddings_base = EmbeddingsAgendados(OllamaEmbeddings(model=EMBEDDING_MODEL), agendador_modelo)
+        self.embeddings = CacheEmbeddings(embeddings_base, self.embedding_cache, self.cache_consultas)
         self.vector_store = None
-        
+        self.loader = MarkdownLoader(CHUNK_SIZE, CHUNK_OVERLAP, max_workers=MARKDOWN_WORKERS)
+        self._lock_atualizacao = threading.RLock()
+        self._usar_versao(self._versao_atual())
+        # Incrementada a cada alteração salva do índice (usada para invalidar caches)
+        self.versao = 0
+
+    @property
+    def arquivo_manifesto(self) -> str:
+        return os.path.join(self.caminho, MANIFEST_FILENAME)
+
+    def _versao_atual(self) -> str:
+        """Retorna o diretório da versão do índice em uso."""
+        ponteiro = os.path.join(self.base, INDEX_VERSION_FILENAME)
+        if os.path.exists(ponteiro):
+            with open(ponteiro, "r", encoding="utf-8") as f:
+                return os.path.join(self.base, f.read().strip())
+        # Layout anterior, com o índice direto no diretório base
+        return self.base
+
+    def _usar_versao(self, caminho: str):
+        self.caminho = caminho
+        self.lexico = IndiceLexico(os.path.join(caminho, LEXICAL_INDEX_FILENAME))
+
+    def _nova_versao(self) -> str:
+        """Cria o diretório de uma nova versão do índice."""
+        os.makedirs(self.base, exist_ok=True)
+        numeros = [int(nome[1:]) for nome in os.listdir(self.base) if re.fullmatch(r"v\d+", nome)]
+        caminho = os.path.join(self.base, f"v{max(numeros, default=0) + 1:04d}")
+        os.makedirs(caminho)
+        return caminho
+
+    def _publicar_versao(self, caminho: str):
+        """Aponta o diretório base para a versão em caminho (troca atômica do ponteiro)."""
+        self._gravar_ponteiro(INDEX_VERSION_FILENAME, caminho)
+        self._usar_versao(caminho)
+
+    def _gravar_ponteiro(self, nome: str, caminho: Optional[str]):
+        ponteiro = os.path.join(self.base, nome)
+        if caminho is None:
+            if os.path.exists(ponteiro):
+                os.remove(ponteiro)
+            return
+        with open(ponteiro + ".tmp", "w", encoding="utf-8") as f:
+            f.write(os.path.basename(caminho))
+        os.replace(ponteiro + ".tmp", ponteiro)
+
+    def _versao_em_construcao(self) -> Optional[str]:
+        """Diretório de uma construção completa ainda não publicada, se houver."""
+        ponteiro = os.path.join(self.base, INDEX_BUILD_FILENAME)
+        if not os.path.exists(ponteiro):
+            return None
+        with open(ponteiro, "r", encoding="utf-8") as f:
+            caminho = os.path.join(self.base, f.read().strip())
+        if not os.path.isdir(caminho) or caminho == self._versao_atual():
+            return None
+        return caminho
+
+    def _sombra(self, caminho: str) -> "VectorStoreService":
+        """Serviço que compartilha embeddings e caches, mas trabalha na versão em caminho."""
+        sombra = VectorStoreService.__new__(VectorStoreService)
+        sombra.__dict__.update(self.__dict__)
+        sombra._usar_versao(caminho)
+        sombra.vector_store = None
+        sombra._lock_atualizacao = threading.RLock()
+        return sombra
+
+    def _publicar(self, sombra: "VectorStoreService") -> FAISS:
+        """Publica a versão construída pela sombra, em disco e em memória."""
+        # Diretórios não são renomeados: no Windows, arquivos abertos impediriam a troca
+        self._publicar_versao(sombra.caminho)
+        self._gravar_ponteiro(INDEX_BUILD_FILENAME, None)
+        self.vector_store = sombra.vector_store
+        self.versao += 1
+        self._limpar_versoes()
+        return self.vector_store
+
+    def _limpar_versoes(self):
+        """
+        Remove versões do índice que não estão mais em uso.
+
+        Arquivos ainda abertos (mapeados ou SQLite) não podem ser removidos no Windows;
+        ficam para a próxima limpeza.
+        """
+        atual = self._versao_atual()
+        if atual == self.base or not os.path.isdir(self.base):
+            return
+        em_uso = {os.path.basename(atual), os.path.basename(self.caminho), INDEX_VERSION_FILENAME,
+                  INDEX_BUILD_FILENAME}
+        construcao = self._versao_em_construcao()
+        if construcao:
+            em_uso.add(os.path.basename(construcao))
+        for nome in os.listdir(self.base):
+            alvo = os.path.join(self.base, nome)
+            if nome in em_uso:
+                continue
+            if os.path.isdir(alvo) and re.fullmatch(r"v\d+", nome):
+                shutil.rmtree(alvo, ignore_errors=True)
+            elif os.path.isfile(alvo):
+                # Arquivos do layout anterior
+                try:
+                    os.remove(alvo)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _copiar_versao(origem: str, destino: str):
+        """Copia os arquivos de uma versão do índice, com cópias consistentes dos bancos SQLite."""
+        for nome in os.listdir(origem):
+            caminho = os.path.join(origem, nome)
+            if not os.path.isfile(caminho) or nome.endswith(("-wal", "-shm")):
+                continue
+            if nome.endswith(".db"):
+                with closing(sqlite3.connect(caminho)) as fonte, \
+                        closing(sqlite3.connect(os.path.join(destino, nome))) as copia:
+                    fonte.backup(copia)
+            else:
+                shutil.copy2(caminho, os.path.join(destino, nome))
+
+    def _carregar(self, mmap: bool = INDEX_MMAP) -> FAISS:
+        """Carrega a versão atual do índice do disco."""
+        vector_store = carregar_indice(self.caminho, self.embeddings, mmap=mmap)
+        self._configurar_busca(vector_store.index)
+        return vector_store
+
+    def _preparar_escrita(self):
+        """Troca o índice mapeado do disco por uma cópia em memória antes de alterá-lo."""
+        self.vector_store = indice_gravavel(self.vector_store, self.caminho)
+        self._configurar_busca(self.vector_store.index)
+
+    def _liberar_escrita(self):
+        """Volta a consultar o índice mapeado do disco depois de salvo."""
+        if INDEX_MMAP and self.vector_store is not None and \
+                not getattr(self.vector_store, "somente_leitura", False):
+            self.vector_store = self._carregar()
+
     def carregar_ou_criar_indice(self):
         """Carrega o índice FAISS existente ou cria um novo."""
         with PerformanceTimer("Inicialização do índice vetorial"):
-            if os.path.exists(VECTOR_STORE_PATH) and os.listdir(VECTOR_STORE_PATH):
+            self._limpar_versoes()
+            if self._versao_em_construcao():
+                print("Retomando construção interrompida do índice...")
+                return self.atualizar_indice(completo=True)
+            if os.path.exists(os.path.join(self.caminho, "index.faiss")):
+                manifesto = self._carregar_manifesto()
+                if not self._indice_compativel(manifesto):
+                    print("Índice vetorial incompatível com a configuração atual, recriando...")
+                    return self.atualizar_indice(completo=True)
+
                 print("Carregando índice vetorial existente...")
-                self.vector_store = FAISS.load_local(VECTOR_STORE_PATH, self.embeddings)
+                self.vector_store = self._carregar()
+                if not self.lexico.existe():
+                    self._reconstruir_lexico()
+
+                # Retoma uma construção interrompida a partir do último checkpoint
+                if not manifesto.get("completo", True):
+                    print("Retomando construção interrompida do índice...")
+                    self.atualizar_indice()
                 return self.vector_store
-            
+
             print("Criando novo índice vetorial...")
-            self.vector_store = self._criar_novo_indice()
-            return self.vector_store
-    
+            return self.atualizar_indice(completo=True)
+
     def _criar_novo_indice(self):
         """Cria um novo índice vetorial a partir dos documentos."""
-        # Carrega os documentos
-        loader = DirectoryLoader(
-            DOCS_DIR,
-            glob="**/*.md",
-            loader_cls=UnstructuredMarkdownLoader
-        )
-        
-        print("Carregando documentos...")
-        docs = loader.load()
-        print(f"Carregados {len(docs)} documentos")
-        
-        # Dividir documentos em chunks menores para melhor recuperação
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=CHUNK_SIZE,
-            chunk_overlap=CHUNK_OVERLAP,
-            separators=["\n\n", "\n", ". ", " ", ""]
-        )
-        
-        print("Dividindo documentos em chunks...")
-        chunks = text_splitter.split_documents(docs)
-        print(f"Criados {len(chunks)} chunks de texto")
-        
+        arquivos = self._listar_arquivos()
+        print(f"Encontrados {len(arquivos)} documentos")
+
         # Criação de embeddings e índice
         print("Criando embeddings e índice vetorial...")
-        vector_store = FAISS.from_documents(chunks, self.embeddings)
-        
+        self.vector_store = None
+        manifesto = {"arquivos": {}, "completo": False}
+        self._indexar_arquivos(arquivos, manifesto)
+
         # Salvar o índice para uso futuro
         print("Salvando índice vetorial...")
-        vector_store.save_local(VECTOR_STORE_PATH)
-        
-        return vector_store
-    
+        manifesto["completo"] = True
+        self._salvar(manifesto)
+        self._liberar_escrita()
+
+        if FAISS_INDEX_TYPE != "flat" and FAISS_REPORT_RECALL and self.vector_store is not None:
+            self.avaliar_indice()
+
+        return self.vector_store
+
+    def _listar_arquivos(self) -> Dict[str, str]:
+        """Lista os arquivos Markdown do acervo (caminho relativo -> caminho absoluto)."""
+        arquivos = {}
+        for raiz, _, nomes in os.walk(self.diretorio_docs):
+            for nome in nomes:
+                if nome.endswith(".md"):
+                    caminho = os.path.join(raiz, nome)
+                    arquivos[os.path.relpath(caminho, self.diretorio_docs)] = caminho
+        return dict(sorted(arquivos.items()))
+
+    @staticmethod
+    def _hash_arquivo(caminho: str) -> str:
+        """Calcula o hash SHA-256 do conteúdo de um arquivo."""
+        sha = hashlib.sha256()
+        with open(caminho, "rb") as f:
+            for bloco in iter(lambda: f.read(1 << 20), b""):
+                sha.update(bloco)
+        return sha.hexdigest()
+
+    def _gerar_chunks(self, arquivos: Dict[str, str]) -> Iterator[Tuple[str, str, List[Document]]]:
+        """Carrega e divide os arquivos em paralelo, sem manter o acervo inteiro em memória."""
+        yield from self.loader.carregar(arquivos)
+
+    def _indexar_arquivos(self, arquivos: Dict[str, str], manifesto: Dict[str, Any]):
+        """
+        Indexa os arquivos em fluxo: carrega, divide, gera embeddings em lotes e adiciona ao índice.
+
+        Os lotes são enviados ao modelo com concorrência limitada e consumidos em ordem, o que
+        limita a memória usada. Um arquivo só entra no manifesto quando todos os seus chunks
+        estão no índice, e checkpoints periódicos permitem retomar uma construção interrompida.
+        """
+        indexados = manifesto.setdefault("arquivos", {})
+        em_andamento = deque()
+        aguardando_treino = []
+        lote = {"textos": [], "metadados": [], "ids": [], "concluidos": []}
+        progresso = {"lotes": 0, "chunks": 0, "arquivos": 0}
+
+        def consumir():
+            future, dados = em_andamento.popleft()
+            vetores = future.result()
+            if self.vector_store is None and dados["textos"]:
+                # Índices treinados precisam de uma amostra antes de receber vetores
+                aguardando_treino.append((vetores, dados))
+                if sum(len(v) for v, _ in aguardando_treino) < self._tamanho_amostra():
+                    return
+                inicializar()
+            else:
+                adicionar(vetores, dados)
+
+        def inicializar():
+            self.vector_store = self._novo_vector_store(
+                [vetor for vetores, _ in aguardando_treino for vetor in vetores])
+            for vetores, dados in aguardando_treino:
+                adicionar(vetores, dados)
+            aguardando_treino.clear()
+
+        def adicionar(vetores, dados):
+            if dados["textos"]:
+                pares = list(zip(dados["textos"], vetores))
+                self.vector_store.add_embeddings(pares, metadatas=dados["metadados"], ids=dados["ids"])
+                self.vector_store._posicoes_por_id = None
+                self.lexico.adicionar(dados["ids"], dados["textos"])
+
+            for relativo, entrada in dados["concluidos"]:
+                indexados[relativo] = entrada
+            progresso["lotes"] += 1
+            progresso["chunks"] += len(dados["textos"])
+            progresso["arquivos"] += len(dados["concluidos"])
+
+            if progresso["lotes"] % INDEX_CHECKPOINT_BATCHES == 0:
+                print(f"Checkpoint: {progresso['arquivos']}/{len(arquivos)} arquivos, "
+                      f"{progresso['chunks']} chunks indexados")
+                self._salvar(manifesto)
+
+        def enviar(executor):
+            dados = dict(lote)
+            if dados["textos"]:
+                future = executor.submit(self.embeddings.embed_documents, dados["textos"])
+            else:
+                # Lote sem textos (apenas arquivos vazios concluídos)
+                future = Future()
+                future.set_result([])
+            em_andamento.append((future, dados))
+            for chave in lote:
+                lote[chave] = []
+
+            # Contrapressão: não deixa o carregamento avançar muito à frente dos embeddings
+            while len(em_andamento) >= EMBEDDING_CONCURRENCY * 2:
+                consumir()
+
+        try:
+            with ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY) as executor:
+                for relativo, hash_arquivo, chunks in self._gerar_chunks(arquivos):
+                    # IDs estáveis por arquivo e versão do conteúdo
+                    ids = [f"{relativo}::{hash_arquivo[:12]}::{i}" for i in range(len(chunks))]
+
+                    for chunk, chunk_id in zip(chunks, ids):
+                        lote["textos"].append(chunk.page_content)
+                        lote["metadados"].append(chunk.metadata)
+                        lote["ids"].append(chunk_id)
+                        if len(lote["textos"]) >= EMBEDDING_BATCH_SIZE:
+                            enviar(executor)
+
+                    lote["concluidos"].append((relativo, {"hash": hash_arquivo, "chunks": ids}))
+
+                if lote["textos"] or lote["concluidos"]:
+                    enviar(executor)
+                while em_andamento:
+                    consumir()
+                if aguardando_treino:
+                    inicializar()
+
+        except BaseException:
+            # Libera os bancos SQLite; o disco permanece no último checkpoint
+            if self.vector_store is not None and hasattr(self.vector_store.docstore, "descartar"):
+                self.vector_store.docstore.descartar()
+            self.lexico.descartar()
+            raise
+
+        print(f"Indexados {progresso['chunks']} chunks de {progresso['arquivos']} arquivos")
+        stats = self.embedding_cache.estatisticas()
+        print(f"Cache de embeddings: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['entradas']}/{stats['capacidade']} entradas)")
+
+    @staticmethod
+    def _tamanho_amostra() -> int:
+        """Quantidade de vetores acumulados antes de criar o índice."""
+        return FAISS_TRAIN_SAMPLE if FAISS_INDEX_TYPE in ("ivf", "ivfpq") else 1
+
+    @staticmethod
+    def _fabrica_indice(quantidade: int) -> str:
+        """Retorna a string de fábrica do FAISS para o tipo de índice configurado."""
+        # O IVF precisa de dezenas de vetores de treino por lista
+        nlist = max(1, min(FAISS_NLIST, quantidade // 39))
+        tipo = FAISS_INDEX_TYPE
+        if tipo == "ivfpq" and quantidade < _MINIMO_TREINO_PQ:
+            # Registrado no manifesto (pq_adiado): o índice é recriado com PQ quando houver vetores
+            print(f"Apenas {quantidade} vetores para treinar o PQ; usando IVF sem compressão")
+            tipo = "ivf"
+        return FAISS_INDEX_FACTORIES[tipo].format(nlist=nlist, pq_m=FAISS_PQ_M)
+
+    @staticmethod
+    def _configurar_busca(index):
+        """Aplica os parâmetros de busca dos índices aproximados."""
+        parametros = faiss.ParameterSpace()
+        if FAISS_INDEX_TYPE in ("ivf", "ivfpq"):
+            parametros.set_index_parameter(index, "nprobe", FAISS_NPROBE)
+            # Permite reconstruir vetores por posição (usado pelo MMR)
+            faiss.extract_index_ivf(index).make_direct_map()
+        elif FAISS_INDEX_TYPE == "hnsw":
+            parametros.set_index_parameter(index, "efSearch", FAISS_EF_SEARCH)
+
+    def _novo_vector_store(self, amostra: List[List[float]]) -> FAISS:
+        """Cria um índice vazio do tipo configurado, treinado com a amostra se necessário."""
+        vetores = np.asarray(amostra, dtype=np.float32)
+        fabrica = self._fabrica_indice(len(vetores))
+        print(f"Criando índice FAISS '{fabrica}'")
+
+        index = faiss.index_factory(vetores.shape[1], fabrica)
+        if not index.is_trained:
+            with PerformanceTimer(f"Treinamento do índice com {len(vetores)} vetores"):
+                index.train(vetores)
+        self._configurar_busca(index)
+        return FAISS(self.embeddings, index, novo_docstore(self.caminho), {})
+
+    def _excluir_vetores(self, ids: List[str]):
+        """Remove vetores do índice."""
+        self.vector_store.docstore.posicoes_invalidas = True
+        if FAISS_INDEX_TYPE == "flat":
+            self.vector_store.delete(ids)
+            self.vector_store._posicoes_por_id = None
+            return
+
+        # Índices aproximados não renumeram as posições ao remover (e o HNSW nem suporta remoção):
+        # o conteúdo é recriado sobre o mesmo treino, com os vetores lidos do próprio índice
+        removidos = set(ids)
+        antigo = self.vector_store
+        mantidos = [(pos, chunk_id) for pos, chunk_id in antigo.index_to_docstore_id.items()
+                    if chunk_id not in removidos]
+        index = faiss.clone_index(antigo.index)
+        index.reset()
+        self._configurar_busca(index)
+        for inicio in range(0, len(mantidos), 4096):
+            posicoes = np.array([pos for pos, _ in mantidos[inicio:inicio + 4096]], dtype=np.int64)
+            index.add(antigo.index.reconstruct_batch(posicoes))
+
+        antigo.docstore.delete(ids)
+        self.vector_store = FAISS(self.embeddings, index, antigo.docstore,
+                                  {pos: chunk_id for pos, (_, chunk_id) in enumerate(mantidos)})
+
+    def avaliar_indice(self, n_consultas: int = 100) -> Dict[str, float]:
+        """
+        Mede recall@k e latência do índice aproximado em relação à busca exata.
+
+        Consultas e vetores vêm do próprio índice (no PQ, já comprimidos): o recall mede o erro
+        da busca, sem recalcular embeddings.
+        """
+        index = self.vector_store.index
+        total = index.ntotal
+        rng = np.random.default_rng(0)
+        amostra = rng.choice(total, size=min(n_consultas, total), replace=False).astype(np.int64)
+        consultas = index.reconstruct_batch(amostra)
+        k = RETRIEVER_K
+
+        # Busca exata em fluxo, lendo os vetores em lotes para não duplicar o índice em memória
+        inicio = time.perf_counter()
+        melhores_dist = np.full((len(consultas), k), np.inf, dtype=np.float32)
+        melhores_ids = np.full((len(consultas), k), -1, dtype=np.int64)
+        for base in range(0, total, 4096):
+            vetores = index.reconstruct_n(base, min(4096, total - base))
+            dist, pos = faiss.knn(consultas, vetores, min(k, len(vetores)))
+            dist = np.hstack([melhores_dist, dist])
+            pos = np.hstack([melhores_ids, pos + base])
+            ordem = np.argsort(dist, axis=1)[:, :k]
+            melhores_dist = np.take_along_axis(dist, ordem, axis=1)
+            melhores_ids = np.take_along_axis(pos, ordem, axis=1)
+        latencia_exata = (time.perf_counter() - inicio) / len(consultas)
+
+        inicio = time.perf_counter()
+        _, aproximados = index.search(consultas, k)
+        latencia = (time.perf_counter() - inicio) / len(consultas)
+
+        acertos = sum(len(set(aproximados[i].tolist()) & set(melhores_ids[i].tolist()) - {-1})
+                      for i in range(len(consultas)))
+        relatorio = {
+            "recall": acertos / (len(consultas) * k),
+            "latencia_ms": latencia * 1000,
+            "latencia_exata_ms": latencia_exata * 1000
+        }
+        print(f"Índice '{FAISS_INDEX_TYPE}': recall@{k} {relatorio['recall']:.3f}, "
+              f"{relatorio['latencia_ms']:.3f} ms/consulta "
+              f"(busca exata: {relatorio['latencia_exata_ms']:.3f} ms/consulta)")
+        return relatorio
+
+    def _carregar_manifesto(self) -> Dict[str, Any]:
+        """Lê o manifesto de arquivos indexados, se existir."""
+        if not os.path.exists(self.arquivo_manifesto):
+            return {}
+        with open(self.arquivo_manifesto, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _metadados_indice(self) -> Dict[str, Any]:
+        """Retorna os parâmetros que determinam a compatibilidade do índice."""
+        dimensao = EMBEDDING_MODELS.get(EMBEDDING_MODEL)
+        if self.vector_store is not None:
+            dimensao = self.vector_store.index.d
+        return {
+            "modelo_embedding": EMBEDDING_MODEL,
+            "dimensao": dimensao,
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "divisao": "titulos_markdown",
+            "tipo_indice": FAISS_INDEX_TYPE,
+            "pq_adiado": self._pq_adiado()
+        }
+
+    def _pq_adiado(self) -> bool:
+        """Indica se o índice "ivfpq" foi criado sem PQ por falta de vetores de treino."""
+        if FAISS_INDEX_TYPE != "ivfpq" or self.vector_store is None:
+            return False
+        ivf = faiss.downcast_index(faiss.extract_index_ivf(self.vector_store.index))
+        return not isinstance(ivf, faiss.IndexIVFPQ)
+
+    def _indice_compativel(self, manifesto: Dict[str, Any]) -> bool:
+        """Verifica se o índice salvo foi gerado com o modelo e a divisão atuais."""
+        salvo = manifesto.get("meta")
+        if not salvo:
+            print("Índice sem metadados (gerado por uma versão anterior)")
+            return False
+
+        atual = self._metadados_indice()
+        for chave in ("modelo_embedding", "chunk_size", "chunk_overlap", "divisao", "tipo_indice"):
+            if salvo.get(chave) != atual[chave]:
+                print(f"Parâmetro '{chave}' alterado: {salvo.get(chave)} -> {atual[chave]}")
+                return False
+
+        # Um IVF criado no lugar do PQ vale até o acervo ter vetores suficientes para treiná-lo
+        if salvo.get("pq_adiado"):
+            vetores = sum(len(entrada["chunks"]) for entrada in manifesto.get("arquivos", {}).values())
+            if vetores >= _MINIMO_TREINO_PQ:
+                print(f"Índice criado sem PQ, mas o acervo já tem {vetores} vetores; recriando com PQ")
+                return False
+
+        # A dimensão real vem dos vetores; o registro serve apenas como conferência
+        if atual["dimensao"] and salvo.get("dimensao") != atual["dimensao"]:
+            print(f"Aviso: índice com dimensão {salvo.get('dimensao')}, "
+                  f"mas o registro informa {atual['dimensao']} para '{EMBEDDING_MODEL}'")
+        return True
+
+    def _salvar(self, manifesto: Dict[str, Any]):
+        """Salva o índice e o manifesto correspondente."""
+        manifesto["meta"] = self._metadados_indice()
+        self.versao += 1
+        if self.vector_store is not None:
+            salvar_indice(self.vector_store, self.caminho)
+        os.makedirs(self.caminho, exist_ok=True)
+        self.lexico.salvar()
+
+        # Grava em arquivo temporário e renomeia para nunca deixar um manifesto parcial
+        temporario = self.arquivo_manifesto + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(manifesto, f, ensure_ascii=False, indent=2)
+        os.replace(temporario, self.arquivo_manifesto)
+
+    def _reconstruir_lexico(self):
+        """Gera o índice léxico a partir dos chunks já armazenados, sem recalcular embeddings."""
+        print("Criando índice léxico a partir do índice vetorial...")
+        docstore = self.vector_store.docstore
+        ids = list(self.vector_store.index_to_docstore_id.values())
+        for i in range(0, len(ids), EMBEDDING_BATCH_SIZE):
+            lote = ids[i:i + EMBEDDING_BATCH_SIZE]
+            self.lexico.adicionar(lote, [docstore.search(chunk_id).page_content for chunk_id in lote])
+        self.lexico.salvar()
+
+    @staticmethod
+    def _busca_vetorial(vector_store: FAISS, vetor: np.ndarray, n: int) -> List[Tuple[str, float]]:
+        """Retorna (id do chunk, distância) dos n vizinhos mais próximos do vetor."""
+        distancias, posicoes = vector_store.index.search(vetor.reshape(1, -1), n)
+        return [(vector_store.index_to_docstore_id[int(pos)], float(dist))
+                for dist, pos in zip(distancias[0], posicoes[0]) if pos != -1]
+
+    @staticmethod
+    def _vetores_armazenados(vector_store: FAISS, ids: List[str]) -> np.ndarray:
+        """Lê do próprio índice os vetores dos chunks, sem recalcular embeddings."""
+        if hasattr(vector_store.index_to_docstore_id, "posicoes"):
+            # Mapa no SQLite: consulta apenas os ids pedidos
+            mapa = vector_store.index_to_docstore_id.posicoes(ids)
+            return vector_store.index.reconstruct_batch(np.array([mapa[i] for i in ids], dtype=np.int64))
+
+        # Mapa id -> posição, calculado uma vez por versão do índice
+        mapa = getattr(vector_store, "_posicoes_por_id", None)
+        if mapa is None or len(mapa) != len(vector_store.index_to_docstore_id):
+            mapa = {chunk_id: pos for pos, chunk_id in vector_store.index_to_docstore_id.items()}
+            vector_store._posicoes_por_id = mapa
+        posicoes = np.array([mapa[chunk_id] for chunk_id in ids], dtype=np.int64)
+        return vector_store.index.reconstruct_batch(posicoes)
+
+    def buscar_documentos(self, vector_store: FAISS, consulta: str, k: int = RETRIEVER_K,
+                          fetch_k: int = RETRIEVER_FETCH_K, lambda_mult: float = RETRIEVER_LAMBDA_MULT,
+                          modo: str = RETRIEVER_MODE, tipo_busca: str = RETRIEVER_SEARCH_TYPE,
+                          limiar: Optional[float] = RETRIEVER_SCORE_THRESHOLD) -> List[Document]:
+        """
+        Busca os chunks mais relevantes para a consulta.
+
+        No modo híbrido, os rankings léxico (BM25) e vetorial são combinados por Reciprocal
+        Rank Fusion; se o melhor resultado léxico contém todos os termos da consulta e se
+        destaca do segundo, o embedding da consulta é dispensado. Os fetch_k candidatos
+        passam então pelo limiar de similaridade e pelo MMR, calculados sobre os vetores
+        já armazenados no índice.
+        """
+        n = max(k, fetch_k)
+        with rastrear("busca_lexica") as span:
+            lexicos, atalho = self._busca_lexica(vector_store, consulta, k, n, modo)
+            span["atalho"] = atalho is not None
+        if atalho is not None:
+            return atalho
+
+        with rastrear("embedding_consulta"):
+            vetor = np.asarray(self.embeddings.embed_query(consulta), dtype=np.float32)
+        with rastrear("busca_vetorial"):
+            return self._combinar(vector_store, vetor, lexicos, k, n, lambda_mult, tipo_busca, limiar)
+
+    async def abuscar_documentos(self, vector_store: FAISS, consulta: str, k: int = RETRIEVER_K,
+                                 fetch_k: int = RETRIEVER_FETCH_K, lambda_mult: float = RETRIEVER_LAMBDA_MULT,
+                                 modo: str = RETRIEVER_MODE, tipo_busca: str = RETRIEVER_SEARCH_TYPE,
+                                 limiar: Optional[float] = RETRIEVER_SCORE_THRESHOLD) -> List[Document]:
+        """Versão assíncrona de buscar_documentos: o embedding da consulta não ocupa uma thread."""
+        n = max(k, fetch_k)
+        with rastrear("busca_lexica") as span:
+            lexicos, atalho = await asyncio.to_thread(self._busca_lexica, vector_store, consulta, k, n, modo)
+            span["atalho"] = atalho is not None
+        if atalho is not None:
+            return atalho
+
+        with rastrear("embedding_consulta"):
+            vetor = np.asarray(await self.embeddings.aembed_query(consulta), dtype=np.float32)
+        # O FAISS libera o GIL durante a busca
+        with rastrear("busca_vetorial"):
+            return await asyncio.to_thread(
+                self._combinar, vector_store, vetor, lexicos, k, n, lambda_mult, tipo_busca, limiar)
+
+    def _busca_lexica(self, vector_store: FAISS, consulta: str, k: int, n: int,
+                      modo: str) -> Tuple[List[Tuple[str, float]], Optional[List[Document]]]:
+        """Retorna o ranking léxico e, quando ele basta sozinho, os documentos finais."""
+        if modo != "hibrido":
+            return [], None
+        lexicos, cobertura = self.lexico.buscar(consulta, n)
+        if lexicos and cobertura[lexicos[0][0]] == 1.0 and (
+                len(lexicos) == 1 or lexicos[0][1] >= LEXICAL_FAST_PATH_RATIO * lexicos[1][1]):
+            return lexicos, self._documentos(vector_store, [chunk_id for chunk_id, _ in lexicos[:k]])
+        return lexicos, None
+
+    def _combinar(self, vector_store: FAISS, vetor: np.ndarray, lexicos: List[Tuple[str, float]], k: int,
+                  n: int, lambda_mult: float, tipo_busca: str, limiar: Optional[float]) -> List[Document]:
+        """Busca vetorial, fusão com o ranking léxico, limiar e MMR."""
+        vetoriais = self._busca_vetorial(vector_store, vetor, n)
+
+        if lexicos:
+            pontuacoes: Dict[str, float] = defaultdict(float)
+            for ranking in (lexicos, vetoriais):
+                for posicao, (chunk_id, _) in enumerate(ranking):
+                    pontuacoes[chunk_id] += 1.0 / (HYBRID_RRF_K + posicao + 1)
+            ids = sorted(pontuacoes, key=pontuacoes.get, reverse=True)[:n]
+        else:
+            ids = [chunk_id for chunk_id, _ in vetoriais]
+
+        # Chunks removidos entre a busca léxica e a vetorial ficam de fora
+        ids = [chunk_id for chunk_id in ids if isinstance(vector_store.docstore.search(chunk_id), Document)]
+
+        if ids and (tipo_busca == "mmr" or limiar is not None):
+            candidatos = self._vetores_armazenados(vector_store, ids)
+            if limiar is not None:
+                normas = np.linalg.norm(candidatos, axis=1) * (np.linalg.norm(vetor) or 1)
+                relevancia = (candidatos @ vetor) / np.where(normas == 0, 1, normas)
+                manter = np.flatnonzero(relevancia >= limiar)
+                ids = [ids[i] for i in manter]
+                candidatos = candidatos[manter]
+            if tipo_busca == "mmr":
+                ids = [ids[i] for i in selecionar_mmr(vetor, candidatos, k, lambda_mult)]
+
+        return self._documentos(vector_store, ids[:k])
+
+    @staticmethod
+    def _documentos(vector_store: FAISS, ids: List[str]) -> List[Document]:
+        documentos = [vector_store.docstore.search(chunk_id) for chunk_id in ids]
+        return [doc for doc in documentos if isinstance(doc, Document)]
+
     def get_retriever(self):
         """Retorna o retriever configurado para uso."""
         if not self.vector_store:
             self.carregar_ou_criar_indice()
-            
-        return self.vector_store.as_retriever(
-            search_kwargs={
-                "k": RETRIEVER_K,
-                "fetch_k": RETRIEVER_FETCH_K,
-                "lambda_mult": RETRIEVER_LAMBDA_MULT
-            }
-        )
-    
-    def atualizar_indice(self):
-        """Força a atualização do índice vetorial."""
-        # Remover o índice existente
-        if os.path.exists(VECTOR_STORE_PATH):
-            import shutil
-            shutil.rmtree(VECTOR_STORE_PATH)
-        
-        # Recriar o índice
-        self.vector_store = self._criar_novo_indice()
-        return self.vector_store
\ No newline at end of file
+
+        return RetrieverIndice(servico=self)
+
+    def atualizar_indice(self, completo: bool = False):
+        """
+        Atualiza o índice vetorial de forma incremental.
+
+        Apenas arquivos novos ou alterados passam pelo modelo de embeddings; os vetores
+        de arquivos removidos são excluídos. Com completo=True, o índice é recriado do zero.
+        """
+        with self._lock_atualizacao:
+            return self._atualizar_indice(completo)
+
+    def _atualizar_indice(self, completo: bool):
+        manifesto = self._carregar_manifesto()
+        if not completo and manifesto and not self._indice_compativel(manifesto):
+            completo = True
+        if not completo and not self.vector_store and manifesto:
+            self.carregar_ou_criar_indice()
+
+        if completo or not manifesto or not self.vector_store:
+            return self._recriar()
+
+        with PerformanceTimer("Atualização incremental do índice"):
+            plano = self._planejar_atualizacao(manifesto)
+            if plano is None:
+                return self.vector_store
+
+            # A versão em uso nunca é alterada: outros processos podem tê-la mapeada
+            sombra = self._sombra(self._nova_versao())
+            self._copiar_versao(self.caminho, sombra.caminho)
+            sombra.vector_store = sombra._carregar(mmap=False)
+            sombra._aplicar_alteracoes(sombra._carregar_manifesto(), plano)
+            print("Nova versão do índice vetorial em uso")
+            return self._publicar(sombra)
+
+    def _recriar(self) -> FAISS:
+        """
+        Constrói o índice do zero em uma nova versão, publicada apenas quando completa.
+
+        O ponteiro de construção permite retomar uma construção interrompida a partir do
+        último checkpoint.
+        """
+        caminho = self._versao_em_construcao()
+        sombra = self._sombra(caminho) if caminho else None
+        manifesto = sombra._carregar_manifesto() if sombra else {}
+        retomar = bool(manifesto) and os.path.exists(os.path.join(caminho, "index.faiss")) \
+            and sombra._indice_compativel(manifesto)
+        if not retomar:
+            # Uma construção que não pode ser retomada é descartada, nunca reaproveitada
+            sombra = self._sombra(self._nova_versao())
+        self._gravar_ponteiro(INDEX_BUILD_FILENAME, sombra.caminho)
+
+        if retomar:
+            sombra.vector_store = sombra._carregar(mmap=False)
+            if not sombra.lexico.existe():
+                sombra._reconstruir_lexico()
+            plano = sombra._planejar_atualizacao(manifesto)
+            if plano is not None:
+                sombra._aplicar_alteracoes(manifesto, plano)
+            else:
+                sombra._liberar_escrita()
+        else:
+            sombra.vector_store = sombra._criar_novo_indice()
+        return self._publicar(sombra)
+
+    def _planejar_atualizacao(self, manifesto: Dict[str, Any]) -> Optional[Dict[str, List[str]]]:
+        """Compara o acervo com o manifesto; retorna None se o índice já está em dia."""
+        indexados = manifesto.get("arquivos", {})
+        arquivos = self._listar_arquivos()
+
+        removidos = [rel for rel in indexados if rel not in arquivos]
+        pendentes = {}
+        for relativo, caminho in arquivos.items():
+            entrada = indexados.get(relativo)
+            if entrada is None or entrada["hash"] != self._hash_arquivo(caminho):
+                pendentes[relativo] = caminho
+        alterados = [rel for rel in pendentes if rel in indexados]
+
+        # Chunks de arquivos que não chegaram ao manifesto (checkpoint no meio de um arquivo)
+        referenciados = {chunk_id for entrada in indexados.values() for chunk_id in entrada["chunks"]}
+        orfaos = [chunk_id for chunk_id in self.vector_store.index_to_docstore_id.values()
+                  if chunk_id not in referenciados]
+
+        if not (removidos or pendentes or orfaos) and manifesto.get("completo", True):
+            return None
+        print(f"Arquivos novos: {len(pendentes) - len(alterados)}, "
+              f"alterados: {len(alterados)}, removidos: {len(removidos)}")
+        return {"removidos": removidos, "alterados": alterados, "pendentes": pendentes, "orfaos": orfaos}
+
+    def _aplicar_alteracoes(self, manifesto: Dict[str, Any], plano: Dict[str, Any]):
+        """Aplica o plano de atualização no índice desta versão e o salva."""
+        indexados = manifesto.setdefault("arquivos", {})
+
+        # Excluir vetores de arquivos removidos ou que serão reindexados
+        ids_obsoletos = list(plano["orfaos"])
+        for relativo in plano["removidos"] + plano["alterados"]:
+            ids_obsoletos.extend(indexados.pop(relativo)["chunks"])
+
+        self._preparar_escrita()
+        if ids_obsoletos:
+            self._excluir_vetores(ids_obsoletos)
+            self.lexico.remover(ids_obsoletos)
+
+        manifesto["completo"] = False
+        self._indexar_arquivos(plano["pendentes"], manifesto)
+        manifesto["completo"] = True
+        self._salvar(manifesto)
+        self._liberar_escrita()
+
+    def atualizar_em_paralelo(self):
+        """
+        Aplica uma atualização incremental sem interromper as consultas em andamento.
+
+        Toda alteração é feita em uma nova versão do índice, construída em um diretório próprio
+        a partir de uma cópia da versão em disco, e só então publicada, tanto em disco quanto
+        em memória.
+        """
+        with self._lock_atualizacao:
+            if not self.vector_store:
+                return self.carregar_ou_criar_indice()
+            return self._atualizar_indice(completo=False)